@@ -0,0 +1,62 @@
+"""
+Compares archiving many rows through ORM objects with the va_bulk_insert and
+va_bulk_update_mappings APIs.
+
+    $ python -m benchmarks.bulk [database url]
+"""
+import sys
+
+from benchmarks.common import StatementCounter, make_session, print_table, timer
+from benchmarks.flush import Base, Item, ItemArchive
+
+ROW_COUNTS = (1000, 10000)
+
+
+def bench_orm(url, n):
+    engine, session = make_session(Base, [(Item, ItemArchive)], url=url)
+    times = {}
+    items = [Item(id=i, name='item{}'.format(i), value=i) for i in range(n)]
+    with StatementCounter(engine) as inserts, timer(times, 'insert'):
+        session.add_all(items)
+        session.flush()
+    with StatementCounter(engine) as updates, timer(times, 'update'):
+        for item in items:
+            item.value += 1
+        session.flush()
+    session.close()
+    engine.dispose()
+    return times, inserts.count, updates.count
+
+
+def bench_bulk(url, n):
+    engine, session = make_session(Base, [(Item, ItemArchive)], url=url)
+    times = {}
+    with StatementCounter(engine) as inserts, timer(times, 'insert'):
+        Item.va_bulk_insert(
+            session, [{'id': i, 'name': 'item{}'.format(i), 'value': i} for i in range(n)]
+        )
+    with StatementCounter(engine) as updates, timer(times, 'update'):
+        Item.va_bulk_update_mappings(session, [{'id': i, 'value': i + 1} for i in range(n)])
+    session.close()
+    engine.dispose()
+    return times, inserts.count, updates.count
+
+
+def run(url):
+    rows = []
+    for n in ROW_COUNTS:
+        for name, bench in (('orm', bench_orm), ('bulk', bench_bulk)):
+            times, insert_count, update_count = bench(url, n)
+            rows.append((
+                name,
+                n,
+                '{:.3f}'.format(times['insert']),
+                insert_count,
+                '{:.3f}'.format(times['update']),
+                update_count,
+            ))
+    print_table(('api', 'rows', 'insert s', 'insert stmts', 'update s', 'update stmts'), rows)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
@@ -0,0 +1,57 @@
+"""
+Compares the encode and decode throughput of the JSON codecs on archive rows shaped like a
+typical va_data blob.
+
+    $ python -m benchmarks.codec
+"""
+from datetime import datetime, timedelta
+
+from benchmarks.common import print_table, timer
+from versionalchemy import utils
+
+ROW_COUNT = 20000
+
+
+def make_rows(n):
+    start = datetime(2020, 1, 1, 12, 30)
+    return [
+        {
+            'id': i,
+            'account_id': 1000 + i % 97,
+            'name': u'product \u2603 {}'.format(i),
+            'description': 'lorem ipsum dolor sit amet ' * 4,
+            'price': i * 1.25,
+            'quantity': i % 13,
+            'active': bool(i % 2),
+            'deleted_at': None,
+            'created_at': start + timedelta(minutes=i),
+            'updated_at': start + timedelta(minutes=i, seconds=30),
+            'tags': ['tag{}'.format(j) for j in range(i % 5)],
+            'attributes': {'color': 'red', 'size': i % 7, 'weight': 0.5},
+        }
+        for i in range(n)
+    ]
+
+
+def run():
+    rows = make_rows(ROW_COUNT)
+    results = []
+    for codec in (utils.SimpleJSONCodec(), utils.OrjsonCodec()):
+        times = {}
+        with timer(times, 'encode'):
+            encoded = [codec.dumps(row) for row in rows]
+        with timer(times, 'decode'):
+            for value in encoded:
+                codec.loads(value)
+        fast_path = codec.name != 'orjson' or utils.orjson is not None
+        results.append((
+            codec.name if fast_path else codec.name + ' (fallback)',
+            ROW_COUNT,
+            '{:.0f}'.format(ROW_COUNT / times['encode']),
+            '{:.0f}'.format(ROW_COUNT / times['decode']),
+        ))
+    print_table(('codec', 'rows', 'encode rows/s', 'decode rows/s'), results)
+
+
+if __name__ == '__main__':
+    run()
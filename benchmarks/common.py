@@ -0,0 +1,65 @@
+"""
+Helpers shared by the benchmark scripts in this directory. Run a benchmark from the root of
+the repository, e.g. ``python -m benchmarks.flush``.
+"""
+import time
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+
+import versionalchemy as va
+
+
+def make_session(Base, tables, url='sqlite://'):
+    """
+    :param Base: the declarative base holding the benchmark models
+    :param tables: a list of (user table model, archive table model) pairs to register
+    :param url: the database url to benchmark against
+
+    :return: an engine and a session bound to a freshly created schema
+    """
+    engine = sa.create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    va.init()
+    for UserTable, ArchiveTable in tables:
+        UserTable.register(ArchiveTable, engine)
+    return engine, sessionmaker(bind=engine)()
+
+
+class StatementCounter(object):
+    """
+    Counts the round trips made to the database while active; an executemany counts once.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        sa.event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        sa.event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+@contextmanager
+def timer(results, name):
+    start = time.time()
+    yield
+    results[name] = time.time() - start
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(x)) for x in col) for col in zip(headers, *rows)]
+    fmt = ' | '.join('{:>%d}' % w for w in widths)
+    print(fmt.format(*headers))
+    print('-+-'.join('-' * w for w in widths))
+    for row in rows:
+        print(fmt.format(*row))
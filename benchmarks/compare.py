@@ -0,0 +1,86 @@
+"""
+Measures utils.compare_dicts on the data of consecutive versions of 50 column rows, as
+va_diff_all_by_pk calls it once per version, against the set based comparison it used to do.
+
+    $ python -m benchmarks.compare
+"""
+from benchmarks.common import print_table, timer
+from versionalchemy import utils
+
+COLUMN_COUNT = 50
+VERSION_COUNT = 20000
+
+
+def set_compare_dicts(old_d, new_d):
+    if not old_d:
+        old_d = {}
+        for key in new_d.keys():
+            old_d[key] = None
+
+    changed_values_set = set.symmetric_difference(set(old_d.items()), set(new_d.items()))
+    changes = {}
+    for pair in list(changed_values_set):
+        if pair[0] not in changes:
+            changes[pair[0]] = {}
+        if pair[0] in new_d:
+            if pair[0] in old_d:
+                prev_or_this = 'this' if pair in new_d.items() else "prev"
+                changes[pair[0]][prev_or_this] = pair[1]
+            else:
+                changes[pair[0]]['prev'] = None
+                changes[pair[0]]['this'] = pair[1]
+        elif pair[0] in old_d:
+            changes[pair[0]]['prev'] = pair[1]
+            changes[pair[0]]['this'] = None
+    return changes
+
+
+def make_versions(changed, json_values):
+    """
+    Returns the data of VERSION_COUNT versions of a row, each changing `changed` columns.
+    """
+    data = {
+        'col{}'.format(j): 'value{}'.format(j) if j % 2 else j for j in range(COLUMN_COUNT)
+    }
+    if json_values:
+        data.update(tags=['a', 'b'], meta={'x': 1})
+    versions = []
+    for version in range(VERSION_COUNT):
+        data = dict(data)
+        for j in range(changed):
+            data['col{}'.format((version + j) % COLUMN_COUNT)] = version
+        versions.append(data)
+    return versions
+
+
+def bench(changed, json_values):
+    versions = make_versions(changed, json_values)
+    pairs = list(zip([None] + versions[:-1], versions))
+    times = {}
+    with timer(times, 'key-wise'):
+        actual = [utils.compare_dicts(old, new) for old, new in pairs]
+    try:
+        with timer(times, 'set'):
+            expected = [set_compare_dicts(old, new) for old, new in pairs]
+    except TypeError:
+        set_ms = 'TypeError'
+    else:
+        assert actual == expected
+        set_ms = '{:.1f}'.format(1000 * times['set'])
+    return (
+        changed,
+        'yes' if json_values else 'no',
+        set_ms,
+        '{:.1f}'.format(1000 * times['key-wise']),
+    )
+
+
+def run():
+    print_table(
+        ('changed columns', 'list/dict values', 'set ms', 'key-wise ms'),
+        [bench(1, False), bench(10, False), bench(1, True)],
+    )
+
+
+if __name__ == '__main__':
+    run()
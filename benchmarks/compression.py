@@ -0,0 +1,64 @@
+"""
+Compares the bytes stored and the CPU time spent per row by the plain and compressed JSON
+column types, on rows shaped like a typical va_data blob and on 50 column rows.
+
+    $ python -m benchmarks.compression
+"""
+from benchmarks.codec import make_rows
+from benchmarks.common import print_table, timer
+from versionalchemy import utils
+
+ROW_COUNT = 10000
+
+
+def make_wide_rows(n):
+    return [
+        dict(
+            {'col{}'.format(j): 'value{}'.format(j) if j % 2 else i * j for j in range(48)},
+            id=i,
+        )
+        for i in range(n)
+    ]
+
+
+def data_types():
+    yield 'plain', utils.JSONEncodedDict()
+    for level in (1, 6):
+        yield 'zlib {}'.format(level), utils.CompressedJSONEncodedDict(level=level)
+    if utils.zstandard is not None:
+        for level in (1, 3):
+            yield 'zstd {}'.format(level), utils.CompressedJSONEncodedDict(
+                compression='zstd', level=level
+            )
+
+
+def run():
+    results = []
+    datasets = (('typical', make_rows(ROW_COUNT)), ('50 columns', make_wide_rows(ROW_COUNT)))
+    for rows_name, rows in datasets:
+        plain_size = None
+        for name, data_type in data_types():
+            times = {}
+            with timer(times, 'encode'):
+                encoded = [data_type.process_bind_param(row, None) for row in rows]
+            with timer(times, 'decode'):
+                for value in encoded:
+                    data_type.process_result_value(value, None)
+            size = sum(len(value) for value in encoded)
+            plain_size = plain_size or size
+            results.append((
+                rows_name,
+                name,
+                size // ROW_COUNT,
+                '{:.0%}'.format(float(size) / plain_size),
+                '{:.1f}'.format(1e6 * times['encode'] / ROW_COUNT),
+                '{:.1f}'.format(1e6 * times['decode'] / ROW_COUNT),
+            ))
+    print_table(
+        ('rows', 'type', 'bytes/row', 'size', 'encode us/row', 'decode us/row'),
+        results,
+    )
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,67 @@
+"""
+Measures the archive size of delta encoded storage against full snapshots, and what rebuilding
+full rows costs when reading history, on a 50 column model where each update changes one column.
+
+    $ python -m benchmarks.delta [database url]
+"""
+import sys
+
+import sqlalchemy as sa
+from sqlalchemy import func
+
+from benchmarks.common import make_session, print_table, timer
+from benchmarks.to_dict import COLUMN_COUNT, Base, Wide, WideArchive
+from versionalchemy.api.data import get
+
+ROW_COUNT = 100
+UPDATE_COUNT = 50
+INTERVALS = (None, 10, 50)
+
+
+def bench(url, interval):
+    WideArchive.va_keyframe_interval = interval
+    engine, session = make_session(Base, [(Wide, WideArchive)], url=url)
+    times = {}
+    rows = [
+        Wide(id=i, **{
+            'col{}'.format(j): 'value{}'.format(j) if j % 2 else j
+            for j in range(COLUMN_COUNT - 3)
+        })
+        for i in range(ROW_COUNT)
+    ]
+    session.add_all(rows)
+    session.commit()
+    with timer(times, 'write'):
+        for version in range(1, UPDATE_COUNT):
+            for row in rows:
+                setattr(row, 'col{}'.format(version % (COLUMN_COUNT - 3)), version)
+            session.commit()
+    size = session.execute(sa.select([func.sum(func.length(WideArchive.va_data))])).scalar()
+
+    with timer(times, 'history'):
+        for row in rows:
+            Wide.va_get_all_by_pk(session, id=row.id)
+    with timer(times, 'page'):
+        get(Wide, session, t1=0, t2='3000-01-01', page=40, page_size=100)
+    session.close()
+    engine.dispose()
+    WideArchive.va_keyframe_interval = None
+    return (
+        interval or 'full',
+        ROW_COUNT * UPDATE_COUNT,
+        size,
+        '{:.3f}'.format(times['write']),
+        '{:.3f}'.format(times['history']),
+        '{:.1f}'.format(1000 * times['page']),
+    )
+
+
+def run(url):
+    print_table(
+        ('keyframes', 'versions', 'va_data bytes', 'write s', 'all histories s', 'page ms'),
+        [bench(url, interval) for interval in INTERVALS],
+    )
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
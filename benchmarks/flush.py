@@ -0,0 +1,77 @@
+"""
+Measures how archive writes scale with the number of rows touched by a single flush.
+
+    $ python -m benchmarks.flush [database url]
+"""
+import sys
+
+from sqlalchemy import Column, Integer, String, UniqueConstraint
+from sqlalchemy.ext.declarative import declarative_base
+
+from benchmarks.common import StatementCounter, make_session, print_table, timer
+from versionalchemy.models import (
+    VERSION_MODE_MAX,
+    VERSION_MODE_POINTER,
+    VALogMixin,
+    VAModelMixin,
+)
+
+Base = declarative_base()
+
+FLUSH_SIZES = (10, 100, 1000, 5000)
+
+
+class Item(VAModelMixin, Base):
+    __tablename__ = 'bench_flush_item'
+    va_version_columns = ['id']
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+    value = Column(Integer)
+
+
+class ItemArchive(VALogMixin, Base):
+    __tablename__ = 'bench_flush_item_archive'
+    id = Column(Integer)
+    user_id = Column(Integer)
+    __table_args__ = (
+        UniqueConstraint('id', 'va_version'),
+    )
+
+
+def run(url):
+    rows = []
+    for mode in (VERSION_MODE_MAX, VERSION_MODE_POINTER):
+        Item.va_version_mode = mode
+        for n in FLUSH_SIZES:
+            rows.append((mode,) + bench(url, n))
+    print_table(
+        ('mode', 'rows', 'insert s', 'insert stmts', 'update s', 'update stmts', 'us/row'),
+        rows,
+    )
+
+
+def bench(url, n):
+    engine, session = make_session(Base, [(Item, ItemArchive)], url=url)
+    times = {}
+    items = [Item(id=i, name='item{}'.format(i), value=i) for i in range(n)]
+    session.add_all(items)
+    with StatementCounter(engine) as inserts, timer(times, 'insert'):
+        session.flush()
+    for item in items:
+        item.value += 1
+    with StatementCounter(engine) as updates, timer(times, 'update'):
+        session.flush()
+    session.close()
+    engine.dispose()
+    return (
+        n,
+        '{:.3f}'.format(times['insert']),
+        inserts.count,
+        '{:.3f}'.format(times['update']),
+        updates.count,
+        '{:.1f}'.format(1e6 * (times['insert'] + times['update']) / (2 * n)),
+    )
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
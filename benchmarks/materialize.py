@@ -0,0 +1,103 @@
+"""
+Compares copying a 50 column table as of a past time into another table by paging through
+api.data.get(t1=...) with materialize_as_of, which extracts the columns in SQL, with va_data
+stored as JSON text and as native JSON.
+
+    $ python -m benchmarks.materialize [database url]
+"""
+import sys
+import time
+from datetime import datetime
+
+import arrow
+import sqlalchemy as sa
+
+from benchmarks.common import StatementCounter, make_session, print_table, timer
+from benchmarks.projection import WideNativeArchive
+from benchmarks.to_dict import COLUMN_COUNT, Base, Wide, WideArchive
+from versionalchemy.api.data import _get_materialized_table, get, materialize_as_of
+
+ROW_COUNT = 5000
+VERSION_COUNT = 3
+PAGE_SIZE = 1000
+
+
+def setup(url, ArchiveTable):
+    engine, session = make_session(Base, [(Wide, ArchiveTable)], url=url)
+    Wide.va_bulk_insert(session, [
+        dict({
+            'col{}'.format(j): 'value{}'.format(j) if j % 2 else j
+            for j in range(COLUMN_COUNT - 3)
+        }, id=i, updated_at=datetime(2020, 1, 1))
+        for i in range(ROW_COUNT)
+    ])
+    session.commit()
+    t = None
+    for version in range(1, VERSION_COUNT):
+        if version == VERSION_COUNT - 1:
+            time.sleep(0.01)
+            t = datetime.now()
+            time.sleep(0.01)
+        Wide.va_bulk_update_mappings(session, [
+            {'id': i, 'col0': version} for i in range(ROW_COUNT)
+        ])
+        session.commit()
+    return engine, session, t
+
+
+def bench_get(url, ArchiveTable):
+    engine, session, t = setup(url, ArchiveTable)
+    target = _get_materialized_table(Wide, 'bench_wide_as_of')
+    target.create(session.connection())
+    times = {}
+    with StatementCounter(engine) as statements, timer(times, 'copy'):
+        cursor = None
+        while True:
+            page = get(Wide, session, t1=t, page_size=PAGE_SIZE, cursor=cursor)
+            if page:
+                session.execute(target.insert(), [
+                    dict(
+                        {k: v for k, v in row['va_data'].items() if k in target.c},
+                        updated_at=arrow.get(row['va_data']['updated_at']).datetime,
+                    )
+                    for row in page
+                ])
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        session.commit()
+    copied = session.execute(sa.select([sa.func.count()]).select_from(target)).scalar()
+    session.close()
+    engine.dispose()
+    return times, statements.count, copied
+
+
+def bench_materialize(url, ArchiveTable):
+    engine, session, t = setup(url, ArchiveTable)
+    times = {}
+    with StatementCounter(engine) as statements, timer(times, 'copy'):
+        target = materialize_as_of(Wide, session, t, 'bench_wide_as_of')
+        session.commit()
+    copied = session.execute(sa.select([sa.func.count()]).select_from(target)).scalar()
+    session.close()
+    engine.dispose()
+    return times, statements.count, copied
+
+
+def run(url):
+    rows = []
+    for ArchiveTable in (WideArchive, WideNativeArchive):
+        for name, bench in (('get', bench_get), ('materialize_as_of', bench_materialize)):
+            times, statement_count, copied = bench(url, ArchiveTable)
+            rows.append((
+                'native' if ArchiveTable is WideNativeArchive else 'text',
+                name,
+                copied,
+                statement_count,
+                '{:.1f}'.format(1000 * times['copy']),
+            ))
+    print_table(('va_data', 'api', 'rows', 'statements', 'ms'), rows)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
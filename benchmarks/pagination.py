@@ -0,0 +1,66 @@
+"""
+Compares reading deep pages of api.data.get with page (OFFSET) and with cursor (keyset)
+pagination.
+
+    $ python -m benchmarks.pagination [database url]
+"""
+import sys
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from benchmarks.common import make_session, print_table, timer
+from benchmarks.flush import Base, Item, ItemArchive
+from versionalchemy.api import data
+
+ITEM_COUNT = 4000
+VERSION_COUNT = 50
+PAGE_SIZE = 100
+PAGES = (1, 100, 1000, 1999)
+
+
+def run(url):
+    engine, session = make_session(Base, [(Item, ItemArchive)], url=url)
+    now = datetime.now()
+    for item_id in range(ITEM_COUNT):
+        session.execute(sa.insert(ItemArchive), [
+            {
+                'id': item_id,
+                'va_version': version,
+                'va_deleted': False,
+                'va_updated_at': now,
+                'va_data': {'id': item_id, 'name': 'item', 'value': version},
+            }
+            for version in range(VERSION_COUNT)
+        ])
+    session.commit()
+
+    results = []
+    for page in PAGES:
+        times = {}
+        with timer(times, 'offset'):
+            by_offset = data.get(
+                Item, session, t1=0, t2='3000-01-01', page=page, page_size=PAGE_SIZE
+            )
+        # The cursor of the previous page points at the last row it read
+        last = (page - 1) * PAGE_SIZE - 1
+        cursor = None if last < 0 else data._encode_cursor(
+            Item, {'id': last // VERSION_COUNT, 'va_version': last % VERSION_COUNT}
+        )
+        with timer(times, 'cursor'):
+            by_cursor = data.get(
+                Item, session, t1=0, t2='3000-01-01', page_size=PAGE_SIZE, cursor=cursor
+            )
+        assert by_offset == by_cursor
+        results.append((
+            page,
+            '{:.1f}'.format(1000 * times['offset']),
+            '{:.1f}'.format(1000 * times['cursor']),
+        ))
+    session.close()
+    engine.dispose()
+    print_table(('page', 'offset ms', 'cursor ms'), results)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
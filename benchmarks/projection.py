@@ -0,0 +1,99 @@
+"""
+Measures api.data.get(fields=[...]) on 50 column rows, with va_data stored as JSON text and as
+native JSON, where the requested fields are extracted in SQL.
+
+    $ python -m benchmarks.projection [database url]
+"""
+import sys
+
+import sqlalchemy as sa
+from sqlalchemy import Column, Integer, UniqueConstraint
+
+from benchmarks.common import make_session, print_table, timer
+from benchmarks.to_dict import COLUMN_COUNT, Base, Wide, WideArchive
+from versionalchemy import utils
+from versionalchemy.api.data import get
+from versionalchemy.models import VALogMixin
+
+ROW_COUNT = 2000
+FIELDS = ['col1', 'col2']
+
+
+class WideNativeArchive(VALogMixin, Base):
+    __tablename__ = 'bench_wide_native_archive'
+    va_data_type = utils.NativeJSONDict
+    id = Column(Integer)
+    user_id = Column(Integer)
+    __table_args__ = (
+        UniqueConstraint('id', 'va_version'),
+    )
+
+
+class ResultSize(object):
+    """
+    Re-runs the statements executed while active on a raw cursor and adds up the size of the
+    values they return.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.bytes = 0
+        self._statements = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._statements.append((statement, parameters))
+
+    def __enter__(self):
+        sa.event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        sa.event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+        conn = self.engine.raw_connection()
+        try:
+            for statement, parameters in self._statements:
+                cursor = conn.cursor()
+                cursor.execute(statement, parameters)
+                for row in cursor.fetchall():
+                    self.bytes += sum(
+                        len(v) if isinstance(v, (str, bytes)) else 8 for v in row if v is not None
+                    )
+        finally:
+            conn.close()
+
+
+def bench(url, ArchiveTable, fields):
+    engine, session = make_session(Base, [(Wide, ArchiveTable)], url=url)
+    session.add_all([
+        Wide(id=i, **{
+            'col{}'.format(j): 'value{}'.format(j) if j % 2 else j
+            for j in range(COLUMN_COUNT - 3)
+        })
+        for i in range(ROW_COUNT)
+    ])
+    session.commit()
+    times = {}
+    with ResultSize(engine) as size, timer(times, 'get'):
+        rows = get(Wide, session, t1=0, t2='3000-01-01', fields=fields, page_size=ROW_COUNT)
+    assert len(rows) == ROW_COUNT
+    session.close()
+    engine.dispose()
+    return (
+        'native' if ArchiveTable is WideNativeArchive else 'text',
+        len(fields) if fields else 'all',
+        size.bytes // ROW_COUNT,
+        '{:.1f}'.format(1000 * times['get']),
+    )
+
+
+def run(url):
+    print_table(('va_data', 'fields', 'bytes/row', 'ms'), [
+        bench(url, WideArchive, None),
+        bench(url, WideArchive, FIELDS),
+        bench(url, WideNativeArchive, None),
+        bench(url, WideNativeArchive, FIELDS),
+    ])
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
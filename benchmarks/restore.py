@@ -0,0 +1,76 @@
+"""
+Compares restoring many rows to an earlier point in time with one va_restore call per row and
+with va_bulk_restore.
+
+    $ python -m benchmarks.restore [database url]
+"""
+import sys
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from benchmarks.common import StatementCounter, make_session, print_table, timer
+from benchmarks.flush import Base, Item, ItemArchive
+
+ROW_COUNTS = (1000, 5000)
+
+
+def setup(url, n):
+    engine, session = make_session(Base, [(Item, ItemArchive)], url=url)
+    Item.va_bulk_insert(
+        session, [{'id': i, 'name': 'item{}'.format(i), 'value': i} for i in range(n)]
+    )
+    session.commit()
+    time.sleep(0.01)
+    t = datetime.now()
+    time.sleep(0.01)
+    Item.va_bulk_update_mappings(session, [{'id': i, 'value': -i} for i in range(n)])
+    session.commit()
+    return engine, session, t
+
+
+def bench_per_row(url, n):
+    engine, session, t = setup(url, n)
+    va_ids = [va_id for va_id, in session.execute(
+        sa.select([ItemArchive.va_id]).where(ItemArchive.va_updated_at <= t)
+    )]
+    times = {}
+    with StatementCounter(engine) as statements, timer(times, 'restore'):
+        for va_id in va_ids:
+            Item.va_restore(session, va_id=va_id)
+    restored = session.query(Item).filter(Item.value >= 0).count()
+    session.close()
+    engine.dispose()
+    return times, statements.count, restored
+
+
+def bench_bulk(url, n):
+    engine, session, t = setup(url, n)
+    times = {}
+    with StatementCounter(engine) as statements, timer(times, 'restore'):
+        Item.va_bulk_restore(session, t)
+        session.commit()
+    restored = session.query(Item).filter(Item.value >= 0).count()
+    session.close()
+    engine.dispose()
+    return times, statements.count, restored
+
+
+def run(url):
+    rows = []
+    for n in ROW_COUNTS:
+        for name, bench in (('va_restore', bench_per_row), ('va_bulk_restore', bench_bulk)):
+            times, statement_count, restored = bench(url, n)
+            rows.append((
+                n,
+                name,
+                restored,
+                statement_count,
+                '{:.1f}'.format(1000 * times['restore']),
+            ))
+    print_table(('rows', 'api', 'rows restored', 'statements', 'ms'), rows)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
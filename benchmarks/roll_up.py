@@ -0,0 +1,64 @@
+"""
+Measures api.data.get over long histories of 50 column rows which it mostly rolls up: with a
+narrow fields list while other columns change, and with versions whose data did not change
+at all (e.g. only an ignored column was updated).
+
+    $ python -m benchmarks.roll_up [database url]
+"""
+import sys
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from benchmarks.common import make_session, print_table, timer
+from benchmarks.to_dict import COLUMN_COUNT, Base, Wide, WideArchive
+from versionalchemy.api.data import get
+
+KEY_COUNT = 20
+VERSION_COUNT = 250
+FIELDS = ['col1', 'col2']
+
+
+def bench(url, changed):
+    engine, session = make_session(Base, [(Wide, WideArchive)], url=url)
+    data = {'col{}'.format(j): 'value{}'.format(j) if j % 2 else j for j in range(COLUMN_COUNT - 3)}
+    now = datetime.now()
+    for key in range(KEY_COUNT):
+        session.execute(sa.insert(WideArchive), [
+            {
+                'id': key,
+                'va_version': version,
+                'va_deleted': False,
+                'va_updated_at': now,
+                'va_data': dict(data, id=key, col3=version if changed else 3),
+            }
+            for version in range(VERSION_COUNT)
+        ])
+    session.commit()
+
+    results = []
+    for fields in (None, FIELDS):
+        times = {}
+        with timer(times, 'get'):
+            rows = get(Wide, session, t1=0, t2='3000-01-01', fields=fields,
+                       page_size=KEY_COUNT * VERSION_COUNT)
+        results.append((
+            'changed' if changed else 'unchanged',
+            len(fields) if fields else 'all',
+            len(rows),
+            '{:.1f}'.format(1000 * times['get']),
+        ))
+    session.close()
+    engine.dispose()
+    return results
+
+
+def run(url):
+    print_table(
+        ('other columns', 'fields', 'rows returned', 'ms'),
+        bench(url, True) + bench(url, False),
+    )
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
@@ -0,0 +1,68 @@
+"""
+Compares the queries api.data.get can use for historical time slices, over keys with hundreds
+of versions each.
+
+    $ python -m benchmarks.time_slice [database url]
+"""
+import sys
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from benchmarks.common import make_session, print_table, timer
+from benchmarks.flush import Base, Item, ItemArchive
+from versionalchemy import utils
+from versionalchemy.api import data
+
+ITEM_COUNT = 200
+VERSION_COUNTS = (10, 100, 500)
+STRATEGIES = (data.TIME_SLICE_JOIN, data.TIME_SLICE_MAX, data.TIME_SLICE_WINDOW)
+
+
+def run(url):
+    results = []
+    for version_count in VERSION_COUNTS:
+        engine, session = make_session(Base, [(Item, ItemArchive)], url=url)
+        start = datetime(2020, 1, 1)
+        for item_id in range(ITEM_COUNT):
+            session.execute(sa.insert(ItemArchive), [
+                {
+                    'id': item_id,
+                    'va_version': version,
+                    'va_deleted': False,
+                    'va_updated_at': start + timedelta(seconds=version),
+                    'va_data': {'id': item_id, 'name': 'item', 'value': version},
+                }
+                for version in range(version_count)
+            ])
+        session.commit()
+
+        # The time slice in the middle of every key's history
+        t = start + timedelta(seconds=version_count // 2)
+        times = {}
+        slices = []
+        for strategy in STRATEGIES:
+            if strategy == data.TIME_SLICE_WINDOW and \
+                    not utils.supports_window_functions(utils.get_dialect(session)):
+                continue
+            query = data._get_historical_time_slice(
+                Item, session, t, None, True, strategy=strategy
+            )
+            with timer(times, strategy):
+                slices.append(utils.result_to_dict(session.execute(query)))
+        assert all(len(rows) == ITEM_COUNT for rows in slices)
+        assert all(rows == slices[0] for rows in slices)
+        results.append((version_count,) + tuple(
+            '{:.1f}'.format(1000 * times[strategy]) if strategy in times else '-'
+            for strategy in STRATEGIES
+        ))
+        session.close()
+        engine.dispose()
+    print_table(
+        ('versions per key',) + tuple('{} ms'.format(strategy) for strategy in STRATEGIES),
+        results,
+    )
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
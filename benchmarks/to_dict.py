@@ -0,0 +1,89 @@
+"""
+Measures serializing rows of a 50 column model into archive data with VAModelMixin._to_dict,
+against resolving every column with utils.get_column_attribute like it used to.
+
+    $ python -m benchmarks.to_dict [database url]
+"""
+import sys
+
+from sqlalchemy import Column, DateTime, Integer, String, UniqueConstraint
+from sqlalchemy.ext.declarative import declarative_base
+
+from benchmarks.common import make_session, print_table, timer
+from versionalchemy import utils
+from versionalchemy.models import VALogMixin, VAModelMixin
+
+Base = declarative_base()
+
+COLUMN_COUNT = 50
+ROW_COUNT = 2000
+
+
+Wide = type('Wide', (VAModelMixin, Base), dict(
+    {
+        'col{}'.format(i): Column(String(50) if i % 2 else Integer)
+        for i in range(COLUMN_COUNT - 3)
+    },
+    __tablename__='bench_wide',
+    va_version_columns=['id'],
+    id=Column(Integer, primary_key=True),
+    updated_at=Column(DateTime),
+))
+
+
+class WideArchive(VALogMixin, Base):
+    __tablename__ = 'bench_wide_archive'
+    id = Column(Integer)
+    user_id = Column(Integer)
+    __table_args__ = (
+        UniqueConstraint('id', 'va_version'),
+    )
+
+
+def per_column_to_dict(row, dialect, use_dirty=True):
+    return {
+        cn: utils.get_column_attribute(row, c, use_dirty=use_dirty, dialect=dialect)
+        for c, cn in utils.get_column_keys_and_names(row)
+        if c not in row.va_ignore_columns
+    }
+
+
+def run(url):
+    engine, session = make_session(Base, [(Wide, WideArchive)], url=url)
+    rows = [
+        Wide(id=i, **{
+            'col{}'.format(j): 'value{}'.format(j) if j % 2 else j
+            for j in range(COLUMN_COUNT - 3)
+        })
+        for i in range(ROW_COUNT)
+    ]
+    session.add_all(rows)
+    session.flush()
+    for row in rows:
+        row.col1 = 'changed'
+    dialect = utils.get_dialect(session)
+
+    results = []
+    for use_dirty in (True, False):
+        times = {}
+        with timer(times, 'per column'):
+            expected = [per_column_to_dict(row, dialect, use_dirty=use_dirty) for row in rows]
+        with timer(times, 'plan'):
+            actual = [row._to_dict(dialect, use_dirty=use_dirty) for row in rows]
+        assert actual == expected
+        for name in ('per column', 'plan'):
+            results.append((
+                name,
+                str(use_dirty),
+                ROW_COUNT,
+                '{:.3f}'.format(times[name]),
+                '{:.1f}'.format(1e6 * times[name] / ROW_COUNT),
+            ))
+    session.rollback()
+    session.close()
+    engine.dispose()
+    print_table(('path', 'use_dirty', 'rows', 's', 'us/row'), results)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
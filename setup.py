@@ -15,6 +15,10 @@ setup(
         'simplejson',
         'arrow'
     ],
+    extras_require={
+        'orjson': ['orjson'],
+        'zstd': ['zstandard'],
+    },
     include_package_data=True,
     author='Akshay Nanavati',
     author_email='akshay@nerdwallet.com',
@@ -8,6 +8,7 @@ from sqlalchemy import (
 from sqlalchemy.ext.declarative import declarative_base
 
 from versionalchemy.models import VALogMixin, VAModelMixin
+from versionalchemy.outbox import VAOutboxMixin
 
 Base = declarative_base()
 
@@ -59,3 +60,7 @@ class MultiColumnArchiveTable(VALogMixin, Base):
     __table_args__ = (
         UniqueConstraint('product_id_1', 'product_id_2', 'va_version'),
     )
+
+
+class Outbox(VAOutboxMixin, Base):
+    __tablename__ = 'va_outbox'
@@ -0,0 +1,262 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy import Column, Integer, String, UniqueConstraint
+from sqlalchemy.ext.declarative import declarative_base
+
+import mock
+
+from tests.models import (
+    MultiColumnUserTable,
+    UserTable,
+)
+from tests.test_native_json import Base as NativeBase, NativeArchiveTable, NativeUserTable
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy import utils
+from versionalchemy.exceptions import LogIdentifyError
+from versionalchemy.models import VALogMixin, VAModelMixin
+
+GeneratedKeyBase = declarative_base()
+
+
+class GeneratedKeyTable(VAModelMixin, GeneratedKeyBase):
+    __tablename__ = 'generated_key_table'
+    va_version_columns = ['id']
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+
+
+class GeneratedKeyArchive(VALogMixin, GeneratedKeyBase):
+    __tablename__ = 'generated_key_table_archive'
+    id = Column(Integer)
+    user_id = Column(String(50))
+
+    __table_args__ = (
+        UniqueConstraint('id', 'va_version'),
+    )
+
+
+class TestBulkInsert(SQLiteTestBase):
+    def test_bulk_insert(self):
+        rows = [dict(self.p1, product_id=i, col4=i) for i in range(50)]
+        UserTable.va_bulk_insert(self.session, rows, user_id='importer')
+
+        for r in rows:
+            expected = dict(r, other_name=r['col4'])
+            del expected['col4']
+            self._verify_row(expected, 0)
+            self._verify_archive(expected, 0, user='importer')
+        p = self.session.query(UserTable).filter_by(product_id=10).one()
+        self.assertEqual(p.version(self.session), 0)
+        self._verify_archive({'product_id': 10, 'id': p.id}, 0, log_id=p.va_id)
+
+    def test_bulk_insert_matches_orm(self):
+        UserTable.va_bulk_insert(self.session, [self.p1])
+        p = UserTable(**self.p2)
+        self.session.add(p)
+        self.session.flush()
+
+        res = self.session.execute(
+            sa.select([UserTable.ArchiveTable.va_data]).order_by(UserTable.ArchiveTable.va_id)
+        ).fetchall()
+        bulk_data, orm_data = res[0][0], res[1][0]
+        self.assertEqual(set(bulk_data), set(orm_data))
+        self.assertEqual(bulk_data['col3'], orm_data['col3'])
+
+    def test_bulk_insert_after_delete(self):
+        p = UserTable(**self.p1)
+        self._add_and_test_version(p, 0)
+        self.session.delete(p)
+        self.session.flush()
+
+        UserTable.va_bulk_insert(self.session, [dict(self.p1, col1='new')])
+        self._verify_archive(dict(self.p1, col1='new'), 2)
+
+    def test_bulk_insert_without_version_columns_fails(self):
+        with self.assertRaises(ValueError):
+            UserTable.va_bulk_insert(self.session, [{'col1': 'foo'}])
+
+
+class TestBulkInsertStatements(SQLiteTestBase):
+    def setUp(self):
+        super(TestBulkInsertStatements, self).setUp()
+        GeneratedKeyBase.metadata.create_all(self.engine)
+        GeneratedKeyTable.register(GeneratedKeyArchive, self.engine)
+
+    def tearDown(self):
+        GeneratedKeyBase.metadata.drop_all(self.engine)
+        super(TestBulkInsertStatements, self).tearDown()
+
+    def _user_table_inserts(self, Model, mappings):
+        with self._record_statements() as statements:
+            Model.va_bulk_insert(self.session, mappings)
+        prefix = 'INSERT INTO {} '.format(Model.__tablename__)
+        return len([s for s in statements if s.statement.startswith(prefix)])
+
+    def test_keyed_rows_are_inserted_at_once(self):
+        rows = [dict(self.p1, product_id=i) for i in range(20)]
+        self.assertEqual(self._user_table_inserts(UserTable, rows), 1)
+
+    def test_generated_keys_are_inserted_per_row_without_returning(self):
+        # SQLite only reports the generated key of a single row INSERT
+        rows = [{'name': 'row{}'.format(i)} for i in range(20)]
+        self.assertEqual(self._user_table_inserts(GeneratedKeyTable, rows), 20)
+        archived = self.session.execute(
+            sa.select([GeneratedKeyArchive.id, GeneratedKeyArchive.va_version])
+        ).fetchall()
+        self.assertEqual(sorted(archived), [(i, 0) for i in range(1, 21)])
+
+
+class TestBulkUpdate(SQLiteTestBase):
+    def setUp(self):
+        super(TestBulkUpdate, self).setUp()
+        self.rows = [UserTable(**self.p1), UserTable(**self.p2), UserTable(**self.p3)]
+        self.session.add_all(self.rows)
+        self.session.flush()
+
+    def test_bulk_update(self):
+        UserTable.va_bulk_update_mappings(self.session, [
+            {'id': self.rows[0].id, 'col1': 'changed'},
+            {'id': self.rows[1].id, 'col2': -1, 'col3': False},
+            {'id': self.rows[2].id, 'col1': self.p3['col1']},
+        ], user_id='importer')
+        self.session.expire_all()
+
+        self._verify_archive(dict(self.p1, col1='changed'), 1, user='importer',
+                             log_id=self.rows[0].va_id)
+        self._verify_archive(dict(self.p2, col2=-1, col3=False), 1, log_id=self.rows[1].va_id)
+        self._verify_row(dict(self.p2, col2=-1, col3=False), 1)
+        # Nothing changed for the last row, so nothing was archived
+        self.assertEqual(self.rows[2].version(self.session), 0)
+
+    def test_bulk_update_version_column(self):
+        UserTable.va_bulk_update_mappings(self.session, [
+            {'id': self.rows[0].id, 'product_id': 100},
+        ])
+        self.session.expire_all()
+
+        self._verify_archive(self.p1, 1, deleted=True)
+        self._verify_archive(dict(self.p1, product_id=100), 0, log_id=self.rows[0].va_id)
+
+    def test_bulk_update_without_primary_key_fails(self):
+        with self.assertRaises(ValueError):
+            UserTable.va_bulk_update_mappings(self.session, [{'col1': 'foo'}])
+
+
+class TestBulkRestore(SQLiteTestBase):
+    def setUp(self):
+        super(TestBulkRestore, self).setUp()
+        self.rows = [UserTable(**self.p1), UserTable(**self.p2), UserTable(**self.p3)]
+        self._commit_at(1, self.session.add_all, self.rows)
+        self.rows[0].col1 = 'changed'
+        self._commit_at(2, self.session.delete, self.rows[1])
+        self.rows[2].col2 = -1
+        self._commit_at(3, self.session.add, UserTable(**dict(self.p1, product_id=99)))
+
+    def _current(self):
+        return {
+            row.product_id: (row.col1, row.col2)
+            for row in self.session.query(UserTable)
+        }
+
+    def test_restore_table(self):
+        restored = UserTable.va_bulk_restore(
+            self.session, datetime.utcfromtimestamp(1), user_id='restorer'
+        )
+        self.assertEqual(restored, 4)
+        self.session.expire_all()
+        self.assertEqual(self._current(), {
+            p['product_id']: (p['col1'], p['col2']) for p in (self.p1, self.p2, self.p3)
+        })
+        self._verify_archive(self.p1, 2, user='restorer', log_id=self.rows[0].va_id)
+        self._verify_archive(self.p2, 2, user='restorer')
+        self._verify_archive(self.p3, 2, user='restorer', log_id=self.rows[2].va_id)
+        self._verify_archive(dict(self.p1, product_id=99), 1, deleted=True, user='restorer')
+        self.assertEqual(self.rows[0].version(self.session), 2)
+
+    def test_restore_identifiers(self):
+        t = datetime.utcfromtimestamp(2)
+        restored = UserTable.va_bulk_restore(
+            self.session, t, [{'product_id': self.p3['product_id']}, {'product_id': 99}]
+        )
+        self.assertEqual(restored, 2)
+        self.session.expire_all()
+        current = self._current()
+        self.assertEqual(current, {
+            self.p1['product_id']: ('changed', self.p1['col2']),
+            self.p3['product_id']: (self.p3['col1'], self.p3['col2']),
+        })
+        self.assertEqual(UserTable.va_bulk_restore(self.session, t, [{'product_id': 99}]), 0)
+        with self.assertRaises(LogIdentifyError):
+            UserTable.va_bulk_restore(self.session, t, [{'col1': 'foo'}])
+
+    def test_restore_flushes_and_expires_loaded_rows(self):
+        self.rows[2].col1 = 'pending'
+        restored = UserTable.va_bulk_restore(self.session, datetime.utcfromtimestamp(1))
+        self.assertEqual(restored, 4)
+        self.assertEqual((self.rows[0].col1, self.rows[2].col1, self.rows[2].col2),
+                         (self.p1['col1'], self.p3['col1'], self.p3['col2']))
+        self.assertEqual(self.rows[2].version(self.session), 3)
+
+    def test_restore_to_now_is_noop(self):
+        archived = self.session.query(UserTable.ArchiveTable).count()
+        self.assertEqual(UserTable.va_bulk_restore(self.session, datetime.utcfromtimestamp(3)), 0)
+        self.assertEqual(self.session.query(UserTable.ArchiveTable).count(), archived)
+
+
+class TestBulkRestoreDateTime(SQLiteTestBase):
+    UserTable = NativeUserTable
+
+    def setUp(self):
+        super(TestBulkRestoreDateTime, self).setUp()
+        NativeBase.metadata.create_all(self.engine)
+        NativeUserTable.register(NativeArchiveTable, self.engine)
+        # Like PostgreSQL, bind datetimes as they are, so they are archived as ISO strings
+        self.patcher = mock.patch.object(
+            utils.ColumnPlan, 'bind_processors', lambda plan, dialect: (None,) * len(plan.archived)
+        )
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        NativeBase.metadata.drop_all(self.engine)
+        super(TestBulkRestoreDateTime, self).tearDown()
+
+    def test_restore_unchanged_row_writes_nothing(self):
+        row = NativeUserTable(product_id=1, col1='a', col2=1, col3=True,
+                              col4=datetime(2020, 1, 1, 12, 30))
+        self._commit_at(1, self.session.add, row)
+        archived = self.session.query(NativeArchiveTable).count()
+        with self._record_statements() as statements:
+            restored = NativeUserTable.va_bulk_restore(
+                self.session, datetime.utcfromtimestamp(2), [{'product_id': 1}]
+            )
+        self.assertEqual(restored, 0)
+        self.assertEqual(self.session.query(NativeArchiveTable).count(), archived)
+        self.assertFalse([s for s in statements if s.statement.startswith('UPDATE')])
+
+
+class TestMultiColumnBulk(SQLiteTestBase):
+    UserTable = MultiColumnUserTable
+
+    def test_bulk_insert_and_update(self):
+        rows = [
+            {'product_id_1': 11, 'product_id_2': 'foo', 'col1': 'foo', 'col2': 100},
+            {'product_id_1': 11, 'product_id_2': 'bar', 'col1': 'foo', 'col2': 100},
+        ]
+        MultiColumnUserTable.va_bulk_insert(self.session, rows)
+        for r in rows:
+            self._verify_archive(r, 0)
+
+        ids = [
+            self.session.query(MultiColumnUserTable.id).filter_by(product_id_2=r['product_id_2'])
+            .scalar() for r in rows
+        ]
+        MultiColumnUserTable.va_bulk_update_mappings(
+            self.session, [{'id': id_, 'col2': 200} for id_ in ids]
+        )
+        for r in rows:
+            self._verify_row(dict(r, col2=200), 1)
+            self._verify_archive(dict(r, col2=200), 1)
@@ -0,0 +1,104 @@
+from tests.models import (
+    ArchiveTable,
+    UserTable,
+)
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy.api.data import delete
+from versionalchemy.cache import ArchiveRowCache
+
+
+class TestArchiveRowCache(SQLiteTestBase):
+    def setUp(self):
+        super(TestArchiveRowCache, self).setUp()
+        self.cache = ArchiveRowCache(maxsize=3)
+        UserTable.register(ArchiveTable, self.engine, cache=self.cache)
+        self.p = UserTable(**dict(self.p1, col2=0))
+        self.session.add(self.p)
+        self.session.commit()
+        for i in range(1, 5):
+            self.p.col2 = i
+            self.session.commit()
+        self.va_ids = [row.va_id for row in self.session.query(ArchiveTable).order_by(
+            ArchiveTable.va_version)]
+        self.session.commit()
+
+    def tearDown(self):
+        UserTable.register(ArchiveTable, self.engine)
+        super(TestArchiveRowCache, self).tearDown()
+
+    def _count_statements(self, f, *args, **kwargs):
+        with self._record_statements() as statements:
+            result = f(*args, **kwargs)
+        return result, len(statements)
+
+    def test_va_get(self):
+        expected, count = self._count_statements(
+            UserTable.va_get, self.session, va_id=self.va_ids[2]
+        )
+        self.assertEqual((expected['col2'], count), (2, 1))
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+        actual, count = self._count_statements(
+            UserTable.va_get, self.session, va_id=self.va_ids[2]
+        )
+        self.assertEqual((actual, count), (expected, 0))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # Rows are copied in and out of the cache
+        actual['col2'] = 'changed'
+        self.assertEqual(UserTable.va_get(self.session, va_id=self.va_ids[2]), expected)
+
+    def test_va_diff(self):
+        expected = UserTable.va_diff(self.session, va_id=self.va_ids[3])
+        self.assertEqual(expected['change'], {'col2': {'prev': 2, 'this': 3}})
+        self.assertEqual(len(self.cache), 2)
+        actual, count = self._count_statements(
+            UserTable.va_diff, self.session, va_id=self.va_ids[3]
+        )
+        # Only the va_ids of the two versions are read
+        self.assertEqual((actual, count), (expected, 1))
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_lru_eviction(self):
+        for va_id in self.va_ids[:3]:
+            UserTable.va_get(self.session, va_id=va_id)
+        UserTable.va_get(self.session, va_id=self.va_ids[0])
+        UserTable.va_get(self.session, va_id=self.va_ids[3])
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get(ArchiveTable, self.va_ids[1]))
+        self.assertIsNotNone(self.cache.get(ArchiveTable, self.va_ids[0]))
+
+    def test_delete_invalidates(self):
+        UserTable.va_get(self.session, va_id=self.va_ids[0])
+        self.session.commit()
+        self.assertEqual(len(self.cache), 1)
+        delete(UserTable, self.session, conds=[{'product_id': self.p1['product_id']}])
+        self.assertEqual(len(self.cache), 0)
+
+    def test_rollback_invalidates(self):
+        UserTable.va_get(self.session, va_id=self.va_ids[0])
+        self.session.commit()
+        self.p.col2 = 100
+        self.session.flush()
+        UserTable.va_get(self.session, va_version=5)
+        self.assertEqual(len(self.cache), 2)
+        self.session.rollback()
+        # The row read before the commit is kept
+        self.assertEqual(len(self.cache), 1)
+        self.assertIsNotNone(self.cache.get(ArchiveTable, self.va_ids[0]))
+
+        UserTable.va_get(self.session, va_id=self.va_ids[1])
+        self.session.close()
+        self.assertEqual(len(self.cache), 1)
+
+    def test_savepoint_release_keeps_rows_tracked(self):
+        with self.session.begin_nested():
+            self.p.col2 = 100
+            self.session.flush()
+            UserTable.va_get(self.session, va_version=5)
+        self.assertEqual(len(self.cache), 1)
+        # The release of the savepoint did not commit the row, so the rollback evicts it
+        self.session.rollback()
+        self.assertEqual(len(self.cache), 0)
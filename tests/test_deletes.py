@@ -45,6 +45,23 @@ class TestDelete(SQLiteTestBase):
         self._verify_archive(self.p1, 1, deleted=True)
         self._verify_archive(p_new, 2)
 
+    def test_delete_insert_and_update_in_same_flush(self):
+        p1 = UserTable(**self.p1)
+        p3 = UserTable(**self.p3)
+        self.session.add_all([p1, p3])
+        self.session.flush()
+
+        self.session.delete(p1)
+        p2 = UserTable(**self.p2)
+        self.session.add(p2)
+        p3.col1 = 'changed'
+        self.session.flush()
+
+        self._verify_archive(self.p1, 1, deleted=True)
+        self._verify_archive(self.p2, 0, log_id=p2.va_id)
+        self._verify_archive(dict(self.p3, col1='changed'), 1, log_id=p3.va_id)
+        self.assertEqual(p3.version(self.session), 1)
+
     def test_delete_with_user(self):
         p = UserTable(**self.p1)
         p.updated_by('test_user')
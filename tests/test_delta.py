@@ -0,0 +1,146 @@
+import sqlalchemy as sa
+
+from tests.models import (
+    ArchiveTable,
+    UserTable,
+)
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy import delta
+from versionalchemy.api.data import get
+
+
+class TestDelta(SQLiteTestBase):
+    def setUp(self):
+        super(TestDelta, self).setUp()
+        ArchiveTable.va_keyframe_interval = 3
+
+    def tearDown(self):
+        ArchiveTable.va_keyframe_interval = None
+        super(TestDelta, self).tearDown()
+
+    def _stored_data(self):
+        return [
+            tuple(row) for row in self.session.execute(
+                sa.select([ArchiveTable.product_id, ArchiveTable.va_version, ArchiveTable.va_data])
+                .order_by(ArchiveTable.product_id, ArchiveTable.va_version)
+            )
+        ]
+
+    def _add_versions(self, count):
+        p = UserTable(**dict(self.p1, col2=0))
+        self._add_and_test_version(p, 0)
+        for i in range(1, count):
+            p.col2 = i
+            self.session.commit()
+        return p
+
+    def test_stores_deltas_between_keyframes(self):
+        self._add_versions(5)
+        stored = self._stored_data()
+        self.assertEqual([version for _, version, _ in stored], [0, 1, 2, 3, 4])
+        for _, version, data in stored:
+            if version % 3:
+                self.assertEqual(data, {delta.DELTA_KEY: {'col2': version}})
+            else:
+                self.assertFalse(delta.is_delta(data))
+                self.assertEqual(data['col2'], version)
+
+    def test_va_get(self):
+        p = self._add_versions(5)
+        for version in range(5):
+            data = UserTable.va_get(self.session, va_version=version)
+            self.assertEqual(data['col2'], version)
+            self.assertEqual(data['col1'], self.p1['col1'])
+            self.assertEqual(data['id'], p.id)
+
+    def test_va_get_all_and_diff(self):
+        p = self._add_versions(5)
+        records = p.va_get_all(self.session)
+        self.assertEqual([r['record']['col2'] for r in records], [0, 1, 2, 3, 4])
+        self.assertEqual(records[4]['record']['col1'], self.p1['col1'])
+
+        diff = UserTable.va_diff(self.session, va_version=4)
+        self.assertEqual(diff['change'], {'col2': {'prev': 3, 'this': 4}})
+        diffs = p.va_diff_all(self.session)
+        self.assertEqual(len(diffs), 5)
+        self.assertEqual(diffs[2]['change'], {'col2': {'prev': 1, 'this': 2}})
+
+    def test_api_get(self):
+        self._add_versions(5)
+        p2 = UserTable(**self.p2)
+        self.session.add(p2)
+        self.session.commit()
+        p2.col1 = 'changed'
+        self.session.commit()
+
+        rows = get(UserTable, self.session, t1=0, t2='3000-01-01', fields=['col1', 'col2'])
+        self.assertEqual(
+            [(r['product_id'], r['va_version'], r['va_data']) for r in rows],
+            [(10, v, {'col1': self.p1['col1'], 'col2': v}) for v in range(5)] +
+            [(11, 0, {'col1': 'baz', 'col2': 11}), (11, 1, {'col1': 'changed', 'col2': 11})],
+        )
+        # Versions which are not in the page are read back to their keyframe
+        rows = get(UserTable, self.session, page=2, page_size=2, t1=0, t2='3000-01-01')
+        self.assertEqual([r['va_data']['col2'] for r in rows], [2, 3])
+        self.assertEqual(rows[0]['va_data']['col1'], self.p1['col1'])
+        latest = get(UserTable, self.session)
+        self.assertEqual([r['va_data']['col1'] for r in latest], [self.p1['col1'], 'changed'])
+
+    def test_delete_and_insert(self):
+        p = self._add_versions(2)
+        self.session.delete(p)
+        self.session.commit()
+        p = UserTable(**dict(self.p1, col1='new'))
+        self.session.add(p)
+        self.session.commit()
+        p.col1 = 'newer'
+        self.session.commit()
+
+        stored = self._stored_data()
+        # The delete is a delta of the previous version; the re-insert has no previous data
+        self.assertEqual(stored[2][2], {delta.DELTA_KEY: {}})
+        self.assertFalse(delta.is_delta(stored[3][2]))
+        self.assertEqual(stored[4][2], {delta.DELTA_KEY: {'col1': 'newer'}})
+        data = UserTable.va_get(self.session, va_version=4)
+        self.assertEqual((data['col1'], data['col2']), ('newer', self.p1['col2']))
+
+    def test_interval_change(self):
+        self._add_versions(5)
+        ArchiveTable.va_keyframe_interval = 2
+        self.assertEqual(UserTable.va_get(self.session, va_version=2)['col2'], 2)
+        ArchiveTable.va_keyframe_interval = None
+        self.assertEqual(UserTable.va_get(self.session, va_version=4)['col2'], 4)
+
+    def test_bulk_update(self):
+        p = self._add_versions(1)
+        UserTable.va_bulk_update_mappings(self.session, [{'id': p.id, 'col1': 'bulk'}])
+        self.assertEqual(self._stored_data()[1][2], {delta.DELTA_KEY: {'col1': 'bulk'}})
+        self.assertEqual(UserTable.va_get(self.session, va_version=1)['col1'], 'bulk')
+
+    def test_version_column_change(self):
+        p = self._add_versions(2)
+        self.assertEqual(p.product_id, self.p1['product_id'])
+        p.product_id = 99
+        p.col1 = 'moved'
+        self.session.commit()
+
+        stored = self._stored_data()
+        self.assertEqual(stored[2][:2], (10, 2))
+        self.assertEqual(stored[2][2], {delta.DELTA_KEY: {}})
+        # The new key has no history to be relative to
+        self.assertEqual(stored[3][:2], (99, 0))
+        self.assertEqual(stored[3][2]['col1'], 'moved')
+        self.assertEqual(p.va_get_all(self.session)[0]['record']['col2'], 1)
+
+
+class TestDeltaHelpers(SQLiteTestBase):
+    def test_make_and_apply_delta(self):
+        base = {'a': 1, 'b': 2, 'c': 3}
+        data = {'a': 1, 'b': 20, 'd': 4}
+        encoded = delta.make_delta(base, data)
+        self.assertEqual(encoded, {delta.DELTA_KEY: {'b': 20, 'd': 4}, delta.UNSET_KEY: ['c']})
+        self.assertEqual(delta.apply_delta(base, encoded), data)
+        self.assertEqual(delta.keyframe_version(7, 3), 6)
+        self.assertEqual(delta.keyframe_version(7, None), 0)
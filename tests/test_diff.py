@@ -0,0 +1,132 @@
+import sqlalchemy as sa
+
+from tests.models import (
+    ArchiveTable,
+    UserTable,
+)
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy.exceptions import LogIdentifyError
+
+
+class TestIterDiff(SQLiteTestBase):
+    def setUp(self):
+        super(TestIterDiff, self).setUp()
+        self.p = UserTable(**dict(self.p1, col2=0))
+        self.session.add(self.p)
+        self.session.commit()
+        for i in range(1, 10):
+            self.p.col2 = i
+            self.session.commit()
+
+    def tearDown(self):
+        ArchiveTable.va_keyframe_interval = None
+        super(TestIterDiff, self).tearDown()
+
+    def _changes(self, diffs):
+        return [
+            (d['va_prev_version'], d['va_version'], d['change'].get('col2')) for d in diffs
+        ]
+
+    def test_matches_diff_all(self):
+        expected = self.p.va_diff_all(self.session)
+        self.assertEqual(len(expected), 10)
+        for batch_size in (1, 3, 1000):
+            self.assertEqual(list(self.p.va_iter_diff(self.session, batch_size=batch_size)),
+                             expected)
+        self.assertEqual(
+            self._changes(expected[1:3]),
+            [(0, 1, {'prev': 0, 'this': 1}), (1, 2, {'prev': 1, 'this': 2})],
+        )
+
+    def test_ordered_by_version(self):
+        # Store the archive rows in the reverse of version order
+        self.session.execute(sa.update(ArchiveTable).values(va_id=100 - ArchiveTable.va_version))
+        self.session.commit()
+        diffs = UserTable.va_diff_all_by_pk(self.session, product_id=self.p1['product_id'])
+        self.assertEqual([d['va_version'] for d in diffs], list(range(10)))
+        self.assertEqual(diffs[5]['change'], {'col2': {'prev': 4, 'this': 5}})
+
+    def test_from_version(self):
+        diffs = list(self.p.va_iter_diff(self.session, from_version=7, batch_size=2))
+        self.assertEqual(self._changes(diffs), [
+            (v - 1, v, {'prev': v - 1, 'this': v}) for v in range(7, 10)
+        ])
+        diffs = list(self.p.va_iter_diff(self.session, from_version=0))
+        self.assertEqual(diffs, self.p.va_diff_all(self.session))
+        self.assertEqual(list(self.p.va_iter_diff(self.session, from_version=10)), [])
+
+    def test_batches_are_read_before_rebuilding(self):
+        ArchiveTable.va_keyframe_interval = 4
+        for i in range(10, 20):
+            self.p.col2 = i
+            self.session.commit()
+        with self._record_statements() as statements:
+            diffs = self.p.va_iter_diff(self.session, batch_size=8)
+            self.assertEqual(len(list(diffs)), 20)
+        # One query per batch, none left open while the deltas of a batch are rebuilt
+        selects = [s for s in statements if 'LIMIT' in s.statement]
+        self.assertEqual(len(selects), 3)
+
+    def test_deltas(self):
+        ArchiveTable.va_keyframe_interval = 4
+        for i in range(10, 20):
+            self.p.col2 = i
+            self.session.commit()
+        for batch_size in (1, 3):
+            diffs = list(self.p.va_iter_diff(self.session, from_version=11, batch_size=batch_size))
+            self.assertEqual(self._changes(diffs), [
+                (v - 1, v, {'prev': v - 1, 'this': v}) for v in range(11, 20)
+            ])
+            self.assertEqual(diffs[0]['change'], {'col2': {'prev': 10, 'this': 11}})
+
+
+class TestMultiKeyHistory(SQLiteTestBase):
+    def setUp(self):
+        super(TestMultiKeyHistory, self).setUp()
+        self.rows = [UserTable(**dict(self.p1, product_id=i, col2=0)) for i in range(5)]
+        self.session.add_all(self.rows)
+        self.session.commit()
+        for i in range(1, 4):
+            for row in self.rows[:3]:
+                row.col2 = i
+            self.session.commit()
+        self.identifiers = [{'product_id': i} for i in (3, 1, 99, 0)]
+
+    def tearDown(self):
+        ArchiveTable.va_keyframe_interval = None
+        super(TestMultiKeyHistory, self).tearDown()
+
+    def _count_statements(self, method):
+        with self._record_statements() as statements:
+            result = method(self.session, self.identifiers)
+        return result, len(statements)
+
+    def test_match_single_key(self):
+        for batch, single in (
+            (UserTable.va_list_by_pks, UserTable.va_list_by_pk),
+            (UserTable.va_get_all_by_pks, UserTable.va_get_all_by_pk),
+            (UserTable.va_diff_all_by_pks, UserTable.va_diff_all_by_pk),
+        ):
+            result, count = self._count_statements(batch)
+            self.assertEqual(count, 1)
+            self.assertEqual(
+                result, [single(self.session, **identifier) for identifier in self.identifiers]
+            )
+        versions = UserTable.va_list_by_pks(self.session, self.identifiers)
+        self.assertEqual([[r['va_version'] for r in rows] for rows in versions],
+                         [[0], [0, 1, 2, 3], [], [0, 1, 2, 3]])
+
+    def test_deltas(self):
+        ArchiveTable.va_keyframe_interval = 2
+        for i in range(4, 8):
+            self.rows[1].col2 = i
+            self.session.commit()
+        records = UserTable.va_get_all_by_pks(self.session, [{'product_id': 1}])[0]
+        self.assertEqual([r['record']['col2'] for r in records], list(range(8)))
+        self.assertEqual(records[5]['record']['col1'], self.p1['col1'])
+
+    def test_missing_identifier_column(self):
+        with self.assertRaises(LogIdentifyError):
+            UserTable.va_list_by_pks(self.session, [{'id': 1}])
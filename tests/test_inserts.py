@@ -1,4 +1,5 @@
 from tests.models import (
+    ArchiveTable,
     UserTable,
 )
 from tests.utils import (
@@ -42,3 +43,19 @@ class TestInsert(SQLiteTestBase):
 
         self._verify_row(self.p1, 0)
         self._verify_archive(self.p1, 0, log_id=p.va_id, user='test_user')
+
+    def test_insert_many_products_batches_archive_writes(self):
+        with self._record_statements() as statements:
+            rows = [dict(self.p1, product_id=i, col2=i) for i in range(100)]
+            products = [UserTable(**r) for r in rows]
+            self.session.add_all(products)
+            self.session.flush()
+
+        self.assertEqual([
+            s.executemany for s in statements
+            if s.statement.startswith('INSERT INTO {}'.format(ArchiveTable.__tablename__))
+        ], [True])
+        for r, p in zip(rows, products):
+            self.assertEqual(p.version(self.session), 0)
+            self._verify_row(r, 0)
+            self._verify_archive(r, 0, log_id=p.va_id)
@@ -1,5 +1,6 @@
 from datetime import datetime
 
+import mock
 from sqlalchemy import (
     Column,
     Integer,
@@ -120,3 +121,27 @@ class TestArchiveTable(SQLiteTestBase):
         self.session.add(ArchiveTable(**to_insert))
         with self.assertRaises(IntegrityError):
             self.session.flush()
+
+    def test_register_reports_missing_indexes(self):
+        self.assertEqual(UserTable.missing_indexes(self.engine), [])
+        for table in (UserTable.__table__, ArchiveTable.__table__):
+            for index in table.indexes:
+                if index.columns.keys() in (['va_id'], ['va_updated_at']):
+                    index.drop(self.engine)
+        missing = [
+            (table.name, col_names) for table, col_names in UserTable.missing_indexes(self.engine)
+        ]
+        self.assertEqual(missing, [
+            (ArchiveTable.__tablename__, ('va_updated_at',)),
+            (UserTable.__tablename__, ('va_id',)),
+        ])
+        try:
+            with mock.patch('versionalchemy.models.log') as log:
+                UserTable.register(ArchiveTable, self.engine)
+            self.assertEqual(log.warning.call_count, 2)
+            self.assertEqual(len(UserTable.missing_indexes(self.engine)), 2)
+
+            UserTable.register(ArchiveTable, self.engine, create_indexes=True)
+            self.assertEqual(UserTable.missing_indexes(self.engine), [])
+        finally:
+            UserTable.register(ArchiveTable, self.engine)
@@ -0,0 +1,125 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from tests.models import UserTable
+from tests.test_native_json import Base as NativeBase, NativeArchiveTable, NativeUserTable
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy.api.data import materialize_as_of
+
+
+class TestMaterialize(SQLiteTestBase):
+    def setUp(self):
+        super(TestMaterialize, self).setUp()
+        self.rows = [UserTable(**self.p1), UserTable(**self.p2), UserTable(**self.p3)]
+        self._commit_at(1, self.session.add_all, self.rows)
+        self.rows[0].col1 = 'changed'
+        self._commit_at(2, self.session.delete, self.rows[1])
+        self._commit_at(3, self.session.add, UserTable(**dict(self.p1, product_id=99)))
+
+    def _contents(self, table):
+        return sorted(
+            (row['product_id'], row['col1'], row['col2'])
+            for row in self.session.execute(sa.select([table]))
+        )
+
+    def test_materialize(self):
+        expected = {
+            0: [],
+            1: [(p['product_id'], p['col1'], p['col2']) for p in (self.p1, self.p2, self.p3)],
+            2: [(10, 'changed', 10), (2546, 'test', 12)],
+            3: [(10, 'changed', 10), (99, 'foobar', 10), (2546, 'test', 12)],
+        }
+        for seconds, rows in sorted(expected.items()):
+            table = materialize_as_of(
+                UserTable, self.session, datetime.utcfromtimestamp(seconds),
+                'snapshot_{}'.format(seconds),
+            )
+            self.assertEqual(self._contents(table), rows)
+        self.assertNotIn('va_id', table.c)
+        self.assertIn('other_name', table.c)
+
+    def test_extracted_in_sql(self):
+        with self._record_statements() as statements:
+            table = materialize_as_of(
+                UserTable, self.session, datetime.utcfromtimestamp(2), 'snapshot'
+            )
+        self.assertEqual(self._contents(table), [(10, 'changed', 10), (2546, 'test', 12)])
+        inserts = [s.statement for s in statements if s.statement.startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertIn('SELECT', inserts[0])
+
+    def test_existing_target(self):
+        table = sa.Table(
+            'snapshot', sa.MetaData(),
+            sa.Column('product_id', sa.Integer, primary_key=True),
+            sa.Column('col1', sa.String(50)),
+            sa.Column('col2', sa.Integer),
+        )
+        table.create(self.session.connection())
+        materialize_as_of(UserTable, self.session, datetime.utcfromtimestamp(2), table)
+        self.assertEqual(self._contents(table), [(10, 'changed', 10), (2546, 'test', 12)])
+
+    def test_attached_memory_database(self):
+        self.session.execute("ATTACH DATABASE ':memory:' AS as_of")
+        table = materialize_as_of(
+            UserTable, self.session, datetime.utcfromtimestamp(1), 'snapshot', schema='as_of'
+        )
+        self.assertEqual(len(self._contents(table)), 3)
+        self.assertEqual(self.session.execute('SELECT COUNT(*) FROM as_of.snapshot').scalar(), 3)
+
+
+class TestNativeMaterialize(SQLiteTestBase):
+    UserTable = NativeUserTable
+
+    def setUp(self):
+        super(TestNativeMaterialize, self).setUp()
+        NativeBase.metadata.create_all(self.engine)
+        NativeUserTable.register(NativeArchiveTable, self.engine)
+        self.t = datetime(2020, 1, 1, 12, 30, 15, 500)
+        self.rows = [
+            NativeUserTable(product_id=i, col1='row{}'.format(i) if i else None, col2=i,
+                            col3=bool(i % 2), col4=self.t)
+            for i in range(3)
+        ]
+        self.session.add_all(self.rows)
+        self.session.commit()
+        self.rows[2].col1 = 'changed'
+        self.session.commit()
+
+    def tearDown(self):
+        NativeArchiveTable.va_keyframe_interval = None
+        NativeBase.metadata.drop_all(self.engine)
+        super(TestNativeMaterialize, self).tearDown()
+
+    def _materialize(self, name):
+        with self._record_statements() as statements:
+            table = materialize_as_of(NativeUserTable, self.session, datetime.now(), name)
+        rows = sorted(tuple(row) for row in self.session.execute(
+            sa.select([table.c.product_id, table.c.col1, table.c.col2, table.c.col3,
+                       table.c.col4])
+        ))
+        return rows, statements
+
+    def test_extracted_in_sql(self):
+        rows, statements = self._materialize('snapshot')
+        self.assertEqual(rows, [
+            (0, None, 0, False, self.t),
+            (1, 'row1', 1, True, self.t),
+            (2, 'changed', 2, False, self.t),
+        ])
+        inserts = [s.statement for s in statements if s.statement.startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertIn('SELECT', inserts[0])
+
+    def test_delta_rows_are_rebuilt(self):
+        NativeArchiveTable.va_keyframe_interval = 10
+        self.rows[1].col2 = 100
+        self.session.commit()
+        NativeArchiveTable.va_keyframe_interval = None
+
+        rows, _ = self._materialize('snapshot')
+        self.assertEqual(rows[1], (1, 'row1', 100, True, self.t))
+        self.assertEqual(len(rows), 3)
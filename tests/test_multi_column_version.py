@@ -192,3 +192,32 @@ class TestMultiColumnVersioning(SQLiteTestBase):
         self._verify_archive(r, 0)
         self._verify_archive(r, 1, deleted=True)
         self._verify_archive(r_new, 2)
+
+    def test_multi_row_flush_versions(self):
+        keys = [(11, 'foo'), (11, 'bar'), (12, 'foo')]
+        rows = [
+            MultiColumnUserTable(product_id_1=k1, product_id_2=k2, col1='foo', col2=i)
+            for i, (k1, k2) in enumerate(keys)
+        ]
+        self.session.add_all(rows[:2])
+        self.session.flush()
+        rows[0].col2 = 1000
+        self.session.flush()
+
+        with self._record_statements() as statements:
+            for row in rows[:2]:
+                row.col1 = 'changed'
+            self.session.add(rows[2])
+            self.session.flush()
+
+        self.assertEqual(len([s for s in statements if 'max(' in s.statement]), 1)
+        for row, version in zip(rows, [2, 1, 0]):
+            self.assertEqual(row.version(self.session), version)
+            expected = {
+                'product_id_1': row.product_id_1,
+                'product_id_2': row.product_id_2,
+                'col1': row.col1,
+                'col2': row.col2,
+            }
+            self._verify_row(expected, version)
+            self._verify_archive(expected, version, log_id=row.va_id)
@@ -0,0 +1,123 @@
+from datetime import datetime
+
+import mock
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Integer,
+    String,
+    UniqueConstraint,
+)
+from sqlalchemy.ext.declarative import declarative_base
+
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy import utils
+from versionalchemy.api.data import get
+from versionalchemy.models import VALogMixin, VAModelMixin
+
+Base = declarative_base()
+
+
+class NativeUserTable(VAModelMixin, Base):
+    __tablename__ = 'native_json_table'
+    va_version_columns = ['product_id']
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False, unique=True)
+    col1 = Column(String(50))
+    col2 = Column(Integer)
+    col3 = Column(Boolean)
+    col4 = Column(DateTime)
+
+
+class NativeArchiveTable(VALogMixin, Base):
+    __tablename__ = 'native_json_table_archive'
+    va_data_type = utils.NativeJSONDict
+    product_id = Column(Integer, nullable=False)
+    user_id = Column(String(50))
+
+    __table_args__ = (
+        UniqueConstraint('product_id', 'va_version'),
+    )
+
+
+class TestNativeJSON(SQLiteTestBase):
+    UserTable = NativeUserTable
+
+    def setUp(self):
+        super(TestNativeJSON, self).setUp()
+        Base.metadata.create_all(self.engine)
+        NativeUserTable.register(NativeArchiveTable, self.engine)
+
+        self.t = datetime(2020, 1, 1, 12)
+        self.rows = [
+            NativeUserTable(product_id=i, col1='row{}'.format(i), col2=i, col3=True, col4=self.t)
+            for i in range(3)
+        ]
+        self.session.add_all(self.rows)
+        self.session.commit()
+        self.rows[0].col2 = 100
+        self.session.commit()
+        self.rows[0].col1 = 'changed'
+        self.session.commit()
+
+    def tearDown(self):
+        NativeArchiveTable.va_keyframe_interval = None
+        Base.metadata.drop_all(self.engine)
+        super(TestNativeJSON, self).tearDown()
+
+    def test_stores_native_json(self):
+        self._verify_archive({'product_id': 0, 'col2': 100, 'col3': True}, 1)
+        self.assertEqual(
+            NativeUserTable.va_get(self.session, va_version=2)['col4'], self.t.isoformat()
+        )
+
+    def test_fields_are_extracted_in_sql(self):
+        with self._record_statements() as statements:
+            rows = get(
+                NativeUserTable, self.session, t1=0, t2='3000-01-01', fields=['col2', 'col3']
+            )
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('va_data,', statements[0].statement)
+        self.assertNotIn('va_data FROM', statements[0].statement)
+        # The change to col1 is not in the requested fields, so it is deduped
+        self.assertEqual(
+            [(r['product_id'], r['va_version'], r['va_data']) for r in rows],
+            [
+                (0, 0, {'col2': 0, 'col3': True}),
+                (0, 1, {'col2': 100, 'col3': True}),
+                (1, 0, {'col2': 1, 'col3': True}),
+                (2, 0, {'col2': 2, 'col3': True}),
+            ],
+        )
+
+    def test_fields_match_full_rows(self):
+        fields = ['col1', 'col3', 'col4', 'missing']
+        for kwargs in ({}, {'t1': self.t}, {'t1': 0, 't2': '3000-01-01'}, {'va_id': 0}):
+            projected = get(NativeUserTable, self.session, fields=fields, **kwargs)
+            NativeArchiveTable.va_keyframe_interval = 100
+            full = get(NativeUserTable, self.session, fields=fields, **kwargs)
+            NativeArchiveTable.va_keyframe_interval = None
+            self.assertEqual(projected, full)
+
+    def test_booleans_before_sqlite_3_38(self):
+        dbapi = self.engine.dialect.dbapi
+        with mock.patch.object(dbapi, 'sqlite_version_info', (3, 37, 0)):
+            rows = get(NativeUserTable, self.session, fields=['col2', 'col3'], conds=[
+                {'product_id': 1}
+            ])
+        self.assertEqual([r['va_data'] for r in rows], [{'col2': 1, 'col3': True}])
+        self.assertIs(rows[0]['va_data']['col3'], True)
+
+    def test_delta_rows_are_rebuilt(self):
+        NativeArchiveTable.va_keyframe_interval = 10
+        self.rows[1].col1 = 'delta'
+        self.session.commit()
+        NativeArchiveTable.va_keyframe_interval = None
+
+        rows = get(NativeUserTable, self.session, fields=['col1', 'col2'], conds=[
+            {'product_id': 1}
+        ])
+        self.assertEqual([r['va_data'] for r in rows], [{'col1': 'delta', 'col2': 1}])
@@ -0,0 +1,188 @@
+from datetime import date, datetime
+from decimal import Decimal
+import os
+import tempfile
+
+import mock
+import sqlalchemy as sa
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from tests.models import (
+    ArchiveTable,
+    Base,
+    Outbox,
+    UserTable,
+)
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy.batch import ArchiveBatch
+from versionalchemy.outbox import OutboxWorker, _decode_value
+
+
+class TestOutbox(SQLiteTestBase):
+    def setUp(self):
+        super(TestOutbox, self).setUp()
+        UserTable.register(ArchiveTable, self.engine, outbox=Outbox)
+        self.worker = OutboxWorker(self.Session, Outbox, workers=1, batch_size=2)
+
+    def tearDown(self):
+        UserTable.register(ArchiveTable, self.engine)
+        super(TestOutbox, self).tearDown()
+
+    def _count(self, table):
+        return self.session.execute(sa.select([func.count()]).select_from(table)).scalar()
+
+    def test_flush_writes_outbox(self):
+        p = UserTable(**self.p1)
+        self.session.add(p)
+        self.session.commit()
+
+        self.assertEqual(self._count(ArchiveTable.__table__), 0)
+        self.assertEqual(self._count(Outbox.__table__), 1)
+        self.assertEqual(p.va_id, 0)
+
+    def test_drain(self):
+        t = datetime.utcfromtimestamp(10)
+        p1 = UserTable(**self.p1)
+        p2 = UserTable(**self.p2)
+        with mock.patch('versionalchemy.models.datetime') as dt:
+            dt.now.return_value = t
+            self.session.add_all([p1, p2])
+            self.session.commit()
+        for i in range(3):
+            p1.col2 = i
+            self.session.commit()
+        self.session.delete(p2)
+        self.session.commit()
+
+        self.assertEqual(self.worker.drain(), 6)
+        self.assertEqual(self._count(Outbox.__table__), 0)
+        self.session.expire_all()
+
+        self._verify_archive(self.p1, 0)
+        for i in range(3):
+            self._verify_archive(dict(self.p1, col2=i), i + 1)
+        self._verify_archive(dict(self.p1, col2=2), 3, log_id=p1.va_id)
+        self._verify_archive(self.p2, 0)
+        self._verify_archive(self.p2, 1, deleted=True)
+        self.assertEqual(p1.version(self.session), 3)
+        updated_at = self.session.execute(
+            sa.select([ArchiveTable.va_updated_at]).
+            where(ArchiveTable.va_version == 0)
+        ).fetchall()
+        self.assertEqual(updated_at, [(t,), (t,)])
+
+    def test_drain_nothing(self):
+        self.assertEqual(self.worker.drain(), 0)
+
+    def test_failing_key_is_held_back(self):
+        self.session.add_all([UserTable(**self.p1), UserTable(**self.p2)])
+        self.session.commit()
+        add_data = ArchiveBatch.add_data
+
+        def failing_add_data(batch, Model, key, *args, **kwargs):
+            if key['product_id'] == self.p2['product_id']:
+                raise ValueError('poison')
+            return add_data(batch, Model, key, *args, **kwargs)
+
+        worker = OutboxWorker(self.Session, Outbox, workers=1, batch_size=2, max_attempts=2)
+        with mock.patch.object(ArchiveBatch, 'add_data', failing_add_data):
+            self.assertEqual(worker.drain(), 1)
+            self.assertEqual(worker.drain(), 0)
+        self._verify_archive(self.p1, 0)
+        self.assertEqual(self._count(ArchiveTable.__table__), 1)
+        self.assertEqual(self.session.execute(sa.select([Outbox.va_attempts])).fetchall(), [(2,)])
+
+        self.session.execute(sa.update(Outbox).values(va_attempts=0))
+        self.assertEqual(worker.drain(), 1)
+        self._verify_archive(self.p2, 0)
+
+    def test_dead_lettered_key_blocks_later_entries(self):
+        p = UserTable(**self.p1)
+        self.session.add(p)
+        self.session.commit()
+        p.col2 = 1
+        self.session.commit()
+
+        def failing_add_data(*args, **kwargs):
+            raise ValueError('poison')
+
+        worker = OutboxWorker(self.Session, Outbox, workers=1, batch_size=10, max_attempts=2)
+        with mock.patch.object(ArchiveBatch, 'add_data', failing_add_data):
+            for _ in range(2):
+                self.assertEqual(worker.drain(), 0)
+        p.col2 = 2
+        self.session.commit()
+        self.session.add(UserTable(**self.p2))
+        self.session.commit()
+
+        # Only the other key is applied, the later update waits for the dead-lettered entries
+        self.assertEqual(worker.drain(), 1)
+        self._verify_archive(self.p2, 0)
+        self.assertEqual(self._count(ArchiveTable.__table__), 1)
+        self.assertEqual(self._count(Outbox.__table__), 3)
+
+        self.session.execute(sa.update(Outbox).values(va_attempts=0))
+        self.assertEqual(worker.drain(), 3)
+        for version in range(3):
+            self._verify_archive(dict(self.p1, col2=version if version else self.p1['col2']),
+                                 version)
+
+    def test_decode_key_values(self):
+        t = datetime(2020, 1, 2, 3, 4, 5, 6)
+        self.assertEqual(_decode_value(sa.DateTime(), t.isoformat()), t)
+        self.assertEqual(_decode_value(sa.Date(), '2020-01-02'), date(2020, 1, 2))
+        self.assertEqual(_decode_value(sa.Numeric(), 1.25), Decimal('1.25'))
+        self.assertEqual(_decode_value(sa.Integer(), 3), 3)
+        self.assertIsNone(_decode_value(sa.DateTime(), None))
+
+
+class TestOutboxWorkers(SQLiteTestBase):
+    def __init__(self, methodName='runTest'):
+        super(TestOutboxWorkers, self).__init__(methodName=methodName)
+        # Worker threads need to see the same database, so don't use an in memory one
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.engine = sa.create_engine('sqlite:///{}'.format(self.db_path))
+        self.Session = sessionmaker(bind=self.engine)
+
+    def setUp(self):
+        Base.metadata.drop_all(self.engine)
+        super(TestOutboxWorkers, self).setUp()
+        UserTable.register(ArchiveTable, self.engine, outbox=Outbox)
+
+    def tearDown(self):
+        UserTable.register(ArchiveTable, self.engine)
+        self.session.close()
+        self.engine.dispose()
+        os.remove(self.db_path)
+
+    def test_parallel_drain_keeps_key_order(self):
+        rows = [UserTable(**dict(self.p1, product_id=i)) for i in range(10)]
+        self.session.add_all(rows)
+        self.session.commit()
+        for version in range(1, 5):
+            for row in rows:
+                row.col2 = version
+            self.session.commit()
+
+        worker = OutboxWorker(self.Session, Outbox, workers=3, batch_size=15)
+        self.assertEqual(worker.drain(), 50)
+        self.session.expire_all()
+        for row in rows:
+            self.assertEqual(row.version(self.session), 4)
+            for version in range(1, 5):
+                self._verify_archive(dict(self.p1, product_id=row.product_id, col2=version),
+                                     version)
+
+    def test_background_worker(self):
+        worker = OutboxWorker(self.Session, Outbox, workers=2, poll_interval=0.01)
+        worker.start()
+        p = UserTable(**self.p1)
+        self.session.add(p)
+        self.session.commit()
+        worker.stop()
+        self.session.expire_all()
+        self._verify_archive(self.p1, 0, log_id=p.va_id)
@@ -0,0 +1,201 @@
+from datetime import datetime
+
+import mock
+import sqlalchemy as sa
+
+from tests.models import (
+    ArchiveTable,
+    MultiColumnUserTable,
+    UserTable,
+)
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy import utils
+from versionalchemy.api.data import get, iter_get
+
+
+class TestCursorPagination(SQLiteTestBase):
+    def setUp(self):
+        super(TestCursorPagination, self).setUp()
+        rows = [UserTable(**dict(self.p1, product_id=i)) for i in range(5)]
+        self.session.add_all(rows)
+        self.session.commit()
+        for i in range(3):
+            for row in rows:
+                row.col2 = i
+            self.session.commit()
+
+    def _all_pages(self, **kwargs):
+        pages = [get(UserTable, self.session, page_size=4, **kwargs)]
+        while pages[-1].next_cursor is not None:
+            pages.append(
+                get(UserTable, self.session, page_size=4, cursor=pages[-1].next_cursor, **kwargs)
+            )
+        return pages
+
+    def _keys(self, rows):
+        return [(r['product_id'], r['va_version']) for r in rows]
+
+    def test_cursor_pages_match_offset_pages(self):
+        for kwargs, count in (({'t1': 0, 't2': '3000-01-01'}, 20), ({'va_id': 2}, 18)):
+            pages = self._all_pages(**kwargs)
+            expected = get(UserTable, self.session, page_size=100, **kwargs)
+            self.assertEqual(len(expected), count)
+            self.assertEqual(self._keys(sum(pages, [])), self._keys(expected))
+            for i, page in enumerate(pages):
+                self.assertEqual(
+                    page, get(UserTable, self.session, page=i + 1, page_size=4, **kwargs)
+                )
+
+    def test_time_slices(self):
+        pages = self._all_pages()
+        self.assertEqual(self._keys(sum(pages, [])), [(i, 3) for i in range(5)])
+        self.assertEqual(len(pages), 2)
+
+    def test_last_page_has_no_cursor(self):
+        page = get(UserTable, self.session, page_size=100)
+        self.assertEqual(len(page), 5)
+        self.assertIsNone(page.next_cursor)
+
+    def test_cursor_does_not_offset(self):
+        cursor = get(UserTable, self.session, page_size=4, t1=0, t2='3000-01-01').next_cursor
+        with self._record_statements() as statements:
+            get(UserTable, self.session, page_size=4, t1=0, t2='3000-01-01', cursor=cursor)
+        statement, parameters, _ = statements[0]
+        # SQLite always renders an OFFSET after a LIMIT
+        if 'OFFSET' in statement:
+            self.assertEqual(parameters[-1], 0)
+
+    def test_invalid_cursor(self):
+        for cursor in ('not a cursor', 'eyJhIjogMX0=', 'WzFd'):
+            with self.assertRaises(ValueError):
+                get(UserTable, self.session, cursor=cursor)
+
+
+class TestMultiColumnCursorPagination(SQLiteTestBase):
+    UserTable = MultiColumnUserTable
+
+    def test_multi_column_cursor(self):
+        rows = [
+            MultiColumnUserTable(product_id_1=i % 2, product_id_2=str(i), col1='foo', col2=i)
+            for i in range(6)
+        ]
+        self.session.add_all(rows)
+        self.session.commit()
+        for row in rows:
+            row.col2 += 10
+        self.session.commit()
+
+        expected = get(MultiColumnUserTable, self.session, t1=0, t2='3000-01-01')
+        page = get(MultiColumnUserTable, self.session, t1=0, t2='3000-01-01', page_size=5)
+        actual = list(page)
+        while page.next_cursor:
+            page = get(MultiColumnUserTable, self.session, t1=0, t2='3000-01-01', page_size=5,
+                       cursor=page.next_cursor)
+            actual.extend(page)
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(actual), 12)
+
+
+class TestIterGet(SQLiteTestBase):
+    def setUp(self):
+        super(TestIterGet, self).setUp()
+        self.rows = [UserTable(**dict(self.p1, product_id=i, col2=0)) for i in range(3)]
+        self.session.add_all(self.rows)
+        self.session.commit()
+        for i in range(1, 5):
+            for row in self.rows:
+                row.col2 = i
+                # col1 does not change in version 3, which fields=['col1'] rolls up
+                row.col1 = 'v{}'.format(i - i % 2)
+            self.session.commit()
+
+    def tearDown(self):
+        ArchiveTable.va_keyframe_interval = None
+        super(TestIterGet, self).tearDown()
+
+    def test_matches_get(self):
+        for kwargs in (
+            {},
+            {'t1': 0, 't2': '3000-01-01'},
+            {'t1': 0, 't2': '3000-01-01', 'fields': ['col1']},
+            {'va_id': 4, 'fields': ['col2']},
+        ):
+            expected = get(UserTable, self.session, page_size=100, **kwargs)
+            for batch_size in (1, 2, 1000):
+                self.assertEqual(
+                    list(iter_get(UserTable, self.session, batch_size=batch_size, **kwargs)),
+                    expected,
+                )
+
+    def test_rolls_up_across_batches(self):
+        rows = list(iter_get(UserTable, self.session, t1=0, t2='3000-01-01', fields=['col1'],
+                             conds=[{'product_id': 1}], batch_size=1))
+        self.assertEqual([r['va_version'] for r in rows], [0, 1, 2, 4])
+        self.assertEqual([r['va_data']['col1'] for r in rows], ['foobar', 'v0', 'v2', 'v4'])
+
+    def test_rebuilds_deltas_across_batches(self):
+        ArchiveTable.va_keyframe_interval = 3
+        for i in range(5, 10):
+            self.rows[0].col2 = i
+            self.session.commit()
+        expected = get(UserTable, self.session, page_size=100, t1=0, t2='3000-01-01')
+        self.assertEqual(
+            list(iter_get(UserTable, self.session, t1=0, t2='3000-01-01', batch_size=2)),
+            expected,
+        )
+        self.assertEqual([r['va_data']['col2'] for r in expected[:10]], list(range(10)))
+
+    def test_close_early(self):
+        rows = iter_get(UserTable, self.session, t1=0, t2='3000-01-01', batch_size=2)
+        self.assertEqual(next(rows)['va_version'], 0)
+        rows.close()
+        self.assertEqual(len(get(UserTable, self.session)), 3)
+
+
+class TestRollUp(SQLiteTestBase):
+    def setUp(self):
+        super(TestRollUp, self).setUp()
+        data = dict(self.p1, id=1)
+        datas = [data] * 3 + [dict(data, col1='changed')] * 2 + [dict(data, col2=0)]
+        self.session.execute(sa.insert(ArchiveTable), [
+            {
+                'product_id': self.p1['product_id'],
+                'va_version': version,
+                'va_deleted': version == 4,
+                'va_updated_at': datetime(2020, 1, 1),
+                'va_data': va_data,
+            }
+            for version, va_data in enumerate(datas)
+        ])
+
+    def test_unchanged_data_is_not_decoded(self):
+        decode = utils.JSONEncodedDict.process_result_value
+        with mock.patch.object(
+            utils.JSONEncodedDict, 'process_result_value', autospec=True, side_effect=decode,
+        ) as process_result_value:
+            rows = get(UserTable, self.session, t1=0, t2='3000-01-01')
+        # Versions 1 and 2 are stored the same as version 0; version 4 is a delete
+        self.assertEqual([r['va_version'] for r in rows], [0, 3, 4, 5])
+        self.assertEqual(process_result_value.call_count, 4)
+        self.assertEqual(rows[1]['va_data']['col1'], 'changed')
+
+    def test_unchanged_fields_are_not_decoded(self):
+        decode = utils.JSONEncodedDict.process_result_value
+        with mock.patch.object(
+            utils.JSONEncodedDict, 'process_result_value', autospec=True, side_effect=decode,
+        ) as process_result_value:
+            rows = get(UserTable, self.session, t1=0, t2='3000-01-01', fields=['col2'])
+        # Version 3 only changes col1
+        self.assertEqual([r['va_version'] for r in rows], [0, 4, 5])
+        self.assertEqual(process_result_value.call_count, 3)
+
+    def test_fields(self):
+        for batch_size in (1, 100):
+            rows = list(iter_get(UserTable, self.session, t1=0, t2='3000-01-01',
+                                 fields=['col2'], batch_size=batch_size))
+            self.assertEqual([r['va_version'] for r in rows], [0, 4, 5])
+            self.assertEqual(
+                rows, get(UserTable, self.session, t1=0, t2='3000-01-01', fields=['col2'])
+            )
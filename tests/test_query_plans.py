@@ -0,0 +1,160 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from tests.models import (
+    ArchiveTable,
+    UserTable,
+)
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy.api import data
+from versionalchemy.api.data import get
+
+
+class TestQueryPlans(SQLiteTestBase):
+    def setUp(self):
+        super(TestQueryPlans, self).setUp()
+        self.rows = [UserTable(**dict(self.p1, product_id=i)) for i in range(3)]
+        self._commit_at(1, self.session.add_all, self.rows)
+        for row in self.rows:
+            row.col2 = 20
+        self._commit_at(2)
+        self._commit_at(3, self.session.delete, self.rows[2])
+        for row in self.rows[:2]:
+            row.col2 = 30
+        self._commit_at(4)
+
+    def _plan(self, query):
+        statement = query.compile(
+            dialect=self.engine.dialect, compile_kwargs={'literal_binds': True}
+        )
+        return [row[-1] for row in self.session.execute('EXPLAIN QUERY PLAN {}'.format(statement))]
+
+    def _assert_no_scan(self, plan, table):
+        for step in plan:
+            self.assertNotEqual(step, 'SCAN {}'.format(table))
+
+    def test_historical_changes_use_updated_at_index(self):
+        index = 'ix_{}_va_updated_at'.format(ArchiveTable.__tablename__)
+        for include_deleted in (True, False):
+            plan = self._plan(data._get_historical_changes(
+                UserTable, self.session, None, datetime.utcfromtimestamp(2),
+                datetime.utcfromtimestamp(3), include_deleted,
+            ))
+            self.assertTrue(any(index in step for step in plan), plan)
+
+    def test_historical_changes_by_key_use_unique_index(self):
+        for include_deleted in (True, False):
+            plan = self._plan(data._get_historical_changes(
+                UserTable, self.session, [{'product_id': 1}], datetime.utcfromtimestamp(2),
+                datetime.utcfromtimestamp(3), include_deleted,
+            ))
+            self.assertTrue(any(step.startswith('SEARCH') for step in plan), plan)
+            self._assert_no_scan(plan, ArchiveTable.__tablename__)
+
+    def test_latest_time_slice_uses_va_id_index(self):
+        plan = self._plan(data._get_latest_time_slice(UserTable, self.session, None, True))
+        self.assertTrue(
+            any('ix_{}_va_id'.format(UserTable.__tablename__) in step for step in plan), plan
+        )
+        self._assert_no_scan(plan, UserTable.__tablename__)
+
+    def test_time_bounds_without_deleted(self):
+        t1, t2 = datetime.utcfromtimestamp(2), datetime.utcfromtimestamp(3)
+        for include_deleted in (True, False):
+            rows = get(UserTable, self.session, t1=t1, t2=t2, include_deleted=include_deleted)
+            self.assertEqual(
+                [(r['product_id'], r['va_version']) for r in rows], [(i, 1) for i in range(3)]
+            )
+        rows = get(UserTable, self.session, t1=t1, t2=datetime.utcfromtimestamp(4),
+                   include_deleted=False)
+        self.assertEqual([(r['product_id'], r['va_version']) for r in rows],
+                         [(0, 1), (1, 1), (2, 1)])
+        rows = get(UserTable, self.session, t1=datetime.utcfromtimestamp(3), include_deleted=False)
+        self.assertEqual([(r['product_id'], r['va_version']) for r in rows], [(0, 1), (1, 1)])
+
+
+class TestDiffQuery(SQLiteTestBase):
+    def test_va_diff_is_one_query(self):
+        rows = [UserTable(**dict(self.p1, product_id=i, col2=0)) for i in range(3)]
+        self.session.add_all(rows)
+        self.session.commit()
+        for i in range(1, 20):
+            for row in rows:
+                row.col2 = i
+            self.session.commit()
+
+        va_id = rows[1].va_id
+        with self._record_statements() as statements:
+            diff = UserTable.va_diff(self.session, va_id=va_id)
+            first = UserTable.va_diff(self.session, va_version=0)
+        self.assertEqual(len(statements), 2)
+        self.assertEqual((diff['va_prev_version'], diff['va_version']), (18, 19))
+        self.assertEqual(diff['change'], {'col2': {'prev': 18, 'this': 19}})
+        self.assertEqual((first['va_prev_version'], first['va_version']), (None, 0))
+
+        statement, parameters, _ = statements[0]
+        plan = [
+            row[-1] for row in
+            self.engine.execute('EXPLAIN QUERY PLAN {}'.format(statement), parameters)
+        ]
+        self.assertNotIn('SCAN {}'.format(ArchiveTable.__tablename__), plan)
+
+
+class TestVersionQuery(SQLiteTestBase):
+    def _count_statements(self, fn):
+        with self._record_statements() as statements:
+            result = fn()
+        return result, len(statements)
+
+    def test_version_after_flush(self):
+        p = UserTable(**self.p1)
+        self.session.add(p)
+        self.session.flush()
+        self.assertEqual(self._count_statements(lambda: p.version(self.session)), (0, 0))
+        p.col1 = 'changed'
+        self.session.flush()
+        self.assertEqual(self._count_statements(lambda: p.version(self.session)), (1, 0))
+        p.product_id = 99
+        self.session.flush()
+        self.assertEqual(self._count_statements(lambda: p.version(self.session)), (0, 0))
+        self.session.commit()
+        # Expired by the commit, so it is read again
+        self.assertEqual(p.version(self.session), 0)
+        self._verify_archive(dict(self.p1, product_id=99, col1='changed'), 0, log_id=p.va_id)
+
+    def test_bulk_writes_unload_version(self):
+        p = UserTable(**self.p1)
+        self.session.add(p)
+        self.session.flush()
+        self.assertEqual(p.version(self.session), 0)
+        UserTable.va_bulk_update_mappings(self.session, [{'id': p.id, 'col1': 'bulk'}])
+        self.assertEqual(p.version(self.session), 1)
+        p.col1 = 'flushed'
+        self.session.flush()
+        self.assertEqual(self._count_statements(lambda: p.version(self.session)), (2, 0))
+
+    def test_versions_are_loaded_with_rows(self):
+        rows = [UserTable(**dict(self.p1, product_id=i)) for i in range(1000)]
+        self.session.add_all(rows)
+        self.session.commit()
+        for row in rows[::3]:
+            row.col2 = 0
+        self.session.commit()
+        self.session.expunge_all()
+
+        loaded, count = self._count_statements(lambda: [
+            (row.product_id, row.version(self.session)) for row in
+            self.session.query(UserTable).options(sa.orm.undefer(UserTable.va_version))
+            .order_by(UserTable.product_id)
+        ])
+        self.assertEqual(count, 1)
+        self.assertEqual(loaded, [(i, 0 if i % 3 else 1) for i in range(1000)])
+
+        # Without the option, the version is read when first needed
+        self.session.expunge_all()
+        row = self.session.query(UserTable).filter_by(product_id=3).one()
+        self.assertNotIn('va_version', sa.inspect(row).dict)
+        self.assertEqual(row.version(self.session), 1)
@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import mock
+
+from tests.models import (
+    MultiColumnUserTable,
+    UserTable,
+)
+from tests.utils import (
+    SQLiteTestBase,
+)
+from versionalchemy import utils
+from versionalchemy.api import data
+
+
+class TestTimeSlice(SQLiteTestBase):
+    def setUp(self):
+        super(TestTimeSlice, self).setUp()
+        self.rows = [UserTable(**dict(self.p1, product_id=i, col2=0)) for i in range(4)]
+        self._commit_at(1, self.session.add_all, self.rows)
+        for i in range(1, 6):
+            for row in self.rows:
+                row.col2 = i
+            self._commit_at(1 + i)
+        self._commit_at(10, self.session.delete, self.rows[1])
+
+    def _time_slice(self, va_table, t, strategy, **kwargs):
+        kwargs.setdefault('conds', None)
+        kwargs.setdefault('include_deleted', True)
+        query = data._get_historical_time_slice(
+            va_table, self.session, t, strategy=strategy, **kwargs
+        )
+        return utils.result_to_dict(self.session.execute(query))
+
+    def _versions(self, rows):
+        return [(r['product_id'], r['va_version'], r['va_deleted']) for r in rows]
+
+    def test_strategies_match(self):
+        for seconds in (0, 1, 3, 9, 10, 100):
+            t = datetime.utcfromtimestamp(seconds)
+            for kwargs in (
+                {},
+                {'include_deleted': False},
+                {'conds': [{'product_id': 1}, {'product_id': 2}]},
+            ):
+                expected = self._time_slice(UserTable, t, data.TIME_SLICE_JOIN, **kwargs)
+                for strategy in (data.TIME_SLICE_WINDOW, data.TIME_SLICE_MAX):
+                    self.assertEqual(
+                        self._time_slice(UserTable, t, strategy, **kwargs), expected
+                    )
+
+    def test_latest_version_at_t(self):
+        for strategy in (data.TIME_SLICE_WINDOW, data.TIME_SLICE_MAX, data.TIME_SLICE_JOIN):
+            rows = self._time_slice(UserTable, datetime.utcfromtimestamp(3), strategy)
+            self.assertEqual(self._versions(rows), [(i, 2, False) for i in range(4)])
+            rows = self._time_slice(UserTable, datetime.utcfromtimestamp(10), strategy)
+            self.assertEqual(
+                self._versions(rows),
+                [(0, 5, False), (1, 6, True), (2, 5, False), (3, 5, False)],
+            )
+            # A deleted key is left out, rather than replaced by its previous version
+            rows = self._time_slice(
+                UserTable, datetime.utcfromtimestamp(10), strategy, include_deleted=False
+            )
+            self.assertEqual([r['product_id'] for r in rows], [0, 2, 3])
+
+    def test_multi_column_keys(self):
+        rows = [
+            MultiColumnUserTable(product_id_1=i % 2, product_id_2=str(i // 2), col1='foo', col2=0)
+            for i in range(4)
+        ]
+        self._commit_at(1, self.session.add_all, rows)
+        rows[0].col2 = 1
+        self._commit_at(2)
+        t = datetime.utcfromtimestamp(5)
+        expected = self._time_slice(MultiColumnUserTable, t, data.TIME_SLICE_JOIN)
+        self.assertEqual(len(expected), 4)
+        for strategy in (data.TIME_SLICE_WINDOW, data.TIME_SLICE_MAX):
+            self.assertEqual(self._time_slice(MultiColumnUserTable, t, strategy), expected)
+
+    def test_default_strategy(self):
+        statement = str(data._get_historical_time_slice(UserTable, self.session, 0, None, True))
+        self.assertIn('max(', statement)
+        with mock.patch.object(utils, 'get_dialect') as get_dialect:
+            get_dialect.return_value.name = 'postgresql'
+            statement = str(
+                data._get_historical_time_slice(UserTable, self.session, 0, None, True)
+            )
+        self.assertIn('row_number() OVER', statement)
+        with self.assertRaises(ValueError):
+            data._get_historical_time_slice(UserTable, self.session, 0, None, True, strategy='x')
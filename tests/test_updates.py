@@ -1,3 +1,4 @@
+from datetime import datetime
 import os
 
 import sqlalchemy as sa
@@ -14,6 +15,7 @@ from tests.utils import (
     SQLiteTestBase,
     VaTestHelpers,
 )
+from versionalchemy.models import VERSION_MODE_MAX, VERSION_MODE_POINTER
 
 
 class TestUpdate(SQLiteTestBase):
@@ -120,6 +122,84 @@ class TestUpdate(SQLiteTestBase):
             'col2': -1,
         }), 1, user='test_user2', log_id=p.va_id)
 
+    def test_va_id_written_back_in_one_statement(self):
+        rows = [dict(self.p1, product_id=i) for i in range(50)]
+        products = [UserTable(**r) for r in rows]
+        self.session.add_all(products)
+        self.session.flush()
+
+        with self._record_statements() as statements:
+            for p in products:
+                p.col2 = -1
+            self.session.flush()
+
+        self.assertEqual([
+            s.executemany for s in statements
+            if s.statement.startswith('UPDATE {} SET va_id'.format(UserTable.__tablename__))
+        ], [True])
+        for r, p in zip(rows, products):
+            expected = dict(r, col2=-1)
+            self._verify_row(dict(expected, va_id=p.va_id), 1)
+            self._verify_archive(expected, 1, log_id=p.va_id)
+
+
+class TestPointerVersionMode(SQLiteTestBase):
+    def setUp(self):
+        super(TestPointerVersionMode, self).setUp()
+        UserTable.va_version_mode = VERSION_MODE_POINTER
+
+    def tearDown(self):
+        UserTable.va_version_mode = VERSION_MODE_MAX
+        super(TestPointerVersionMode, self).tearDown()
+
+    def _max_version_queries(self, statements):
+        return [
+            s.statement for s in statements if 'max(' in s.statement and 'va_version' in s.statement
+        ]
+
+    def test_update_does_not_scan_archive(self):
+        p = UserTable(**self.p1)
+        self._add_and_test_version(p, 0)
+        p.col1 = 'new'
+        self._add_and_test_version(p, 1)
+        with self._record_statements() as statements:
+            p.col2 = -1
+            self._add_and_test_version(p, 2)
+            va_id = p.va_id
+            self.session.delete(p)
+            self.session.flush()
+
+        self.assertEqual(self._max_version_queries(statements), [])
+        self._verify_archive(dict(self.p1, col1='new', col2=-1), 2, log_id=va_id)
+        self._verify_archive(dict(self.p1, col1='new', col2=-1), 3, deleted=True, log_id=p.va_id)
+
+    def test_version_column_change_falls_back_to_max(self):
+        p = UserTable(**self.p1)
+        self._add_and_test_version(p, 0)
+        p.col1 = 'new'
+        self._add_and_test_version(p, 1)
+        p.product_id = 12
+        self._add_and_test_version(p, 0)
+
+        self._verify_archive(dict(self.p1, col1='new'), 2, deleted=True)
+        self._verify_archive(dict(self.p1, col1='new', product_id=12), 0, log_id=p.va_id)
+
+    def test_stale_pointer_fails(self):
+        p = UserTable(**self.p1)
+        self._add_and_test_version(p, 0)
+
+        # Simulate another writer moving the history forward behind this session's back
+        self.session.execute(sa.insert(ArchiveTable), {
+            'product_id': p.product_id,
+            'va_version': 1,
+            'va_deleted': False,
+            'va_updated_at': datetime.now(),
+            'va_data': {},
+        })
+        p.col1 = 'new'
+        with self.assertRaises(IntegrityError):
+            self.session.flush()
+
 
 class TestConcurrentUpdate(unittest.TestCase, VaTestHelpers):
     DATABASE_URL = 'sqlite:///test.db'
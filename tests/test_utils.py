@@ -1,14 +1,19 @@
-from datetime import datetime
+import dataclasses
+from datetime import date, datetime, time
 from decimal import Decimal
 import json
 import unittest
+import uuid
 
 import sqlalchemy as sa
+from sqlalchemy.dialects import mysql, postgresql
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import StatementError
 from sqlalchemy.ext.declarative import declarative_base
 
 from versionalchemy import utils
+from versionalchemy.exceptions import LogTableCreationError
+from versionalchemy.models import VALogMixin
 
 
 Base = declarative_base()
@@ -21,6 +26,18 @@ class TestModel(Base):
     json_dict = sa.Column(utils.JSONEncodedDict)
 
 
+class OrjsonModel(Base):
+    __tablename__ = 'test_orjson'
+    id = sa.Column(sa.Integer, primary_key=True)
+    json_dict = sa.Column(utils.JSONEncodedDict(codec='orjson'))
+
+
+class CompressedModel(Base):
+    __tablename__ = 'test_compressed'
+    id = sa.Column(sa.Integer, primary_key=True)
+    json_dict = sa.Column(utils.CompressedJSONEncodedDict(threshold=64))
+
+
 class TestClass(object):
     def __init__(self, foo):
         self.foo = foo
@@ -38,6 +55,8 @@ class TestUtils(unittest.TestCase):
 
     def tearDown(self):
         self.engine.execute('drop table test')
+        self.engine.execute('drop table test_orjson')
+        self.engine.execute('drop table test_compressed')
         self.session.close()
 
     def test_get_column_attribute(self):
@@ -49,6 +68,38 @@ class TestUtils(unittest.TestCase):
         attr = utils.get_column_attribute(test_row, 'json_list')
         self.assertEquals(attr, val)
 
+    def test_column_plan_matches_get_column_attribute(self):
+        plan = utils.ColumnPlan(TestModel, ignore={'json_dict'})
+        self.assertEqual(plan.keys, ('id', 'json_list', 'json_dict'))
+        self.assertEqual(plan.archived, (('id', 'id'), ('json_list', 'json_list')))
+
+        m = TestModel(json_list=[1, 2], json_dict={'a': 1})
+        self.session.add(m)
+        self.session.commit()
+        self.assertEqual(m.json_list, [1, 2])
+        m.json_list = [3]
+        dialect = self.engine.dialect
+        for use_dirty in (True, False):
+            for d in (None, dialect):
+                self.assertEqual(plan.to_dict(m, d, use_dirty=use_dirty), {
+                    c: utils.get_column_attribute(m, c, use_dirty=use_dirty, dialect=d)
+                    for c in ('id', 'json_list')
+                })
+        self.assertEqual(plan.to_dict(m, dialect, use_dirty=False)['json_list'], '[1, 2]')
+        self.assertIs(plan.bind_processors(dialect), plan.bind_processors(dialect))
+
+    def test_column_plan_is_current(self):
+        class Model(declarative_base()):
+            __tablename__ = 'test_plan'
+            id = sa.Column(sa.Integer, primary_key=True)
+
+        plan = utils.ColumnPlan(Model, ignore={'id'})
+        self.assertTrue(plan.is_current(Model, {'id'}))
+        self.assertFalse(plan.is_current(Model))
+        Model.col = sa.Column(sa.Integer)
+        self.assertFalse(plan.is_current(Model, {'id'}))
+        self.assertEqual(utils.ColumnPlan(Model).archived, (('id', 'id'), ('col', 'col')))
+
     def test_json_encoded_none_value(self):
         m = TestModel(json_list=None, json_dict=None)
         self.session.add(m)
@@ -123,7 +174,220 @@ class TestUtils(unittest.TestCase):
             return
         self.assertTrue(False, 'Test should have raised ValueError')
 
+    def test_orjson_codec(self):
+        ts = datetime.now()
+        value = {'a': ts, 'b': [1, u'\u2603', None], 'c': {'d': 1.5}}
+        for codec in (utils.OrjsonCodec(), utils.SimpleJSONCodec()):
+            decoded = dict(value, a=ts.isoformat())
+            self.assertEqual(codec.loads(codec.dumps(value)), decoded)
+            self.assertEqual(codec.loads(utils.SimpleJSONCodec().dumps(value)), decoded)
+
+        m = OrjsonModel(json_dict=value)
+        self.session.add(m)
+        self.session.commit()
+        self.session.expire_all()
+        self.assertEqual(self.session.query(OrjsonModel).one().json_dict['a'], ts.isoformat())
+
+    def test_orjson_codec_falls_back(self):
+        codec = utils.OrjsonCodec()
+        self.assertEqual(codec.loads(codec.dumps({'a': Decimal('2.5')})), {'a': 2.5})
+        self.assertEqual(codec.loads(codec.dumps([2 ** 70])), [2 ** 70])
+        with self.assertRaises(TypeError):
+            codec.dumps([TestClass('bar')])
+
+    def test_orjson_codec_rejects_what_simplejson_rejects(self):
+        @dataclasses.dataclass
+        class Point(object):
+            x: int
+
+        for codec in (utils.OrjsonCodec(), utils.SimpleJSONCodec()):
+            for value in (
+                {'a': time(12, 30)}, {'a': [uuid.uuid4()]}, {uuid.uuid4(): 1}, {'a': Point(1)},
+            ):
+                with self.assertRaises(TypeError):
+                    codec.dumps(value)
+        value = {'a': str(uuid.uuid4()), 'b': date(2020, 1, 2)}
+        self.assertEqual(
+            json.loads(utils.OrjsonCodec().dumps(value)),
+            json.loads(utils.SimpleJSONCodec().dumps(value)),
+        )
+
+    def test_orjson_codec_rejects_non_finite_floats(self):
+        for codec in (utils.OrjsonCodec(), utils.SimpleJSONCodec()):
+            for value in ({'a': float('nan')}, {'a': [1, float('inf')]}):
+                with self.assertRaises(ValueError):
+                    codec.dumps(value)
+        self.assertEqual(utils.OrjsonCodec().dumps({'a': None, 'b': 1.5}), '{"a":null,"b":1.5}')
+
+    def test_default_codec(self):
+        self.assertIsInstance(utils.get_codec(), utils.SimpleJSONCodec)
+        utils.set_default_codec('orjson')
+        try:
+            self.assertIsInstance(utils.get_codec(), utils.OrjsonCodec)
+            m = TestModel(json_dict={'a': 1})
+            self.session.add(m)
+            self.session.commit()
+            self.session.expire_all()
+            self.assertEqual(self.session.query(TestModel).one().json_dict, {'a': 1})
+        finally:
+            utils.set_default_codec(None)
+        with self.assertRaises(ValueError):
+            utils.get_codec('unknown')
+
+    def _raw_compressed(self):
+        return [
+            bytes(row[0]) for row in self.session.execute(
+                sa.select([sa.column('json_dict')]).select_from(sa.table('test_compressed'))
+                .order_by(sa.column('id'))
+            )
+        ]
+
+    def test_compressed_json(self):
+        small = {'a': 1}
+        large = {'key{}'.format(i): 'value' * 10 for i in range(20)}
+        self.session.add_all([CompressedModel(json_dict=small), CompressedModel(json_dict=large)])
+        self.session.commit()
+        self.session.expire_all()
+
+        raw = self._raw_compressed()
+        self.assertEqual(raw[0][:1], utils.HEADER_PLAIN)
+        self.assertEqual(raw[1][:1], utils.HEADER_ZLIB)
+        self.assertLess(len(raw[1]), len(json.dumps(large)) / 4)
+        result = self.session.query(CompressedModel).order_by(CompressedModel.id).all()
+        self.assertEqual([r.json_dict for r in result], [small, large])
+
+    def test_compressed_json_reads_uncompressed_rows(self):
+        table = sa.table('test_compressed', sa.column('json_dict'))
+        self.session.execute(sa.insert(table, values={'json_dict': b'{"a": "b"}'}))
+        self.session.execute(sa.insert(table, values={'json_dict': u'{"a": "\u2603"}'}))
+        result = self.session.query(CompressedModel).order_by(CompressedModel.id).all()
+        self.assertEqual([r.json_dict for r in result], [{'a': 'b'}, {'a': u'\u2603'}])
+
+    @unittest.skipIf(utils.zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        value = {'key{}'.format(i): 'value' * 10 for i in range(20)}
+        compressed = utils.compress(json.dumps(value).encode('utf8'), 'zstd')
+        self.assertEqual(compressed[:1], utils.HEADER_ZSTD)
+        self.assertEqual(json.loads(utils.decompress(compressed).decode('utf8')), value)
+
+    def test_log_table_data_type(self):
+        class CompressedArchive(VALogMixin, declarative_base()):
+            __tablename__ = 'test_compressed_archive'
+            va_codec = 'orjson'
+            va_data_type = utils.CompressedJSONEncodedDict
+            id = sa.Column(sa.Integer)
+
+        data_type = CompressedArchive.__table__.c.va_data.type
+        self.assertIsInstance(data_type, utils.CompressedJSONEncodedDict)
+        self.assertIsInstance(data_type.codec, utils.OrjsonCodec)
+
+    def test_log_table_data_type_instance_codec(self):
+        shared = utils.CompressedJSONEncodedDict(threshold=128)
+
+        class CompressedArchive(VALogMixin, declarative_base()):
+            __tablename__ = 'test_compressed_archive'
+            va_codec = 'orjson'
+            va_data_type = shared
+            id = sa.Column(sa.Integer)
+
+        data_type = CompressedArchive.__table__.c.va_data.type
+        self.assertIsInstance(data_type.codec, utils.OrjsonCodec)
+        self.assertEqual(data_type.threshold, 128)
+        self.assertIsNone(shared.codec)
+
+        with self.assertRaises(LogTableCreationError):
+            class ConflictingArchive(VALogMixin, declarative_base()):
+                __tablename__ = 'test_conflicting_archive'
+                va_codec = 'orjson'
+                va_data_type = utils.JSONEncodedDict(codec='simplejson')
+                id = sa.Column(sa.Integer)
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            utils.CompressedJSONEncodedDict(compression='lzma')
+
+    def test_json_value_keeps_decimal_precision(self):
+        dialect = postgresql.dialect()
+        expression = utils.json_value(
+            sa.column('va_data'), 'price', sa.Numeric(20, 10), dialect
+        )
+        compiled = str(expression.compile(dialect=dialect))
+        self.assertIn('AS NUMERIC(20, 10)', compiled)
+        self.assertNotIn('FLOAT', compiled)
+
+    def test_select_by_keys_matches_normalized_values(self):
+        table = sa.Table(
+            'test_keys', sa.MetaData(),
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('price', sa.Numeric(10, 2)),
+            sa.Column('name', sa.String(10, collation='NOCASE')),
+        )
+        table.create(self.engine)
+        try:
+            self.session.execute(table.insert(), [
+                {'id': 1, 'price': Decimal('1.10'), 'name': 'abc'},
+                {'id': 2, 'price': Decimal('2'), 'name': 'def'},
+            ])
+            columns = [table.c.price, table.c.name]
+            keys = [(1.1, 'ABC'), (2, 'def'), (3, 'ghi')]
+            self.assertEqual(
+                utils.select_by_keys(self.session, columns, keys, [table.c.id]),
+                {(1.1, 'ABC'): (1,), (2, 'def'): (2,)},
+            )
+        finally:
+            table.drop(self.engine)
+
+    def test_json_keys_are_escaped(self):
+        column = sa.column('va_data')
+        dialect = mysql.dialect()
+        compiled = utils.json_field(column, 'a"b', dialect).compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}
+        )
+        self.assertIn(r"""'$."a\\"b"'""", str(compiled))
+
+        dialect = self.engine.dialect
+        self.assertFalse(utils.supports_json_key('a"b', dialect))
+        with self.assertRaises(ValueError):
+            utils.json_field(column, 'a"b', dialect)
+        self.assertTrue(utils.supports_json_key('a"b', postgresql.dialect()))
+
     def test_is_modified(self):
         row = TestModel(json_list=[1, 2, 3])
         row.json_list = [1]
         self.assertTrue(utils.is_modified(row))
+
+    def test_compare_dicts(self):
+        old = {'a': 1, 'b': 'x', 'c': None, 'd': 4}
+        new = {'a': 1, 'b': 'y', 'd': 4, 'e': 5}
+        self.assertEqual(utils.compare_dicts(old, new), {
+            'b': {'prev': 'x', 'this': 'y'},
+            'c': {'prev': None, 'this': None},
+            'e': {'prev': None, 'this': 5},
+        })
+        self.assertEqual(utils.compare_dicts(None, {'a': 1, 'b': None}), {
+            'a': {'prev': None, 'this': 1},
+        })
+        self.assertEqual(utils.compare_dicts(old, dict(old)), {})
+
+    def test_compare_dicts_unhashable(self):
+        old = {'tags': ['a', 'b'], 'meta': {'x': 1, 'y': [1]}, 'same': [1, {'z': 2}]}
+        new = {'tags': ['a'], 'meta': {'x': 1, 'y': [2]}, 'same': [1, {'z': 2}]}
+        self.assertEqual(utils.compare_dicts(old, new), {
+            'tags': {'prev': ['a', 'b'], 'this': ['a']},
+            'meta': {'prev': {'x': 1, 'y': [1]}, 'this': {'x': 1, 'y': [2]}},
+        })
+        self.assertEqual(utils.compare_dicts(old, new, nested=True), {
+            'tags': {'prev': ['a', 'b'], 'this': ['a']},
+            'meta': {'y': {'prev': [1], 'this': [2]}},
+        })
+
+    def test_compare_dicts_nested_empty_old(self):
+        for old in ({}, None):
+            self.assertEqual(
+                utils.compare_dicts({'meta': old}, {'meta': {'x': None}}, nested=True),
+                {'meta': {'prev': old, 'this': {'x': None}}},
+            )
+        self.assertEqual(
+            utils.compare_dicts({'meta': {}}, {'meta': {'x': 1}}, nested=True),
+            utils.compare_dicts({'meta': {}}, {'meta': {'x': 1}}),
+        )
@@ -1,6 +1,10 @@
+from collections import namedtuple
+from contextlib import contextmanager
 import unittest
 from copy import deepcopy
+from datetime import datetime
 
+import mock
 import sqlalchemy as sa
 from sqlalchemy import func, String
 from sqlalchemy.orm import sessionmaker
@@ -16,6 +20,8 @@ import tests
 import versionalchemy as va
 from versionalchemy import utils
 
+ExecutedStatement = namedtuple('ExecutedStatement', ['statement', 'parameters', 'executemany'])
+
 
 class VaTestHelpers(object):
     def _add_and_test_version(self, row, version):
@@ -23,6 +29,35 @@ class VaTestHelpers(object):
         self.session.commit()
         self.assertEqual(row.version(self.session), version)
 
+    def _commit_at(self, t, action=None, *args):
+        """
+        Calls action with args, if given, and commits, with the archive rows written at t
+        seconds after the epoch.
+        """
+        with mock.patch('versionalchemy.models.datetime') as dt:
+            dt.now.return_value = datetime.utcfromtimestamp(t)
+            if action is not None:
+                action(*args)
+            self.session.commit()
+
+    @contextmanager
+    def _record_statements(self, engine=None):
+        """
+        Records the statements executed on engine, self.engine by default, in the block.
+
+        :return: a list the :class:`ExecutedStatement` of each statement is appended to
+        """
+        engine = engine or self.engine
+        statements = []
+
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(ExecutedStatement(statement, parameters, executemany))
+        sa.event.listen(engine, 'before_cursor_execute', on_execute)
+        try:
+            yield statements
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', on_execute)
+
     def _result_to_dict(self, res):
         return utils.result_to_dict(res)
 
@@ -1,7 +1,8 @@
 import sqlalchemy as sa
 from sqlalchemy.orm import Session
 
-from versionalchemy import utils
+from versionalchemy import cache, utils
+from versionalchemy.batch import ArchiveBatch
 from versionalchemy.exceptions import LogTableCreationError
 #from models import VAModelMixin
 from versionalchemy.models import VAModelMixin
@@ -19,6 +20,9 @@ def init():
         return
     _initialized = True
     sa.event.listen(Session, 'after_flush', _after_flush_handler)
+    sa.event.listen(Session, 'after_commit', cache.after_commit_handler)
+    sa.event.listen(Session, 'after_soft_rollback', cache.after_soft_rollback_handler)
+    sa.event.listen(Session, 'after_transaction_end', cache.after_transaction_end_handler)
 
 
 def is_initialized():
@@ -27,6 +31,7 @@ def is_initialized():
 
 
 def _after_flush_handler(session, flush_context):
+    batch = ArchiveBatch(session)
     handlers = [
         (_versioned_delete, session.deleted),
         (_versioned_insert, session.new),
@@ -38,27 +43,17 @@ def _after_flush_handler(session, flush_context):
                 if not hasattr(row, 'ArchiveTable'):
                     raise LogTableCreationError('Need to register va tables!!')
                 user_id = getattr(row, '_updated_by', None)
-                va_id = handler(row, session, user_id)
-                if va_id:
-                    Model = type(row)
-                    where_clause = utils.generate_and_clause(
-                        Model, row, row.va_version_columns
-                    )
-                    session.execute(sa.update(Model, values={'va_id': va_id}).where(where_clause))
-                    row.va_id = va_id
-
-
-def _versioned_delete(row, session, user_id=None):
-    result = session.execute(
-        sa.insert(row.ArchiveTable),
-        row.ArchiveTable.build_row_dict(row, session, deleted=True, user_id=user_id)
-    )
-    # This should not matter since the row is being deleted anyways from the user
-    # table but is here if we ever decide to implement soft deletes on the user table
-    return result.inserted_primary_key[0]
-
-
-def _versioned_update(row, session, user_id=None):
+                handler(row, batch, user_id)
+    batch.execute()
+
+
+def _versioned_delete(row, batch, user_id=None):
+    # Tracking the va_id should not matter since the row is being deleted anyways from the
+    # user table but is here if we ever decide to implement soft deletes on the user table
+    batch.add(row, deleted=True, user_id=user_id)
+
+
+def _versioned_update(row, batch, user_id=None):
     if not utils.is_modified(row, ignore={'va_id'}):
         return
 
@@ -67,23 +62,10 @@ def _versioned_update(row, session, user_id=None):
         hist = getattr(sa.inspect(row).attrs, col).history
         if hist.has_changes():
             # delete the original row from the archive table
-            session.execute(
-                sa.insert(row.ArchiveTable),
-                row.ArchiveTable.build_row_dict(
-                    row, session, user_id=user_id, deleted=True, use_dirty=False
-                )
-            )
-
-    result = session.execute(
-        sa.insert(row.ArchiveTable),
-        row.ArchiveTable.build_row_dict(row, session, user_id=user_id)
-    )
-    return result.inserted_primary_key[0]
-
-
-def _versioned_insert(row, session, user_id=None):
-    result = session.execute(
-        sa.insert(row.ArchiveTable),
-        row.ArchiveTable.build_row_dict(row, session, user_id=user_id)
-    )
-    return result.inserted_primary_key[0]
+            batch.add(row, deleted=True, user_id=user_id, use_dirty=False, track=False)
+
+    batch.add(row, user_id=user_id)
+
+
+def _versioned_insert(row, batch, user_id=None):
+    batch.add(row, user_id=user_id)
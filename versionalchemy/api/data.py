@@ -1,6 +1,9 @@
+import base64
+
+import simplejson as json
 import sqlalchemy as sa
 
-from versionalchemy import utils
+from versionalchemy import delta, utils
 
 
 def delete(va_table, session, conds):
@@ -15,7 +18,8 @@ def delete(va_table, session, conds):
         in this dictionary must be exactly the unique columns that versioning pivots around.
 
     Performs a hard delete on a row, which means the row is deleted from the versionalchemy \
-    table as well as the archive table.
+    table as well as the archive table. The rows of the archive table are evicted from the \
+    model's ``va_cache``, if it has one.
     '''
     with session.begin_nested():
         archive_conds_list = _get_conditions_list(va_table, conds)
@@ -27,6 +31,8 @@ def delete(va_table, session, conds):
         session.execute(
             sa.delete(va_table, whereclause=_get_conditions(conds_list))
         )
+    if va_table.va_cache is not None:
+        va_table.va_cache.invalidate(va_table.ArchiveTable)
 
 
 def get(
@@ -40,6 +46,7 @@ def get(
     include_deleted=True,
     page=1,
     page_size=100,
+    cursor=None,
 ):
     '''
     :param va_table: the model class which inherits from \
@@ -56,7 +63,9 @@ def get(
         this will return the latest data (i.e. time slice of data now). This must either be a \
         valid sql time string or a datetime.datetime object.
     :param fields: a list of strings which corresponds to columns in the table; If \
-        None or unspecified, returns all fields in the table.
+        None or unspecified, returns all fields in the table. If the archive table stores \
+        va_data as :class:`~versionalchemy.utils.NativeJSONDict`, only these fields are read \
+        from the database.
     :param conds: a list of dictionary of key value pairs where keys are columns in the table \
         and values are values the column should take on. If specified, this query will \
         only return rows where the columns meet all the conditions. The columns specified \
@@ -67,38 +76,448 @@ def get(
         the result set will contain results 100 - 199
     :param page_size: upper bound on number of results to display. Note the actual returned result \
         set may be smaller than this due to the roll up.
+    :param cursor: the ``next_cursor`` of the previous page. If specified, page is ignored and \
+        the results start right after the last row of the previous page. Unlike page, this \
+        seeks through the index on the version columns, so deep pages are as fast as the first.
+
+    :return: a :class:`Page` of results
     '''
     limit, offset = _get_limit_and_offset(page, page_size)
+    after = None
+    if cursor is not None:
+        offset = None
+        after = _get_keyset_clause(va_table, session, _decode_cursor(cursor))
     version_col_names = va_table.va_version_columns
+    project = fields is not None and _supports_projection(va_table, session, fields)
+    decoder = None if project else _get_data_decoder(va_table, session)
+    compared = _get_compared_fields(va_table, session, fields, decoder)
     if fields is None:
         fields = [name for name in utils.get_column_names(va_table) if name != 'va_id']
+    columns = _get_select_columns(
+        va_table, session, fields if project else None, raw=decoder is not None,
+        compared=compared,
+    )
 
-    if va_id is not None:
-        return _format_response(utils.result_to_dict(session.execute(
-            sa.select([va_table.ArchiveTable])
-            .where(va_table.ArchiveTable.va_id > va_id)
-            .order_by(*_get_order_clause(va_table.ArchiveTable))
-            .limit(page_size)
-            .offset(offset)
-        )), fields, version_col_names)
+    query = _get_query(
+        va_table, session, va_id, t1, t2, conds, include_deleted, columns, after
+    ).limit(limit).offset(offset)
+    rows = utils.result_to_dict(session.execute(query))
+    # The cursor points at the last row read, even if the roll up drops it from the response
+    next_cursor = None
+    if rows and len(rows) == limit:
+        next_cursor = _encode_cursor(va_table, rows[-1])
+    rows, _ = _load_data(va_table, session, rows, fields, project, decoder, compared=compared)
+    return Page(_format_response(rows, fields, version_col_names), next_cursor)
+
+
+def iter_get(
+    va_table,
+    session,
+    va_id=None,
+    t1=None,
+    t2=None,
+    fields=None,
+    conds=None,
+    include_deleted=True,
+    batch_size=1000,
+):
+    '''
+    Like :func:`get`, but reads every matching row with a single streaming query instead of a
+    page of them, and yields the rows as they are read. At most batch_size rows are held in
+    memory at once, however large the result is. The rows and the roll up of unchanged versions
+    are the same as when paging through :func:`get`.
+
+    The query uses a server side cursor where the driver supports one (e.g. psycopg2 or
+    MySQLdb's SSCursor), so the session's connection is busy until the generator is exhausted
+    or closed. Rebuilding delta encoded rows (see :mod:`versionalchemy.delta`) executes more
+    queries on that connection while the result is open, which MySQL's unbuffered cursors do
+    not allow.
 
-    if t1 is None and t2 is None:
-        rows = _get_latest_time_slice(va_table, session, conds, include_deleted, limit, offset)
-        return _format_response(rows, fields, version_col_names)
+    :param va_table: the model class which inherits from \
+        :class:`~versionalchemy.models.user_table.VAModelMixin` and specifies the model of \
+        the user table from which we are querying
+    :param session: a sqlalchemy session with connections to the database
+    :param va_id: see :func:`get`
+    :param t1: see :func:`get`
+    :param t2: see :func:`get`
+    :param fields: see :func:`get`
+    :param conds: see :func:`get`
+    :param include_deleted: see :func:`get`
+    :param batch_size: the number of rows fetched from the cursor at once
+
+    :return: a generator of results
+    '''
+    version_col_names = va_table.va_version_columns
+    project = fields is not None and _supports_projection(va_table, session, fields)
+    decoder = None if project else _get_data_decoder(va_table, session)
+    compared = _get_compared_fields(va_table, session, fields, decoder)
+    if fields is None:
+        fields = [name for name in utils.get_column_names(va_table) if name != 'va_id']
+    columns = _get_select_columns(
+        va_table, session, fields if project else None, raw=decoder is not None,
+        compared=compared,
+    )
+    query = _get_query(va_table, session, va_id, t1, t2, conds, include_deleted, columns)
+    result = session.execute(query.execution_options(stream_results=True))
+    try:
+        for row in _iter_format_response(
+            _iter_rows(
+                va_table, session, result, fields, project, decoder, batch_size, compared
+            ),
+            fields,
+            version_col_names,
+        ):
+            yield row
+    finally:
+        result.close()
+
+
+def materialize_as_of(va_table, session, t, target, schema=None, batch_size=1000):
+    '''
+    Fills target with the rows of the user table as they were at time t, i.e. with the data of
+    the latest version of each key archived at or before t, unless that version is a delete.
+
+    If the archive table stores va_data as :class:`~versionalchemy.utils.NativeJSONDict`, or as
+    uncompressed JSON text written by one of the built in codecs, the columns are extracted from
+    va_data by the database and target is filled with a single ``INSERT ... SELECT``, so no row
+    is read into Python. Else, e.g. for compressed, custom encoded or delta encoded data, the rows
+    are streamed from the archive table and inserted batch_size rows at a time, with the same
+    caveats as :func:`iter_get`.
+
+    :param va_table: the model class which inherits from \
+        :class:`~versionalchemy.models.user_table.VAModelMixin` and specifies the model of \
+        the user table from which we are querying
+    :param session: a sqlalchemy session with connections to the database
+    :param t: the time of the rows; this must either be a valid sql time string or a \
+        datetime.datetime object.
+    :param target: a :class:`~sqlalchemy.schema.Table` with columns named like the archived \
+        columns of va_table, or the name of a table to create with them. The table is created \
+        if it does not exist, and archived columns it does not have are left out.
+    :param schema: the schema of the table created if target is a name, e.g. that of an \
+        in-memory SQLite database attached to the session's connection
+    :param batch_size: the number of rows inserted at once if they are read into Python
+
+    :return: the target table
+    :rtype: sqlalchemy.schema.Table
+    '''
+    ArchiveTable = va_table.ArchiveTable
+    if not isinstance(target, sa.Table):
+        target = _get_materialized_table(va_table, target, schema)
+    target.create(session.connection(), checkfirst=True)
+    col_names = [
+        col_name for _, col_name in va_table._column_plan().archived if col_name in target.c
+    ]
 
-    if t2 is None:  # return a historical time slice
-        rows = _get_historical_time_slice(
-            va_table, session, t1, conds, include_deleted, limit, offset
+    after = None
+    dialect = utils.get_dialect(session)
+    va_data = ArchiveTable.__table__.c.va_data
+    in_sql = utils.supports_text_json_fields(va_data, dialect) and all(
+        utils.supports_json_key(col_name, dialect) for col_name in col_names
+    )
+    if in_sql or _supports_projection(va_table, session, col_names):
+        va_data = utils.as_json(va_data, dialect)
+        is_delta = utils.json_field(va_data, delta.DELTA_KEY, dialect)
+        columns = [
+            utils.json_value(va_data, col_name, target.c[col_name].type, dialect)
+            for col_name in col_names
+        ]
+        query = _get_historical_time_slice(
+            va_table, session, t, None, False, columns, after=is_delta.is_(None)
         )
-        return _format_response(rows, fields, version_col_names)
+        session.execute(target.insert().from_select(col_names, query.order_by(None)))
+        # Rows written while the archive table had a va_keyframe_interval are rebuilt in Python
+        after = is_delta.isnot(None)
+    query = _get_historical_time_slice(va_table, session, t, None, False, after=after)
+    result = session.execute(query.execution_options(stream_results=True))
+    keys = result.keys()
+    columns = va_table._restore_columns()
+    try:
+        while True:
+            rows = [dict(zip(keys, row)) for row in result.fetchmany(batch_size)]
+            if not rows:
+                break
+            params = []
+            for row in ArchiveTable._rebuild_data(session, rows):
+                # Missing columns are NULL, like they are when extracted in SQL
+                values = va_table._restore_values(columns, row['va_data'], set())
+                params.append({
+                    col_name: values[attr_name]
+                    for attr_name, col_name, _, _ in columns if col_name in target.c
+                })
+            session.execute(target.insert(), params)
+    finally:
+        result.close()
+    return target
+
+
+def _get_materialized_table(va_table, name, schema=None):
+    '''
+    Returns a table named name with a column for each archived column of va_table, with the
+    same type, nullability and primary key, but no other constraints or indexes.
+    '''
+    mapper = sa.inspect(va_table)
+    columns = []
+    for attr_name, col_name in va_table._column_plan().archived:
+        column = mapper.get_property(attr_name).columns[0]
+        columns.append(sa.Column(
+            col_name,
+            column.type,
+            primary_key=column.primary_key,
+            nullable=column.nullable,
+            autoincrement=False,
+        ))
+    return sa.Table(name, sa.MetaData(), *columns, schema=schema)
+
+
+class Page(list):
+    '''
+    A list of results from :func:`get`. ``next_cursor`` is passed as the cursor of the next call
+    to get the following page; it is None on the last page.
+    '''
+
+    def __init__(self, rows, next_cursor=None):
+        super(Page, self).__init__(rows)
+        self.next_cursor = next_cursor
+
+
+def _get_cursor_col_names(va_table):
+    '''
+    Returns the names of the columns results are ordered by, in order.
+    '''
+    return sorted(va_table.ArchiveTable._version_col_names) + ['va_version']
+
+
+def _encode_cursor(va_table, row):
+    values = [row[col_name] for col_name in _get_cursor_col_names(va_table)]
+    return base64.urlsafe_b64encode(
+        json.dumps(values, cls=utils.VAJSONEncoder).encode('utf8')
+    ).decode('ascii')
 
-    if t1 is None:
-        t1 = 0
 
-    rows = _get_historical_changes(
-        va_table, session, conds, t1, t2, include_deleted, limit, offset
+def _decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor {!r}'.format(cursor))
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor {!r}'.format(cursor))
+    return values
+
+
+def _get_keyset_clause(va_table, session, values):
+    '''
+    Returns a condition selecting the rows which come after values in the order of
+    :func:`_get_order_clause`.
+    '''
+    ArchiveTable = va_table.ArchiveTable
+    col_names = _get_cursor_col_names(va_table)
+    if len(values) != len(col_names):
+        raise ValueError('The cursor does not match the version columns of {}'.format(
+            va_table.__name__
+        ))
+    columns = [getattr(ArchiveTable, col_name) for col_name in col_names]
+    if utils.supports_tuple_in(utils.get_dialect(session)):
+        return sa.tuple_(*columns) > sa.tuple_(*values)
+    # (a, b) > (x, y) is a > x or (a = x and b > y)
+    return sa.or_(*(
+        sa.and_(*[c == v for c, v in zip(columns[:i], values[:i])] + [columns[i] > values[i]])
+        for i in range(len(columns))
+    ))
+
+
+def _supports_projection(va_table, session, fields):
+    '''
+    Returns True if fields, requested from the archive table of va_table, can be extracted
+    from va_data in SQL. Delta encoded archive tables need the full data to rebuild rows.
+    '''
+    ArchiveTable = va_table.ArchiveTable
+    dialect = utils.get_dialect(session)
+    return not ArchiveTable.va_keyframe_interval and utils.supports_json_fields(
+        ArchiveTable.__table__.c.va_data, dialect
+    ) and all(utils.supports_json_key(field, dialect) for field in fields)
+
+
+def _get_data_decoder(va_table, session):
+    '''
+    Returns a function decoding va_data of the archive table of va_table as it is stored, if
+    the rows of the table can be compared by their stored va_data (see
+    :func:`_drop_unchanged_data`), else None.
+    '''
+    ArchiveTable = va_table.ArchiveTable
+    if ArchiveTable.va_keyframe_interval:
+        # Deltas need their previous version to be rebuilt, so none are dropped
+        return None
+    dialect = utils.get_dialect(session)
+    column_type = ArchiveTable.__table__.c.va_data.type.dialect_impl(dialect)
+    # Native JSON is decoded by the driver or the JSON type, so is never read as stored
+    if not isinstance(column_type, sa.types.TypeDecorator) or \
+            isinstance(column_type.impl, sa.types.JSON):
+        return None
+
+    def decode(value):
+        return column_type.process_result_value(value, dialect)
+    return decode
+
+
+def _get_compared_fields(va_table, session, fields, decoder):
+    '''
+    Returns fields if rows read with decoder can be compared by the values of fields extracted
+    in SQL from their stored va_data (see :func:`_drop_unchanged_data`), else None.
+    '''
+    if fields is None or decoder is None:
+        return None
+    va_data = va_table.ArchiveTable.__table__.c.va_data
+    dialect = utils.get_dialect(session)
+    if not utils.supports_text_json_fields(va_data, dialect) or \
+            not all(utils.supports_json_key(field, dialect) for field in fields):
+        return None
+    return fields
+
+
+def _get_select_columns(va_table, session, fields=None, raw=False, compared=None):
+    '''
+    Returns the columns to select from the archive table of va_table. If fields is specified,
+    va_data is replaced by the value of each field, labeled ``va_field_<index>``, and by the
+    delta marker of the row, labeled ``va_is_delta``. Else if raw is ``True``, va_data is
+    selected as it is stored, to be decoded by :func:`_get_data_decoder`, along with the value
+    of each of the compared fields, labeled ``va_field_<index>``.
+    '''
+    ArchiveTable = va_table.ArchiveTable
+    if fields is None:
+        if not raw:
+            return [ArchiveTable]
+        dialect = utils.get_dialect(session)
+        stored_type = ArchiveTable.__table__.c.va_data.type.dialect_impl(dialect).impl
+        va_data = utils.as_json(ArchiveTable.__table__.c.va_data, dialect)
+        return [
+            sa.type_coerce(c, stored_type).label(c.name) if c.name == 'va_data' else c
+            for c in ArchiveTable.__table__.c
+        ] + [
+            # Compared as the database returns them, without decoding
+            sa.type_coerce(utils.json_field(va_data, field, dialect), sa.UnicodeText)
+            .label('va_field_{}'.format(i))
+            for i, field in enumerate(compared or ())
+        ]
+    dialect = utils.get_dialect(session)
+    mapper = sa.inspect(va_table)
+    column_types = {
+        col_name: mapper.get_property(attr_name).columns[0].type
+        for attr_name, col_name in va_table._column_plan().archived
+    }
+    columns = [c for c in ArchiveTable.__table__.c if c.name != 'va_data']
+    columns.extend(
+        utils.json_field(
+            ArchiveTable.va_data, field, dialect, column_types.get(field)
+        ).label('va_field_{}'.format(i))
+        for i, field in enumerate(fields)
+    )
+    columns.append(
+        utils.json_field(ArchiveTable.va_data, delta.DELTA_KEY, dialect).label('va_is_delta')
     )
-    return _format_response(rows, fields, version_col_names)
+    return columns
+
+
+def _load_data(va_table, session, rows, fields, project, decoder, previous=None, compared=None):
+    '''
+    Replaces the va_data of rows selected with the columns of :func:`_get_select_columns` by
+    the full data of the version.
+
+    :param previous: the state returned for the rows before these, if they are read in batches
+    :param compared: the fields selected to compare rows by, see :func:`_get_compared_fields`
+
+    :return: the rows, some of which may be dropped by :func:`_drop_unchanged_data`, and the \
+        state to pass with the next batch
+    '''
+    if project:
+        return _unpack_fields(va_table, session, rows, fields), None
+    carry, last = previous or (None, None)
+    if decoder is not None:
+        rows, last = _drop_unchanged_data(rows, va_table.va_version_columns, last, compared)
+        for row in rows:
+            row['va_data'] = decoder(row['va_data'])
+    if not rows:
+        return rows, (carry, last)
+    if carry is None:
+        rows = va_table.ArchiveTable._rebuild_data(session, rows)
+    else:
+        # The first deltas of a batch are applied to the last row of the previous one instead
+        # of being read back to their keyframe again
+        rows = va_table.ArchiveTable._rebuild_data(session, [carry] + rows)[1:]
+    return rows, (rows[-1], last)
+
+
+def _drop_unchanged_data(rows, unique_col_names, last=None, compared=None):
+    '''
+    Drops the rows whose va_deleted and data are the same as those of the previous row of the
+    same key, before their data is decoded. :func:`_format_response` would roll them up. The
+    data is compared by the values of the compared fields if they were selected, else by the
+    stored va_data, so only versions where every field is unchanged are dropped.
+
+    :param last: the state returned for the rows before these, if they are read in batches
+    :param compared: the fields selected to compare rows by, see :func:`_get_compared_fields`
+
+    :return: the remaining rows and the state to pass with the next batch
+    '''
+    kept = []
+    for row in rows:
+        if compared:
+            data = tuple(row.pop('va_field_{}'.format(i)) for i in range(len(compared)))
+        else:
+            data = row['va_data']
+        state = (tuple(row[k] for k in unique_col_names), row['va_deleted'], data)
+        if state != last:
+            kept.append(row)
+            last = state
+    return kept, last
+
+
+def _unpack_fields(va_table, session, rows, fields):
+    '''
+    Collects the fields selected by :func:`_get_select_columns` into va_data. Rows which are
+    delta encoded (e.g. written while the archive table had a ``va_keyframe_interval``) are
+    read in full and rebuilt.
+    '''
+    delta_rows = []
+    for row in rows:
+        row['va_data'] = {
+            field: row.pop('va_field_{}'.format(i)) for i, field in enumerate(fields)
+        }
+        if row.pop('va_is_delta') is not None:
+            delta_rows.append(row)
+    if delta_rows:
+        ArchiveTable = va_table.ArchiveTable
+        datas = {}
+        va_ids = [row['va_id'] for row in delta_rows]
+        for chunk in utils.chunked(va_ids, utils.IN_CLAUSE_CHUNK_SIZE):
+            datas.update(session.execute(
+                sa.select([ArchiveTable.va_id, ArchiveTable.va_data])
+                .where(ArchiveTable.va_id.in_(chunk))
+            ).fetchall())
+        for row in delta_rows:
+            row['va_data'] = datas[row['va_id']]
+        ArchiveTable._rebuild_data(session, delta_rows)
+        for row in delta_rows:
+            row['va_data'] = {field: row['va_data'].get(field) for field in fields}
+    return rows
+
+
+def _iter_rows(va_table, session, result, fields, project, decoder, batch_size, compared=None):
+    '''
+    Yields the rows of result as dictionaries with full va_data, fetching batch_size rows at a
+    time.
+    '''
+    keys = result.keys()
+    previous = None
+    while True:
+        rows = [dict(zip(keys, row)) for row in result.fetchmany(batch_size)]
+        if not rows:
+            return
+        rows, previous = _load_data(
+            va_table, session, rows, fields, project, decoder, previous, compared
+        )
+        for row in rows:
+            yield row
+
 
 def _format_response(rows, fields, unique_col_names):
     '''
@@ -122,26 +541,27 @@ def _format_response(rows, fields, unique_col_names):
     Note that some versions may be omitted in the output for the same key if the specified fields
     were not changed between versions.
     '''
-    output = []
-    old_id = None
+    return list(_iter_format_response(rows, fields, unique_col_names))
+
+
+def _iter_format_response(rows, fields, unique_col_names):
+    '''
+    Yields the results of :func:`_format_response` one at a time. Only the last result is kept
+    to roll up the versions after it, so rows may be any iterable.
+    '''
+    last = None
     for row in rows:
-        id_ = {k: row[k] for k in unique_col_names}
-        formatted = {k: row[k] for k in row if k != 'va_data'}
-        if id_ != old_id:  # new unique versioned row
-            data = row['va_data']
-            formatted['va_data'] = {k: data.get(k) for k in fields}
-            output.append(formatted)
-        else:
-            data = row['va_data']
-            pruned_data = {k: data.get(k) for k in fields}
-            if (
-                pruned_data != output[-1]['va_data'] or
-                row['va_deleted'] != output[-1]['va_deleted']
-            ):
-                formatted['va_data'] = pruned_data
-                output.append(formatted)
-        old_id = id_
-    return output
+        data = row['va_data']
+        if (
+            last is not None and
+            row['va_deleted'] == last['va_deleted'] and
+            all(row[k] == last[k] for k in unique_col_names) and
+            all(data.get(k) == last['va_data'][k] for k in fields)
+        ):
+            continue
+        last = {k: row[k] for k in row if k != 'va_data'}
+        last['va_data'] = {k: data.get(k) for k in fields}
+        yield last
 
 
 def _get_conditions(pk_conds, and_conds=None):
@@ -197,36 +617,121 @@ def _get_conditions_list(va_table, conds, archive=True):
     return all_conditions
 
 
-def _get_historical_changes(va_table, session, conds, t1, t2, include_deleted, limit, offset):
-    pk_conditions = _get_conditions_list(va_table, conds)
-    and_clause = _get_conditions(
-        pk_conditions,
-        [va_table.ArchiveTable.va_updated_at >= t1, va_table.ArchiveTable.va_updated_at < t2] +
-        [] if include_deleted else [va_table.ArchiveTable.va_deleted.is_(False)],
+def _get_query(
+    va_table, session, va_id, t1, t2, conds, include_deleted, columns=None, after=None
+):
+    '''
+    Returns the query selecting the rows :func:`get` returns, in the order of
+    :func:`_get_order_clause`, without a limit.
+    '''
+    if va_id is not None:
+        query = (
+            sa.select(columns or [va_table.ArchiveTable])
+            .where(va_table.ArchiveTable.va_id > va_id)
+            .order_by(*_get_order_clause(va_table.ArchiveTable))
+        )
+        if after is not None:
+            query = query.where(after)
+        return query
+    elif t1 is None and t2 is None:
+        return _get_latest_time_slice(va_table, session, conds, include_deleted, columns, after)
+    elif t2 is None:  # return a historical time slice
+        return _get_historical_time_slice(
+            va_table, session, t1, conds, include_deleted, columns, after
+        )
+    if t1 is None:
+        t1 = 0
+    return _get_historical_changes(
+        va_table, session, conds, t1, t2, include_deleted, columns, after
     )
 
-    return utils.result_to_dict(session.execute(
-        sa.select([va_table.ArchiveTable])
+
+def _get_historical_changes(
+    va_table, session, conds, t1, t2, include_deleted, columns=None, after=None
+):
+    at = va_table.ArchiveTable
+    pk_conditions = _get_conditions_list(va_table, conds)
+    and_conds = [at.va_updated_at >= t1, at.va_updated_at < t2]
+    if not include_deleted:
+        and_conds.append(at.va_deleted.is_(False))
+    and_clause = _get_conditions(pk_conditions, and_conds)
+    if after is not None:
+        and_clause = sa.and_(and_clause, after)
+
+    return (
+        sa.select(columns or [at])
         .where(and_clause)
-        .order_by(*_get_order_clause(va_table.ArchiveTable))
-        .limit(limit)
-        .offset(offset)
-    ))
+        .order_by(*_get_order_clause(at))
+    )
+
 
+# How _get_historical_time_slice finds the latest version of each key at a time:
+#   - TIME_SLICE_WINDOW: numbers the versions of each key, newest first, with ROW_NUMBER()
+#   - TIME_SLICE_MAX: joins each key to its maximum version in a grouped subquery
+#   - TIME_SLICE_JOIN: outer joins each version to the newer versions of its key and keeps the
+#   versions without one; this is quadratic in the number of versions per key
+# By default, TIME_SLICE_WINDOW is used where the dialect supports window functions and
+# TIME_SLICE_MAX otherwise. SQLite always uses TIME_SLICE_MAX, which it answers from the unique
+# index on the version columns and va_version several times faster than the window (see
+# benchmarks/time_slice.py).
+TIME_SLICE_WINDOW = 'window'
+TIME_SLICE_MAX = 'max'
+TIME_SLICE_JOIN = 'join'
 
-def _get_historical_time_slice(va_table, session, t, conds, include_deleted, limit, offset):
+
+def _get_historical_time_slice(
+    va_table, session, t, conds, include_deleted, columns=None, after=None, strategy=None
+):
     at = va_table.ArchiveTable
     vc = va_table.va_version_columns
-    pk_conditions = _get_conditions_list(va_table, conds)
-    and_clause = _get_conditions(
-        pk_conditions,
-        [at.va_updated_at <= t] +
-        [] if include_deleted else [va_table.ArchiveTable.va_deleted.is_(False)],
+    if strategy is None:
+        dialect = utils.get_dialect(session)
+        if dialect.name != 'sqlite' and utils.supports_window_functions(dialect):
+            strategy = TIME_SLICE_WINDOW
+        else:
+            strategy = TIME_SLICE_MAX
+    # The versions of a key before t, of which the latest is selected
+    versions_clause = _get_conditions(
+        _get_conditions_list(va_table, conds), [at.va_updated_at <= t]
     )
-    t2 = at.__table__.alias('t2')
-    return utils.result_to_dict(session.execute(
-        sa.select([at])
-        .select_from(at.__table__.join(
+    and_clause = sa.and_() if include_deleted else at.va_deleted.is_(False)
+    if after is not None:
+        and_clause = sa.and_(and_clause, after)
+
+    if strategy == TIME_SLICE_WINDOW:
+        row_number = sa.func.row_number().over(
+            partition_by=[getattr(at, c) for c in vc],
+            order_by=at.va_version.desc(),
+        )
+        latest = (
+            sa.select([at.va_id, row_number.label('va_row_number')])
+            .where(versions_clause)
+            .alias('latest')
+        )
+        from_clause = at.__table__.join(
+            latest,
+            sa.and_(at.va_id == latest.c.va_id, latest.c.va_row_number == 1),
+        )
+    elif strategy == TIME_SLICE_MAX:
+        latest = (
+            sa.select(
+                [getattr(at, c) for c in vc] +
+                [sa.func.max(at.va_version).label('va_version')]
+            )
+            .where(versions_clause)
+            .group_by(*[getattr(at, c) for c in vc])
+            .alias('latest')
+        )
+        from_clause = at.__table__.join(
+            latest,
+            sa.and_(
+                at.va_version == latest.c.va_version,
+                *[getattr(at, c) == getattr(latest.c, c) for c in vc]
+            ),
+        )
+    elif strategy == TIME_SLICE_JOIN:
+        t2 = at.__table__.alias('t2')
+        from_clause = at.__table__.join(
             t2,
             sa.and_(
                 t2.c.va_updated_at <= t,
@@ -234,21 +739,29 @@ def _get_historical_time_slice(va_table, session, t, conds, include_deleted, lim
                 *[getattr(at, c) == getattr(t2.c, c) for c in vc]
             ),
             isouter=True,
-        ))
-        .where(t2.c.va_version.is_(None) & and_clause)
+        )
+        and_clause = sa.and_(versions_clause, t2.c.va_version.is_(None), and_clause)
+    else:
+        raise ValueError('Unknown time slice strategy {!r}'.format(strategy))
+    return (
+        sa.select(columns or [at])
+        .select_from(from_clause)
+        .where(and_clause)
         .order_by(*_get_order_clause(at))
-        .limit(limit)
-        .offset(offset)
-    ))
+    )
 
 
-def _get_latest_time_slice(va_table, session, conds, include_deleted, limit, offset):
+def _get_latest_time_slice(
+    va_table, session, conds, include_deleted, columns=None, after=None
+):
     and_clause = _get_conditions(
         _get_conditions_list(va_table, conds, archive=False),
         [] if include_deleted else [va_table.ArchiveTable.va_deleted.is_(False)],
     )
-    result = session.execute(
-        sa.select([va_table.ArchiveTable]).select_from(
+    if after is not None:
+        and_clause = sa.and_(and_clause, after)
+    return (
+        sa.select(columns or [va_table.ArchiveTable]).select_from(
             va_table.ArchiveTable.__table__.join(
                 va_table,
                 va_table.ArchiveTable.va_id == va_table.va_id
@@ -256,10 +769,7 @@ def _get_latest_time_slice(va_table, session, conds, include_deleted, limit, off
         )
         .where(and_clause)
         .order_by(*_get_order_clause(va_table.ArchiveTable))
-        .limit(limit)
-        .offset(offset)
     )
-    return utils.result_to_dict(result)
 
 
 def _get_limit_and_offset(page, page_size):
@@ -276,10 +786,12 @@ def _get_limit_and_offset(page, page_size):
 def _get_order_clause(archive_table):
     '''
     Returns an ascending order clause on the versioned unique constraint as well as the
-    version column.
+    version column. The version columns are sorted by name so the order, and the cursors built
+    from it, are the same in every process.
     '''
     order_clause = [
-        sa.asc(getattr(archive_table, col_name)) for col_name in archive_table._version_col_names
+        sa.asc(getattr(archive_table, col_name))
+        for col_name in sorted(archive_table._version_col_names)
     ]
     order_clause.append(sa.asc(archive_table.va_version))
     return order_clause
@@ -0,0 +1,303 @@
+from collections import OrderedDict
+
+import simplejson as json
+import sqlalchemy as sa
+
+from versionalchemy import delta, utils
+
+VERSION_MODE_MAX = 'max'
+VERSION_MODE_POINTER = 'pointer'
+
+
+class ArchiveBatch(object):
+    """
+    Collects the archive rows generated during a single flush and writes them with one
+    executemany per archive table, instead of one INSERT round trip per versioned row.
+
+    The versions of all collected rows are looked up with one grouped query per archive table
+    once the batch is executed. Rows are written in the order they were added, so a key touched
+    several times in the same flush (e.g. a delete followed by an insert) still gets consecutive
+    versions.
+    """
+
+    def __init__(self, session, use_outbox=True):
+        """
+        :param session: the session being flushed
+        :param use_outbox: if ``True``, changes to models registered with an outbox are written \
+            to the outbox instead of the archive table.
+        """
+        self.session = session
+        self.use_outbox = use_outbox
+        self._entries = OrderedDict()
+
+    def add(self, row, deleted=False, user_id=None, use_dirty=True, track=True):
+        """
+        :param row: the row from the user table
+        :param deleted: whether or not the row is deleted
+        :param user_id: the user that is performing the change on this row
+        :param use_dirty: whether to use the dirty fields from row or not
+        :param track: if ``True``, the va_id of the archive row will be written back to the \
+            user row once the batch has been executed.
+        """
+        ArchiveTable = row.ArchiveTable
+        key = tuple(
+            utils.get_column_attribute(row, col_name, use_dirty=use_dirty)
+            for col_name in ArchiveTable._version_col_names
+        )
+        # The committed state of the row is the data of its previous version, unless the row
+        # is new or moves to a different key
+        has_base = False
+        if ArchiveTable.va_keyframe_interval and not sa.inspect(row).pending:
+            has_base = not use_dirty or not _version_columns_changed(row)
+        pointer = None
+        if row.va_version_mode == VERSION_MODE_POINTER:
+            # The committed va_id points at the newest archive row of the committed key, so it
+            # is only usable if we are archiving that key
+            va_id = utils.get_column_attribute(row, 'va_id', use_dirty=False)
+            if va_id and (not use_dirty or not _version_columns_changed(row)):
+                pointer = va_id
+        self._entries.setdefault(ArchiveTable, []).append({
+            'Model': type(row),
+            'row': row,
+            'key': key,
+            'pointer': pointer,
+            'deleted': deleted,
+            'user_id': user_id,
+            'use_dirty': use_dirty,
+            'track': track,
+            'has_base': has_base,
+        })
+
+    def add_data(
+        self,
+        Model,
+        key,
+        data,
+        deleted=False,
+        user_id=None,
+        pointer=None,
+        track=True,
+        updated_at=None,
+        base=None,
+    ):
+        """
+        Like :meth:`add`, for changes which were not made through ORM objects.
+
+        :param Model: the user table model
+        :param key: a dictionary with the value of each of Model.va_version_columns
+        :param data: the archived representation of the row, as built by \
+            :meth:`~versionalchemy.models.VAModelMixin._to_dict`
+        :param deleted: whether or not the row is deleted
+        :param user_id: the user that is performing the change on this row
+        :param pointer: the va_id of the newest archive row for this key, if it is known
+        :param track: if ``True``, the va_id of the archive row will be written back to the \
+            user row once the batch has been executed.
+        :param updated_at: when the change was made; defaults to now
+        :param base: the data of the previous version of this key, if it is known. Archive \
+            tables with a ``va_keyframe_interval`` only store the changes relative to it.
+        """
+        ArchiveTable = Model.ArchiveTable
+        if Model.va_version_mode != VERSION_MODE_POINTER:
+            pointer = None
+        self._entries.setdefault(ArchiveTable, []).append({
+            'Model': Model,
+            'row': None,
+            'key': tuple(key[col_name] for col_name in ArchiveTable._version_col_names),
+            'data': data,
+            'pointer': pointer or None,
+            'deleted': deleted,
+            'user_id': user_id,
+            'track': track,
+            'updated_at': updated_at,
+            'base': base,
+        })
+
+    def _allocate_versions(self, ArchiveTable, entries):
+        """
+        :return: the version of the archive row of each entry, in the same order as entries
+        :rtype: list
+        """
+        # The first entry of each key decides how the key's latest version is found
+        first_entries = OrderedDict()
+        for entry in entries:
+            first_entries.setdefault(entry['key'], entry)
+
+        pointers = [e['pointer'] for e in first_entries.values() if e['pointer'] is not None]
+        pointed_versions = ArchiveTable._versions_of(self.session, pointers)
+        latest = {}
+        unresolved = []
+        for key, entry in first_entries.items():
+            if entry['pointer'] in pointed_versions:
+                latest[key] = pointed_versions[entry['pointer']]
+            else:
+                unresolved.append(key)
+        latest.update(ArchiveTable._latest_versions(self.session, unresolved))
+
+        versions = []
+        for entry in entries:
+            version = latest.get(entry['key'])
+            version = 0 if version is None else version + 1
+            latest[entry['key']] = version
+            versions.append(version)
+        return versions
+
+    def execute(self):
+        """
+        Inserts all collected archive rows and points the tracked user rows at their newest
+        archive row.
+        """
+        pointed = OrderedDict()
+        for ArchiveTable, entries in self._entries.items():
+            Outbox = entries[0]['Model'].va_outbox
+            if self.use_outbox and Outbox is not None:
+                self._insert_outbox(Outbox, ArchiveTable, entries)
+                continue
+
+            versions = self._allocate_versions(ArchiveTable, entries)
+            rows = [
+                self._build_row_dict(ArchiveTable, entry, version)
+                for entry, version in zip(entries, versions)
+            ]
+            if ArchiveTable.va_keyframe_interval:
+                self._encode_deltas(ArchiveTable, entries, versions, rows)
+            va_ids = self._insert(ArchiveTable, rows)
+            self._expire_versions(ArchiveTable, entries)
+            for entry, version, va_id in zip(entries, versions, va_ids):
+                if not entry['track']:
+                    continue
+                if entry['row'] is not None:
+                    entry['row'].va_id = va_id
+                    # Stored as loaded, so row.version() needs no query
+                    sa.orm.attributes.set_committed_value(entry['row'], 'va_version', version)
+                # The user row of a delete is gone, there is nothing to point
+                if not entry['deleted']:
+                    params = {'va_new_id': va_id}
+                    for col_name, value in zip(ArchiveTable._version_col_names, entry['key']):
+                        params['va_key_' + col_name] = value
+                    pointed.setdefault(entry['Model'], []).append(params)
+        for Model, params in pointed.items():
+            self._update_pointers(Model, params)
+        self._entries.clear()
+
+    def _expire_versions(self, ArchiveTable, entries):
+        """
+        Expires va_id and va_version of the instances in the session's identity map whose key
+        gets a new version from an entry which was not added through the instance itself (e.g.
+        by :meth:`~versionalchemy.models.VAModelMixin.va_bulk_update_mappings`), so
+        ``version()`` reads them again.
+        """
+        keys = set(entry['key'] for entry in entries if entry['row'] is None)
+        if not keys:
+            return
+        Models = tuple(set(entry['Model'] for entry in entries))
+        utils.expire_by_keys(
+            self.session, Models, list(ArchiveTable._version_col_names), keys,
+            ['va_id', 'va_version'],
+        )
+
+    def _insert_outbox(self, Outbox, ArchiveTable, entries):
+        """
+        Writes compact entries for the archive rows to the outbox with a single executemany;
+        versions are allocated once an :class:`~versionalchemy.outbox.OutboxWorker` applies them.
+        """
+        outbox_rows = []
+        for entry in entries:
+            row = self._build_row_dict(ArchiveTable, entry, None)
+            key = {col_name: row[col_name] for col_name in ArchiveTable._version_col_names}
+            outbox_rows.append({
+                'va_table': ArchiveTable.__table__.fullname,
+                'va_key': json.dumps(key, sort_keys=True, cls=utils.VAJSONEncoder),
+                'va_updated_at': row['va_updated_at'],
+                'va_entry': {
+                    'key': key,
+                    'data': row['va_data'],
+                    'deleted': entry['deleted'],
+                    'user_id': entry['user_id'],
+                    'track': entry['track'],
+                },
+            })
+            # Any version loaded with the user row is stale until the worker applies the entry
+            if entry['row'] is not None:
+                sa.orm.attributes.instance_dict(entry['row']).pop('va_version', None)
+        self.session.execute(sa.insert(Outbox), outbox_rows)
+
+    def _encode_deltas(self, ArchiveTable, entries, versions, rows):
+        """
+        Replaces the data of every row which is not a keyframe, and whose previous version is
+        known, with the changes since that version.
+        """
+        interval = ArchiveTable.va_keyframe_interval
+        dialect = utils.get_dialect(self.session)
+        previous = {}
+        for entry, version, row in zip(entries, versions, rows):
+            data = row['va_data']
+            # Earlier entries of the same key in this batch are exactly the previous version
+            base = previous.get(entry['key'])
+            if base is None:
+                base = entry.get('base')
+            if base is None and entry.get('has_base'):
+                base = entry['row']._to_dict(dialect, use_dirty=False)
+            previous[entry['key']] = data
+            if base is not None and version % interval:
+                row['va_data'] = delta.make_delta(base, data)
+
+    def _build_row_dict(self, ArchiveTable, entry, version):
+        if entry['row'] is None:
+            return ArchiveTable.build_row_dict_from_data(
+                dict(zip(ArchiveTable._version_col_names, entry['key'])),
+                entry['data'],
+                deleted=entry['deleted'],
+                user_id=entry['user_id'],
+                version=version,
+                updated_at=entry['updated_at'],
+            )
+        return ArchiveTable.build_row_dict(
+            entry['row'],
+            self.session,
+            deleted=entry['deleted'],
+            user_id=entry['user_id'],
+            use_dirty=entry['use_dirty'],
+            version=version,
+        )
+
+    def _update_pointers(self, Model, params):
+        """
+        Writes the new va_ids back to the user table with a single executemany.
+
+        :param params: a list of dictionaries with the new va_id under ``va_new_id`` and the \
+            value of each version column under ``va_key_<column name>``
+        """
+        where_clause = sa.and_(*(
+            getattr(Model, col_name) == sa.bindparam('va_key_' + col_name)
+            for col_name in Model.va_version_columns
+        ))
+        self.session.execute(
+            sa.update(Model).where(where_clause).values(va_id=sa.bindparam('va_new_id')),
+            params,
+        )
+
+    def _insert(self, ArchiveTable, rows):
+        """
+        :return: the va_id of each inserted row, in the same order as rows
+        :rtype: list
+        """
+        if len(rows) == 1:
+            result = self.session.execute(sa.insert(ArchiveTable), rows[0])
+            return [result.inserted_primary_key[0]]
+
+        # executemany does not report the generated primary keys, so look them up through
+        # the unique constraint on (version columns, va_version)
+        self.session.execute(sa.insert(ArchiveTable), rows)
+        col_names = list(ArchiveTable._version_col_names) + ['va_version']
+        columns = [getattr(ArchiveTable, col_name) for col_name in col_names]
+        keys = [tuple(row[col_name] for col_name in col_names) for row in rows]
+        va_ids = utils.select_by_keys(self.session, columns, keys, [ArchiveTable.va_id])
+        return [va_ids[key][0] for key in keys]
+
+
+def _version_columns_changed(row):
+    ins = sa.inspect(row)
+    return any(
+        getattr(ins.attrs, col_name).history.has_changes()
+        for col_name in row.va_version_columns
+    )
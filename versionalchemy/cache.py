@@ -0,0 +1,115 @@
+from collections import OrderedDict
+import copy
+import threading
+
+# The key under which a session's info holds the entries cached during its transaction
+SESSION_INFO_KEY = 'va_cached_rows'
+
+
+class ArchiveRowCache(object):
+    """
+    An in-process, size bounded LRU cache of archive rows with their full data, keyed by
+    archive table and va_id. Archive rows never change once written, so entries are only
+    evicted by size, by :func:`versionalchemy.api.data.delete` and when the transaction which
+    read them ends without a commit (in case it also wrote them). A cache can be shared by any
+    number of models:
+
+    .. code-block:: python
+
+        cache = ArchiveRowCache(maxsize=10000)
+        Example.register(ExampleArchive, engine, cache=cache)
+
+    Rows are copied in and out of the cache, so callers may modify the rows they get.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        :param maxsize: the maximum number of rows held; the least recently used rows are \
+            evicted first
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, ArchiveTable, va_id):
+        """
+        :return: a copy of the cached row of ArchiveTable with va_id, or None if it is not cached
+        :rtype: dict
+        """
+        key = (ArchiveTable, va_id)
+        with self._lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Reinserting marks the row as the most recently used
+            self._rows[key] = row
+        return copy.deepcopy(row)
+
+    def put(self, ArchiveTable, row, session=None):
+        """
+        :param row: a dictionary of the columns of an archive row, with its full va_data
+        :param session: the session the row was read with; if specified, the row is evicted \
+            if the session's transaction ends without a commit
+        """
+        key = (ArchiveTable, row['va_id'])
+        row = copy.deepcopy(row)
+        with self._lock:
+            self._rows.pop(key, None)
+            self._rows[key] = row
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+        if session is not None:
+            session.info.setdefault(SESSION_INFO_KEY, []).append((self, key))
+
+    def invalidate(self, ArchiveTable, va_ids=None):
+        """
+        Evicts the rows of ArchiveTable with one of va_ids, or all of its rows if va_ids is None.
+        """
+        with self._lock:
+            if va_ids is None:
+                keys = [key for key in self._rows if key[0] is ArchiveTable]
+            else:
+                keys = [(ArchiveTable, va_id) for va_id in va_ids]
+            for key in keys:
+                self._rows.pop(key, None)
+
+    def clear(self):
+        """
+        Evicts every row and resets the counters.
+        """
+        with self._lock:
+            self._rows.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def _invalidate_session_rows(session):
+    for cache, (ArchiveTable, va_id) in session.info.pop(SESSION_INFO_KEY, ()):
+        cache.invalidate(ArchiveTable, [va_id])
+
+
+def after_commit_handler(session):
+    # after_commit also fires when a SAVEPOINT is released, while the transaction is still
+    # being committed; the rows read in it could still be rolled back with its root
+    transaction = session.transaction
+    if transaction is not None and transaction.parent is not None:
+        return
+    # The rows read in the transaction are committed, whether or not it wrote them
+    session.info.pop(SESSION_INFO_KEY, None)
+
+
+def after_soft_rollback_handler(session, previous_transaction):
+    _invalidate_session_rows(session)
+
+
+def after_transaction_end_handler(session, transaction):
+    # Rows read in a transaction which was closed without a commit may have been written by it
+    if transaction.parent is None:
+        _invalidate_session_rows(session)
@@ -0,0 +1,62 @@
+"""
+Helpers for delta encoded archive rows.
+
+An archive table with ``va_keyframe_interval`` set stores only the columns which changed since
+the previous version of a key, e.g. ``{'__va_delta__': {'col1': 'new value'}}``, plus the names
+of columns which no longer exist under ``'__va_unset__'``. Every version which is a multiple of
+the interval, and every version whose previous data was not known when it was written, stores
+the full row (a keyframe) instead, so rebuilding a row never needs more than the versions since
+the last keyframe.
+"""
+DELTA_KEY = '__va_delta__'
+UNSET_KEY = '__va_unset__'
+
+
+def is_delta(data):
+    """
+    :param data: the va_data of an archive row
+
+    :return: True if data only holds the changes since the previous version
+    :rtype: bool
+    """
+    return data is not None and DELTA_KEY in data
+
+
+def make_delta(base, data):
+    """
+    :param base: the full data of the previous version
+    :param data: the full data of the new version
+
+    :return: the delta encoded form of data, relative to base
+    :rtype: dict
+    """
+    delta = {DELTA_KEY: {k: v for k, v in data.items() if k not in base or base[k] != v}}
+    unset = sorted(k for k in base if k not in data)
+    if unset:
+        delta[UNSET_KEY] = unset
+    return delta
+
+
+def apply_delta(base, data):
+    """
+    :param base: the full data of the previous version
+    :param data: delta encoded data, as returned by :func:`make_delta`
+
+    :return: the full data of the new version
+    :rtype: dict
+    """
+    full = dict(base)
+    full.update(data[DELTA_KEY])
+    for k in data.get(UNSET_KEY, ()):
+        full.pop(k, None)
+    return full
+
+
+def keyframe_version(version, interval):
+    """
+    :return: the newest version at or before version which is always stored in full
+    :rtype: int
+    """
+    if not interval:
+        return 0
+    return version - version % interval
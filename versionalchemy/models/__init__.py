@@ -1,3 +1,6 @@
+from collections import OrderedDict
+import copy
+import itertools
 import logging
 from datetime import datetime
 import json
@@ -5,10 +8,15 @@ from operator import and_
 
 from sqlalchemy import Column, Integer, Boolean, DateTime, func
 import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import column_property
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 
-from versionalchemy import utils
+from versionalchemy import delta, utils
+from versionalchemy.api import data as data_api
+from versionalchemy.batch import ArchiveBatch, VERSION_MODE_MAX, VERSION_MODE_POINTER
 from versionalchemy.exceptions import LogTableCreationError, RestoreError, LogIdentifyError, HistoryItemNotFound
+from versionalchemy.outbox import register_outbox_model
 import arrow
 log = logging.getLogger(__name__)
 
@@ -20,33 +28,94 @@ class VALogMixin(object):
       - user_id - a column corresponding to the user that made the specified change
       - 1 or more columns which are a subset of columns in the user table. These columns
       must have a unique constraint on the user table and also be named the same in both tables
+
+    The codec va_data is serialized with can be chosen per archive table with ``va_codec``, a
+    codec or the name of one in :data:`versionalchemy.utils.CODECS`. By default, the codec set
+    with :func:`versionalchemy.utils.set_default_codec` is used.
+
+    The column type of va_data can be replaced with ``va_data_type``, e.g. with
+    :class:`versionalchemy.utils.CompressedJSONEncodedDict` to store it compressed. A type
+    class is instantiated with ``va_codec``, and a type instance created without a codec is
+    copied with it.
     """
     va_id = Column(Integer, primary_key=True, autoincrement=True)
     va_version = Column(Integer, nullable=False, index=True)
     va_deleted = Column(Boolean, nullable=False)
-    va_updated_at = Column(DateTime, nullable=False)
-    va_data = Column(utils.JSONEncodedDict, nullable=False)  # JSON blob
+    va_updated_at = Column(DateTime, nullable=False, index=True)
+    va_codec = None
+    va_data_type = None
+    # If set, only the columns changed since the previous version are stored in va_data, with
+    # the full row stored every va_keyframe_interval versions; see versionalchemy.delta
+    va_keyframe_interval = None
+
+    @declared_attr
+    def va_data(cls):
+        data_type = cls.va_data_type or utils.JSONEncodedDict
+        if isinstance(data_type, type):
+            data_type = data_type(codec=cls.va_codec)
+        elif cls.va_codec is not None:
+            if getattr(data_type, 'codec', False) is not None:
+                raise LogTableCreationError(
+                    '{}: va_codec can only be applied to a va_data_type that takes a codec and '
+                    'was not given one'.format(cls.__name__)
+                )
+            # The instance may be shared with other tables, so it is left as it is
+            data_type = copy.copy(data_type)
+            data_type.codec = utils.get_codec(cls.va_codec)
+        return Column(data_type, nullable=False)  # JSON blob
 
     @classmethod
-    def build_row_dict(cls, ut_row, session, deleted=False, user_id=None, use_dirty=True):
+    def build_row_dict(
+        cls, ut_row, session, deleted=False, user_id=None, use_dirty=True, version=None
+    ):
         """
         :param ut_row: the row from the user table
         :param deleted: whether or not the row is deleted
         :param user_id: the user that is performing the update on this row
         :param use_dirty: whether to use the dirty fields from ut_row or not
+        :param version: the version to give the archive row; if None, it is one more than the \
+            latest version in the archive table
+
+        :return: a dictionary of key value pairs to be inserted into the archive table
+        :rtype: dict
+        """
+        if version is None:
+            version = cls._latest_version(session, ut_row, use_dirty=use_dirty)
+            version = 0 if version is None else version + 1
+        key = {
+            col_name: utils.get_column_attribute(ut_row, col_name, use_dirty=use_dirty)
+            for col_name in cls._version_col_names
+        }
+        return cls.build_row_dict_from_data(
+            key,
+            ut_row._to_dict(utils.get_dialect(session), use_dirty=use_dirty),
+            deleted=deleted,
+            user_id=user_id,
+            version=version,
+        )
+
+    @classmethod
+    def build_row_dict_from_data(
+        cls, key, data, version, deleted=False, user_id=None, updated_at=None
+    ):
+        """
+        :param key: a dictionary with the value of each of the version columns
+        :param data: the dictionary representation of the user table row to archive
+        :param version: the version to give the archive row
+        :param deleted: whether or not the row is deleted
+        :param user_id: the user that is performing the update on this row
+        :param updated_at: when the change was made; defaults to now
 
         :return: a dictionary of key value pairs to be inserted into the archive table
         :rtype: dict
         """
         at_data = {
             'va_deleted': deleted,
-            'va_updated_at': datetime.now(),
-            'va_data': ut_row._to_dict(utils.get_dialect(session), use_dirty=use_dirty),
+            'va_updated_at': datetime.now() if updated_at is None else updated_at,
+            'va_data': data,
+            'va_version': version,
         }
-        version = cls._latest_version(session, ut_row, use_dirty=use_dirty)
-        at_data['va_version'] = 0 if version is None else version + 1
-        for col_name in cls._version_col_names:
-            at_data[col_name] = utils.get_column_attribute(ut_row, col_name, use_dirty=use_dirty)
+        at_data.update(key)
 
         if user_id is not None:
             at_data['user_id'] = user_id
@@ -71,6 +140,143 @@ class VALogMixin(object):
         ).first()
         return None if result is None else result[0]
 
+    @classmethod
+    def _latest_versions(cls, session, keys):
+        """
+        :param session: a session instance to execute a select on the log table
+        :param keys: a list of tuples with the values of the version columns, in the iteration \
+            order of ``cls._version_col_names``
+
+        :return: a dictionary mapping each key which has been inserted to its maximum version ID
+        :rtype: dict
+        """
+        columns = [getattr(cls, col_name) for col_name in cls._version_col_names]
+        dialect = utils.get_dialect(session)
+        latest = {}
+        for chunk in utils.chunked(keys, utils.IN_CLAUSE_CHUNK_SIZE // len(columns)):
+            result = session.execute(
+                sa.select(columns + [func.max(cls.va_version)]).
+                where(utils.tuple_in(columns, chunk, dialect)).
+                group_by(*columns)
+            )
+            for row in result:
+                latest[tuple(row[:-1])] = row[-1]
+        return latest
+
+    @classmethod
+    def _versions_of(cls, session, va_ids):
+        """
+        :param session: a session instance to execute a select on the log table
+        :param va_ids: a list of va_ids of rows in the log table
+
+        :return: a dictionary mapping each va_id which exists in the log table to its version
+        :rtype: dict
+        """
+        versions = {}
+        for chunk in utils.chunked(va_ids, utils.IN_CLAUSE_CHUNK_SIZE):
+            result = session.execute(
+                sa.select([cls.va_id, cls.va_version]).
+                where(cls.va_id.in_(chunk))
+            )
+            versions.update(dict(result.fetchall()))
+        return versions
+
+    @classmethod
+    def _rebuild_data(cls, session, rows, data_key='va_data', key=None):
+        """
+        Replaces delta encoded data (see :mod:`versionalchemy.delta`) with the full data of the
+        version. Versions which cannot be rebuilt from rows alone are read back to their keyframe
+        with one query per chunk of keys.
+
+        :param session: a session instance to execute a select on the log table
+        :param rows: a list of dictionaries with ``va_version``, data_key and, unless key is \
+            given, the version columns
+        :param data_key: the name under which rows hold the data
+        :param key: a dictionary with the values of the version columns, if all rows belong to \
+            the same key and do not include them
+
+        :return: rows, with full data under data_key
+        :rtype: list
+        """
+        if not any(delta.is_delta(row[data_key]) for row in rows):
+            return rows
+        col_names = list(cls._version_col_names)
+
+        def key_of(row):
+            return tuple((row if key is None else key)[col_name] for col_name in col_names)
+
+        datas = {}
+        for row in rows:
+            datas.setdefault(key_of(row), {})[row['va_version']] = row[data_key]
+        full = {}
+        unresolved = {}
+        for k, key_datas in datas.items():
+            versions = _rebuild_versions(k, key_datas, full)
+            if versions:
+                unresolved[k] = versions
+
+        cls._read_back_to_keyframes(session, datas, full, unresolved)
+        _substitute_full_data(rows, data_key, key_of, full)
+        return rows
+
+    @classmethod
+    def _read_back_to_keyframes(cls, session, datas, full, unresolved):
+        """
+        Fetches the versions the unresolved versions of each key are relative to and rebuilds
+        them into full.
+
+        :param datas: a dictionary mapping each key to a dictionary of its versions and their \
+            data, to which the fetched versions are added
+        :param full: a dictionary mapping (key, version) to the full data of the version
+        :param unresolved: a dictionary mapping each key to its versions which are not in full
+        """
+        # Read back to the keyframe first; only if it is missing (e.g. the interval changed
+        # since the rows were written) go back to the start of the history
+        for extend in (False, True):
+            if not unresolved:
+                break
+            ranges = {}
+            for k, versions in unresolved.items():
+                low = delta.keyframe_version(versions[0], cls.va_keyframe_interval)
+                ranges[k] = (0, low - 1) if extend else (low, versions[-1])
+            for k, key_datas in cls._fetch_data(session, ranges).items():
+                for version, data in key_datas.items():
+                    datas[k].setdefault(version, data)
+            for k in list(unresolved):
+                versions = _rebuild_versions(k, datas[k], full, force=extend)
+                if versions:
+                    unresolved[k] = versions
+                else:
+                    del unresolved[k]
+
+    @classmethod
+    def _fetch_data(cls, session, ranges):
+        """
+        :param session: a session instance to execute a select on the log table
+        :param ranges: a dictionary mapping keys, tuples in the iteration order of \
+            ``cls._version_col_names``, to an inclusive range of versions
+
+        :return: a dictionary mapping each key to a dictionary of its versions and their va_data
+        :rtype: dict
+        """
+        col_names = list(cls._version_col_names)
+        columns = [getattr(cls, col_name) for col_name in col_names]
+        datas = {}
+        items = [(k, r) for k, r in ranges.items() if r[0] <= r[1]]
+        for chunk in utils.chunked(items, utils.IN_CLAUSE_CHUNK_SIZE // (len(columns) + 2)):
+            result = session.execute(
+                sa.select(columns + [cls.va_version, cls.va_data]).
+                where(sa.or_(*(
+                    sa.and_(cls.va_version.between(low, high), *(
+                        column == value for column, value in zip(columns, k)
+                    ))
+                    for k, (low, high) in chunk
+                )))
+            )
+            for row in result:
+                datas.setdefault(tuple(row[:-2]), {})[row[-2]] = row[-1]
+        return datas
+
     @classmethod
     def _validate(cls, engine, *version_cols):
         """
@@ -120,35 +326,150 @@ class VALogMixin(object):
             )
 
 
+def _substitute_full_data(rows, data_key, key_of, full):
+    for row in rows:
+        if delta.is_delta(row[data_key]):
+            row[data_key] = dict(full[(key_of(row), row['va_version'])])
+
+
+def _rebuild_versions(key, datas, full, force=False):
+    """
+    Rebuilds the full data of every version in datas whose chain of deltas reaches a full row.
+
+    :param datas: a dictionary mapping versions of key to their stored va_data
+    :param full: a dictionary mapping (key, version) to full data, updated in place
+    :param force: if ``True``, deltas which cannot be rebuilt are applied to an empty row
+
+    :return: the versions which could not be rebuilt, in ascending order
+    :rtype: list
+    """
+    unresolved = []
+    for version in sorted(datas):
+        data = datas[version]
+        if not delta.is_delta(data):
+            full[(key, version)] = data
+        elif (key, version - 1) in full:
+            full[(key, version)] = delta.apply_delta(full[(key, version - 1)], data)
+        elif force:
+            log.warning('Cannot find the keyframe of version {} of {}'.format(version, key))
+            full[(key, version)] = delta.apply_delta({}, data)
+        else:
+            unresolved.append(version)
+    return unresolved
+
+
 class VAModelMixin(object):
-    va_id = Column(Integer, nullable=False, default=0)
+    va_id = Column(Integer, nullable=False, default=0, index=True)
 
     va_ignore_columns = None
     va_version_columns = None
+    # How the version of a new archive row is allocated:
+    #   - VERSION_MODE_MAX: one more than the maximum va_version recorded for the row's key
+    #   - VERSION_MODE_POINTER: one more than the version of the archive row va_id points at,
+    #   which is a primary key lookup however long the history is. This requires that all writes
+    #   to the user table go through the ORM; a stale va_id (e.g. a concurrent update from
+    #   another session) surfaces as an IntegrityError on the archive table's unique constraint
+    #   instead of silently appending. Inserts and changes to the version columns fall back to
+    #   VERSION_MODE_MAX.
+    va_version_mode = VERSION_MODE_MAX
+    # If set by register, archive rows are written to this outbox during the flush and only
+    # moved into the archive table by an OutboxWorker
+    va_outbox = None
+    # If set by register, va_get and va_diff read archive rows by va_id through this
+    # versionalchemy.cache.ArchiveRowCache
+    va_cache = None
 
     def updated_by(self, user):
         self._updated_by = user
 
     @classmethod
-    def register(cls, ArchiveTable, engine):
+    def register(cls, ArchiveTable, engine, outbox=None, create_indexes=False, cache=None):
         """
         :param ArchiveTable: the model for the users archive table
         :param engine: the database engine
         :param version_col_names: strings which correspond to columns that versioning will pivot \
             around. These columns must have a unique constraint set on them.
+        :param outbox: optionally, a model inheriting from \
+            :class:`~versionalchemy.outbox.VAOutboxMixin`. If specified, flushes only write \
+            compact entries to the outbox and an :class:`~versionalchemy.outbox.OutboxWorker` \
+            writes the archive rows later.
+        :param create_indexes: if ``True``, the indexes the read API needs which are missing \
+            (see :meth:`missing_indexes`) are created. Else they are only logged as warnings.
+        :param cache: optionally, a :class:`~versionalchemy.cache.ArchiveRowCache` holding the \
+            archive rows read by :meth:`va_get` and :meth:`va_diff`
         """
         version_col_names = cls.va_version_columns
         if not version_col_names:
             raise LogTableCreationError('Need to specify version cols in cls.va_version_columns')
+        if cls.va_version_mode not in (VERSION_MODE_MAX, VERSION_MODE_POINTER):
+            raise LogTableCreationError(
+                'Unknown va_version_mode {}'.format(cls.va_version_mode)
+            )
         if cls.va_ignore_columns is None:
             cls.va_ignore_columns = set()
         cls.va_ignore_columns.add('va_id')
+        cls._va_column_plan = utils.ColumnPlan(cls, cls.va_ignore_columns)
         version_cols = [getattr(cls, col_name, None) for col_name in version_col_names]
 
         cls._validate(engine, *version_cols)
 
         ArchiveTable._validate(engine, *version_cols)
         cls.ArchiveTable = ArchiveTable
+        # The version of the archive row va_id points at. It is deferred, so it is loaded when
+        # first accessed, or along with the rows by query(...).options(undefer(cls.va_version))
+        sa.inspect(cls).add_property('va_version', column_property(
+            sa.select([ArchiveTable.va_version])
+            .where(ArchiveTable.va_id == cls.va_id)
+            .correlate_except(ArchiveTable)
+            .as_scalar(),
+            deferred=True,
+        ))
+        cls.va_outbox = outbox
+        cls.va_cache = cache
+        if outbox is not None:
+            register_outbox_model(cls)
+
+        for table, col_names in cls.missing_indexes(engine):
+            if create_indexes:
+                # Create the index the model declares, if it does, so the database matches it
+                index = next((
+                    index for index in table.indexes
+                    if tuple(c.name for c in index.columns) == col_names
+                ), None)
+                if index is None:
+                    index = sa.Index(
+                        'ix_{}_{}'.format(table.name, '_'.join(col_names)),
+                        *(table.c[col_name] for col_name in col_names)
+                    )
+                log.info('Creating index {} on {}'.format(index.name, table.name))
+                index.create(engine)
+            else:
+                log.warning('{} has no index on ({}); queries of the history of {} which need it '
+                            'scan the whole table'.format(
+                                table.name, ', '.join(col_names), cls.__name__))
+
+    @classmethod
+    def missing_indexes(cls, engine):
+        """
+        Lists the indexes which the read API (see :mod:`versionalchemy.api.data`) needs and
+        which do not exist in the database:
+          - ``va_updated_at`` of the archive table, for the time bounds of historical queries
+          - ``va_id`` of the user table, for the join of the latest time slice
+        Versions of a key are found through the unique constraint checked by :meth:`register`.
+
+        :param engine: the database engine
+
+        :return: a list of tuples of a table and the names of the columns it needs an index on
+        :rtype: list
+        """
+        wanted = [
+            (cls.ArchiveTable.__table__, ('va_updated_at',)),
+            (cls.__table__, (cls.va_id.property.columns[0].name,)),
+        ]
+        return [
+            (table, col_names) for table, col_names in wanted
+            if not utils.has_index(table.name, engine, *col_names)
+        ]
 
     def _to_dict(self, dialect, use_dirty=True):
         """
@@ -160,11 +481,452 @@ class VAModelMixin(object):
         :return: a dictionary of key value pairs representing this row.
         :rtype: dict
         """
-        return {
-            cn: utils.get_column_attribute(self, c, use_dirty=use_dirty, dialect=dialect)
-            for c, cn in utils.get_column_keys_and_names(self)
-            if c not in self.va_ignore_columns
-        }
+        return self._column_plan().to_dict(self, dialect, use_dirty=use_dirty)
+
+    @classmethod
+    def _values_to_dict(cls, values, dialect):
+        """
+        :param values: a dictionary mapping each column attribute of this model to its value
+        :param dialect: a :py:class:`~sqlalchemy.engine.interfaces.Dialect` corresponding to the \
+            SQL dialect being used.
+
+        :return: the same dictionary representation of the row as :meth:`_to_dict`
+        :rtype: dict
+        """
+        return cls._column_plan().values_to_dict(values, dialect)
+
+    @classmethod
+    def _column_plan(cls):
+        """
+        :return: the :class:`~versionalchemy.utils.ColumnPlan` built for this model by \
+            :meth:`register`. Models which were not registered themselves (e.g. subclasses of a \
+            registered model) get one built on first use, and the plan is rebuilt once columns \
+            are added to or removed from the model.
+        :rtype: versionalchemy.utils.ColumnPlan
+        """
+        plan = cls.__dict__.get('_va_column_plan')
+        if plan is None or not plan.is_current(cls, cls.va_ignore_columns):
+            plan = utils.ColumnPlan(cls, cls.va_ignore_columns)
+            cls._va_column_plan = plan
+        return plan
+
+    @classmethod
+    def _column_key(cls, attr_name):
+        return sa.inspect(cls).get_property(attr_name).columns[0].key
+
+    @classmethod
+    def _primary_key_names(cls):
+        mapper = sa.inspect(cls)
+        return [mapper.get_property_by_column(col).key for col in mapper.primary_key]
+
+    @classmethod
+    def _fetch_rows(cls, session, attr_names, keys):
+        """
+        :param session: a sqlalchemy session
+        :param attr_names: the column attributes which identify a row
+        :param keys: a list of distinct tuples with a value for each of attr_names
+
+        :return: a dictionary mapping each key of keys that was found in the user table to a \
+        dictionary of the row's column attributes and their values
+        :rtype: dict
+        """
+        col_keys = cls._column_plan().keys
+        rows = utils.select_by_keys(
+            session,
+            [getattr(cls, name) for name in attr_names],
+            keys,
+            [getattr(cls, k) for k in col_keys],
+        )
+        return {key: dict(zip(col_keys, values)) for key, values in rows.items()}
+
+    @classmethod
+    def va_bulk_insert(cls, session, mappings, user_id=None):
+        """
+        Inserts many rows and archives them with set based statements. Unlike
+        :meth:`~sqlalchemy.orm.session.Session.bulk_insert_mappings`, which skips the flush
+        listener, this records history exactly like flushing the equivalent ORM objects would.
+
+        Mappings without the version columns, whose values are then generated by the database
+        (e.g. an autoincrement primary key), are inserted with one multi row
+        ``INSERT ... RETURNING`` per chunk on dialects which support it, like PostgreSQL. Other
+        dialects, like SQLite and MySQL, only report the generated key of a single row insert,
+        so these mappings are inserted one statement per row there.
+
+        :param session: a sqlalchemy session
+        :param mappings: a list of dictionaries mapping column attributes to values, one per row
+        :param user_id: the user that is performing the insert
+        """
+        key_names = cls.va_version_columns
+        pk_names = cls._primary_key_names()
+        keyed, unkeyed = [], []
+        for mapping in mappings:
+            if all(mapping.get(col_name) is not None for col_name in key_names):
+                keyed.append(mapping)
+            else:
+                unkeyed.append(mapping)
+        if unkeyed and not set(key_names) <= set(pk_names):
+            raise ValueError('Every mapping must specify the version columns <{}>'.format(
+                ','.join(key_names)
+            ))
+
+        if keyed:
+            session.execute(sa.insert(cls.__table__), [
+                {cls._column_key(k): v for k, v in mapping.items()} for mapping in keyed
+            ])
+        keys = [tuple(mapping[col_name] for col_name in key_names) for mapping in keyed]
+        if unkeyed:
+            keys.extend(cls._insert_unkeyed(session, unkeyed))
+
+        # Read the rows back so column defaults end up in the archive like they do for a flush
+        rows = cls._fetch_rows(session, key_names, keys)
+        dialect = utils.get_dialect(session)
+        batch = ArchiveBatch(session)
+        for key in keys:
+            batch.add_data(
+                cls,
+                dict(zip(key_names, key)),
+                cls._values_to_dict(rows[key], dialect),
+                user_id=user_id,
+            )
+        batch.execute()
+
+    @classmethod
+    def _insert_unkeyed(cls, session, mappings):
+        """
+        Inserts mappings whose version columns are generated by the database.
+
+        :return: the key of each inserted row, tuples in the order of ``cls.va_version_columns``
+        :rtype: list
+        """
+        key_names = cls.va_version_columns
+        table = cls.__table__
+        dialect = utils.get_dialect(session)
+        returning = [table.c[cls._column_key(col_name)] for col_name in key_names]
+        multi_row = dialect.implicit_returning and dialect.supports_multivalues_insert
+        # Rows of a multi row INSERT all set the same columns
+        groups = OrderedDict()
+        for mapping in mappings:
+            row = {cls._column_key(k): v for k, v in mapping.items()}
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        keys = []
+        for col_keys, group in groups.items():
+            if not (multi_row and col_keys):
+                keys.extend(cls._insert_row(session, row) for row in group)
+                continue
+            for chunk in utils.chunked(group, utils.IN_CLAUSE_CHUNK_SIZE // len(col_keys)):
+                result = session.execute(sa.insert(table).values(chunk).returning(*returning))
+                keys.extend(tuple(row) for row in result)
+        return keys
+
+    @classmethod
+    def _insert_row(cls, session, row):
+        """
+        :return: the key of the row inserted with the column values of row
+        :rtype: tuple
+        """
+        # Only the inserted primary key tells us what the version columns are
+        result = session.execute(sa.insert(cls.__table__), row)
+        pk = dict(zip(cls._primary_key_names(), result.inserted_primary_key))
+        return tuple(pk[col_name] for col_name in cls.va_version_columns)
+
+    @classmethod
+    def va_bulk_update_mappings(cls, session, mappings, user_id=None):
+        """
+        Updates many rows and archives the changes with set based statements. Unlike
+        :meth:`~sqlalchemy.orm.session.Session.bulk_update_mappings`, which skips the flush
+        listener, this records history exactly like flushing the equivalent ORM objects would:
+        rows whose values do not change are not archived, and a change to the version columns
+        archives a delete of the old key.
+
+        :param session: a sqlalchemy session
+        :param mappings: a list of dictionaries mapping column attributes to values, one per row. \
+            Each dictionary must contain the primary key of the row to update.
+        :param user_id: the user that is performing the update
+        """
+        key_names = cls.va_version_columns
+        pk_names = cls._primary_key_names()
+        for mapping in mappings:
+            if any(mapping.get(col_name) is None for col_name in pk_names):
+                raise ValueError('Every mapping must specify the primary key <{}>'.format(
+                    ','.join(pk_names)
+                ))
+        pks = list(OrderedDict(
+            (tuple(mapping[col_name] for col_name in pk_names), None) for mapping in mappings
+        ))
+        old_rows = cls._fetch_rows(session, pk_names, pks)
+
+        # Mappings updating the same columns share a statement and are sent as one executemany
+        groups = OrderedDict()
+        for mapping in mappings:
+            attr_names = tuple(sorted(k for k in mapping if k not in pk_names))
+            if attr_names:
+                groups.setdefault(attr_names, []).append(mapping)
+        table = cls.__table__
+        where_clause = sa.and_(*(
+            table.c[cls._column_key(col_name)] == sa.bindparam('va_pk_' + col_name)
+            for col_name in pk_names
+        ))
+        for attr_names, group in groups.items():
+            values = {
+                cls._column_key(attr_name): sa.bindparam('va_value_' + attr_name)
+                for attr_name in attr_names
+            }
+            session.execute(sa.update(table).where(where_clause).values(values), [
+                {
+                    ('va_pk_' if k in pk_names else 'va_value_') + k: v
+                    for k, v in mapping.items()
+                }
+                for mapping in group
+            ])
+
+        # Read the rows back so onupdate defaults end up in the archive like they do for a flush
+        new_rows = cls._fetch_rows(session, pk_names, pks)
+        dialect = utils.get_dialect(session)
+        batch = ArchiveBatch(session)
+        for pk in pks:
+            old, new = old_rows.get(pk), new_rows.get(pk)
+            if old is None or new is None:
+                continue
+            if all(old[k] == new[k] for k in new if k != 'va_id'):
+                continue
+            pointer = old['va_id']
+            base = cls._values_to_dict(old, dialect)
+            old_key = {col_name: old[col_name] for col_name in key_names}
+            new_key = {col_name: new[col_name] for col_name in key_names}
+            if old_key != new_key:
+                batch.add_data(
+                    cls,
+                    old_key,
+                    base,
+                    deleted=True,
+                    user_id=user_id,
+                    pointer=pointer,
+                    track=False,
+                    base=base,
+                )
+                pointer = base = None
+            batch.add_data(
+                cls,
+                new_key,
+                cls._values_to_dict(new, dialect),
+                user_id=user_id,
+                pointer=pointer,
+                base=base,
+            )
+        batch.execute()
+
+    @classmethod
+    def va_bulk_restore(cls, session, t, identifiers=None, user_id=None):
+        """
+        Restores many rows to their state at time t with set based statements, and archives the
+        restore like :meth:`va_bulk_update_mappings` does. Rows which did not exist at t are
+        deleted and rows which were deleted since are inserted again. Unlike :meth:`va_restore`,
+        the session is not committed. Pending changes are flushed first, and ORM objects of the
+        restored rows already loaded in the session are expired.
+
+        :param session: a sqlalchemy session
+        :param t: a datetime; each row is restored to its latest version archived at or \
+            before t
+        :param identifiers: a list of dictionaries with the values of the version columns of \
+            each row to restore. If None, every row with history after t is restored.
+        :param user_id: the user that is performing the restore
+        :return: the number of rows which were updated, inserted or deleted
+        :rtype: int
+        """
+        # The restore is written with session.execute, which doesn't autoflush
+        session.flush()
+        key_names = list(cls.va_version_columns)
+        keys = cls._restore_keys(session, t, identifiers)
+        targets = cls._data_at(session, t, keys)
+        old_rows = cls._fetch_rows(session, key_names, keys)
+
+        dialect = utils.get_dialect(session)
+        # The current rows are compared in the form their data is archived in, e.g. with
+        # datetimes as strings on dialects which bind them as datetimes
+        codec = utils.get_codec(cls.ArchiveTable.__table__.c.va_data.type.codec)
+        inserts, updates, deletes = [], [], []
+        for key in keys:
+            old, data = old_rows.get(key), targets.get(key)
+            if data is None:
+                if old is not None:
+                    deletes.append(key)
+            elif old is None:
+                inserts.append(key)
+            elif data != codec.loads(codec.dumps(cls._values_to_dict(old, dialect))):
+                updates.append(key)
+        cls._write_restore(session, targets, inserts, updates, deletes)
+
+        # Read the rows back so column defaults end up in the archive like they do for a flush
+        new_rows = cls._fetch_rows(session, key_names, updates + inserts)
+        batch = ArchiveBatch(session)
+        for key in deletes + updates + inserts:
+            old, new = old_rows.get(key), new_rows.get(key)
+            base = None if old is None else cls._values_to_dict(old, dialect)
+            batch.add_data(
+                cls,
+                dict(zip(key_names, key)),
+                base if new is None else cls._values_to_dict(new, dialect),
+                deleted=new is None,
+                user_id=user_id,
+                pointer=None if old is None else old['va_id'],
+                base=base,
+            )
+        batch.execute()
+        cls._expire_loaded(session, deletes + updates + inserts)
+        return len(deletes) + len(updates) + len(inserts)
+
+    @classmethod
+    def _expire_loaded(cls, session, keys):
+        """
+        Expires the instances in the session's identity map whose key is in keys, so they are
+        loaded again after their rows were written with set based statements.
+        """
+        utils.expire_by_keys(session, cls, cls.va_version_columns, set(keys))
+
+    @classmethod
+    def _restore_keys(cls, session, t, identifiers):
+        """
+        :return: the keys, tuples in the order of ``cls.va_version_columns``, of identifiers, \
+            or of every row with history after t if identifiers is None
+        :rtype: list
+        """
+        ArchiveTable = cls.ArchiveTable
+        key_names = cls.va_version_columns
+        if identifiers is None:
+            # Rows with no history after t are already in their state at t
+            return [tuple(row) for row in session.execute(
+                sa.select([getattr(ArchiveTable, col_name) for col_name in key_names]).
+                where(ArchiveTable.va_updated_at > t).
+                distinct()
+            )]
+        for identifier in identifiers:
+            for col_name in key_names:
+                if col_name not in identifier:
+                    raise LogIdentifyError("Can't determine item id - no parameters passed, "
+                                           "please pass '{}' argument".format(col_name))
+        return list(OrderedDict(
+            (tuple(identifier[col_name] for col_name in key_names), None)
+            for identifier in identifiers
+        ))
+
+    @classmethod
+    def _data_at(cls, session, t, keys):
+        """
+        :param session: a sqlalchemy session
+        :param t: a datetime
+        :param keys: a list of tuples with the values of ``cls.va_version_columns``
+
+        :return: a dictionary mapping each key which existed at t to its archived data at t
+        :rtype: dict
+        """
+        key_names = cls.va_version_columns
+        datas = {}
+        for chunk in utils.chunked(keys, utils.IN_CLAUSE_CHUNK_SIZE // len(key_names)):
+            query = data_api._get_historical_time_slice(
+                cls, session, t, [dict(zip(key_names, key)) for key in chunk],
+                include_deleted=True,
+            )
+            rows = utils.result_to_dict(session.execute(query))
+            for row in cls.ArchiveTable._rebuild_data(session, rows):
+                if not row['va_deleted']:
+                    datas[tuple(row[col_name] for col_name in key_names)] = row['va_data']
+        return datas
+
+    @classmethod
+    def _write_restore(cls, session, datas, inserts, updates, deletes):
+        """
+        Writes the user rows of a restore with one executemany per kind of change.
+
+        :param datas: a dictionary mapping each key of inserts and updates to its archived data
+        :param inserts: the keys of the rows to insert
+        :param updates: the keys of the rows to update
+        :param deletes: the keys of the rows to delete
+        """
+        key_names = cls.va_version_columns
+        table = cls.__table__
+        columns = cls._restore_columns()
+        missing = set()
+        where_clause = sa.and_(*(
+            table.c[cls._column_key(col_name)] == sa.bindparam('va_key_' + col_name)
+            for col_name in key_names
+        ))
+
+        def key_params(key):
+            return {'va_key_' + col_name: value for col_name, value in zip(key_names, key)}
+
+        if deletes:
+            session.execute(sa.delete(table).where(where_clause), [
+                key_params(key) for key in deletes
+            ])
+        if updates:
+            values = {
+                cls._column_key(attr_name): sa.bindparam('va_value_' + attr_name)
+                for attr_name, _, _, _ in columns
+            }
+            params = []
+            for key in updates:
+                param = key_params(key)
+                for attr_name, value in cls._restore_values(columns, datas[key], missing).items():
+                    param['va_value_' + attr_name] = value
+                params.append(param)
+            session.execute(sa.update(table).where(where_clause).values(values), params)
+        if inserts:
+            params = []
+            for key in inserts:
+                values = cls._restore_values(columns, datas[key], missing)
+                params.append({
+                    cls._column_key(attr_name): value for attr_name, value in values.items()
+                })
+            session.execute(sa.insert(table), params)
+        for col_name in sorted(missing):
+            log.warning("Model '{}' has new column '{}' which has no default, using NULL".format(
+                cls.__name__, col_name))
+
+    @classmethod
+    def _restore_columns(cls):
+        """
+        :return: a tuple of the attribute, the column name, whether the archived value is parsed \
+            as a datetime and whether the column is nullable, for each archived column
+        :rtype: tuple
+        """
+        columns = []
+        for attr_name, col_name in cls._column_plan().archived:
+            column = sa.inspect(cls).get_property(attr_name).columns[0]
+            try:
+                is_datetime = column.type.python_type is datetime
+            except NotImplementedError:
+                is_datetime = False
+            columns.append((attr_name, col_name, is_datetime, column.nullable))
+        return tuple(columns)
+
+    @classmethod
+    def _restore_values(cls, columns, data, missing):
+        """
+        :param columns: the columns returned by :meth:`_restore_columns`
+        :param data: the archived data of a row
+        :param missing: a set the names of nullable columns which are not in data are added to
+
+        :return: a dictionary mapping each archived column attribute to its value in data, \
+            converted like :meth:`va_restore` does
+        :rtype: dict
+        """
+        values = {}
+        for attr_name, col_name, is_datetime, nullable in columns:
+            if col_name in data:
+                value = data[col_name]
+                if value is not None and is_datetime:
+                    value = arrow.get(value).datetime
+            elif nullable:
+                value = None
+                missing.add(col_name)
+            else:
+                raise RestoreError((
+                    "We does not support non-nullable values that were added in new version of "
+                    "model '{}'. New column is '{}', please mark it as nullable to be able to "
+                    "restore"
+                ).format(cls.__name__, col_name))
+            values[attr_name] = value
+        return values
 
     @classmethod
     def _validate(cls, engine, *version_cols):
@@ -189,7 +951,13 @@ class VAModelMixin(object):
         Returns the rows current version. This can only be called after a row has been
         inserted into the table and the session has been flushed. Otherwise this
         method has undefined behavior.
+
+        No query is needed if the version was stored on the row by the flush which archived it,
+        or loaded with the row (see :attr:`va_version`).
         """
+        version = sa.inspect(self).dict.get('va_version')
+        if version is not None:
+            return version
         result = session.execute(
             sa.select([self.ArchiveTable.va_version]).
             where(self.ArchiveTable.va_id == self.va_id)
@@ -222,6 +990,116 @@ class VAModelMixin(object):
             .where(cls.create_log_select_expression(kwargs))
         ))
 
+    @classmethod
+    def va_list_by_pks(cls, session, identifiers):
+        """
+        Like :meth:`va_list_by_pk`, for many records with one query per chunk of records.
+
+        :param session: flushed session
+        :param identifiers: a list of dictionaries with the values of the version columns of \
+            each record, as passed to :meth:`va_list_by_pk`
+        :return: a list with the result of :meth:`va_list_by_pk` for each identifier, in order \
+            of version
+        :rtype: list
+        """
+        ArchiveTable = cls.ArchiveTable
+        histories = cls._history_by_pks(session, identifiers, [
+            ArchiveTable.va_id,
+            ArchiveTable.user_id,
+            ArchiveTable.va_version,
+        ])
+        return cls._drop_version_columns(histories)
+
+    @classmethod
+    def va_get_all_by_pks(cls, session, identifiers):
+        """
+        Like :meth:`va_get_all_by_pk`, for many records with one query per chunk of records.
+
+        :param session: flushed session
+        :param identifiers: a list of dictionaries with the values of the version columns of \
+            each record
+        :return: a list with the result of :meth:`va_get_all_by_pk` for each identifier, in \
+            order of version
+        :rtype: list
+        """
+        ArchiveTable = cls.ArchiveTable
+        histories = cls._history_by_pks(session, identifiers, [
+            ArchiveTable.va_id,
+            ArchiveTable.va_version,
+            ArchiveTable.user_id,
+            ArchiveTable.va_data.label('record'),
+        ])
+        ArchiveTable._rebuild_data(
+            session, list(itertools.chain.from_iterable(histories)), data_key='record'
+        )
+        return cls._drop_version_columns(histories)
+
+    @classmethod
+    def va_diff_all_by_pks(cls, session, identifiers):
+        """
+        Like :meth:`va_diff_all_by_pk`, for many records with one query per chunk of records.
+
+        :param session: flushed session
+        :param identifiers: a list of dictionaries with the values of the version columns of \
+            each record
+        :return: a list with the result of :meth:`va_diff_all_by_pk` for each identifier
+        :rtype: list
+        """
+        ArchiveTable = cls.ArchiveTable
+        histories = cls._history_by_pks(session, identifiers, [
+            ArchiveTable.va_id,
+            ArchiveTable.va_version,
+            ArchiveTable.user_id,
+            ArchiveTable.va_data,
+        ])
+        ArchiveTable._rebuild_data(session, list(itertools.chain.from_iterable(histories)))
+        return [
+            [utils.compare_rows(prev_row, row) for prev_row, row in zip([None] + rows, rows)]
+            for rows in histories
+        ]
+
+    @classmethod
+    def _history_by_pks(cls, session, identifiers, columns):
+        """
+        :param session: a session instance to execute a select on the log table
+        :param identifiers: a list of dictionaries with the values of the version columns
+        :param columns: the columns of the log table to select
+
+        :return: a list with, for each identifier, the list of its rows in order of version. \
+            Each row is a dictionary of columns and the version columns.
+        :rtype: list
+        """
+        ArchiveTable = cls.ArchiveTable
+        col_names = sorted(ArchiveTable._version_col_names)
+        keys = []
+        for identifier in identifiers:
+            for col_name in col_names:
+                if col_name not in identifier:
+                    raise LogIdentifyError("Can't determine item id - no parameters passed, "
+                                           "please pass '{}' argument".format(col_name))
+            keys.append(tuple(identifier[col_name] for col_name in col_names))
+
+        key_columns = [getattr(ArchiveTable, col_name) for col_name in col_names]
+        dialect = utils.get_dialect(session)
+        histories = OrderedDict((key, []) for key in keys)
+        for chunk in utils.chunked(list(histories), utils.IN_CLAUSE_CHUNK_SIZE // len(col_names)):
+            result = session.execute(
+                sa.select(key_columns + columns).
+                where(utils.tuple_in(key_columns, chunk, dialect)).
+                order_by(*(key_columns + [ArchiveTable.va_version]))
+            )
+            for row in utils.result_to_dict(result):
+                histories.setdefault(tuple(row[c] for c in col_names), []).append(row)
+        return [histories[key] for key in keys]
+
+    @classmethod
+    def _drop_version_columns(cls, histories):
+        col_names = cls.ArchiveTable._version_col_names
+        return [
+            [{k: v for k, v in row.items() if k not in col_names} for row in rows]
+            for rows in histories
+        ]
+
     def get_row_identifier(self):
         return {
             col_name: getattr(self, col_name) for col_name in self.ArchiveTable._version_col_names
@@ -261,10 +1139,13 @@ class VAModelMixin(object):
         else:
             filter_condition = (cls.ArchiveTable.va_id == va_id,)
 
-        result = utils.result_to_dict(session.execute(
-                sa.select({cls.ArchiveTable.va_id, cls.ArchiveTable.va_data})
-                .where(*filter_condition)
-        ))
+        if va_version is None and cls.va_cache is not None:
+            result = list(cls._rows_by_va_id(session, [va_id]).values())
+        else:
+            result = utils.result_to_dict(session.execute(
+                    sa.select([cls.ArchiveTable])
+                    .where(*filter_condition)
+            ))
 
         if not len(result):
             if va_version is not None:
@@ -273,7 +1154,9 @@ class VAModelMixin(object):
                 identify_str = 'va_id={}'.format(va_id)
             raise HistoryItemNotFound("Can't find log record by {}".format(identify_str))
 
-        result = result[0]
+        result = cls.ArchiveTable._rebuild_data(session, result[:1])[0]
+        if va_version is not None and cls.va_cache is not None:
+            cls.va_cache.put(cls.ArchiveTable, result, session)
         historic_object = result['va_data']
         historic_object['va_id'] = result['va_id']
         return historic_object
@@ -335,57 +1218,152 @@ class VAModelMixin(object):
         if va_version is None and va_id is None:
             raise LogIdentifyError("Please provide at least one from va_version, va_id to identify column")
 
+        ArchiveTable = cls.ArchiveTable
         if va_version is not None:
-            filter_condition = (cls.ArchiveTable.va_version == va_version,)
+            filter_condition = ArchiveTable.va_version == va_version
         else:
-            filter_condition = (cls.ArchiveTable.va_id == va_id,)
+            filter_condition = ArchiveTable.va_id == va_id
 
-        this_row = utils.result_to_dict(session.execute(
-            sa.select({cls.ArchiveTable}).where(*filter_condition)
+        # The row to compare and the one before it are read together, seeking through the
+        # unique index on the version columns and va_version from the target's version down
+        col_names = sorted(ArchiveTable._version_col_names)
+        target = (
+            sa.select([getattr(ArchiveTable, c) for c in col_names] + [ArchiveTable.va_version])
+            .where(filter_condition)
+            .order_by(ArchiveTable.va_id)
+            .limit(1)
+            .alias('target')
+        )
+        cache = cls.va_cache
+        rows = utils.result_to_dict(session.execute(
+            # With a cache, only the va_ids are read and the rows are looked up in the cache
+            sa.select([ArchiveTable.va_id] if cache is not None else [ArchiveTable])
+            .select_from(ArchiveTable.__table__.join(target, sa.and_(*(
+                getattr(ArchiveTable, c) == getattr(target.c, c) for c in col_names
+            ))))
+            .where(ArchiveTable.va_version <= target.c.va_version)
+            .order_by(ArchiveTable.va_version.desc())
+            .limit(2)
         ))
-        if not len(this_row):
+        if rows and cache is not None:
+            rows_by_va_id = cls._rows_by_va_id(session, [row['va_id'] for row in rows])
+            rows = [rows_by_va_id[row['va_id']] for row in rows]
+        if not rows:
             if va_version is not None:
                 identify_str = 'va_version={}'.format(va_version)
             else:
                 identify_str = 'va_id={}'.format(va_id)
             raise HistoryItemNotFound("Can't find log record by {}".format(identify_str))
-        this_row = this_row[0]
-
-        va_id = this_row['va_id']
-        all_history_items = {
-           col_name: this_row[col_name] for col_name in cls.ArchiveTable._version_col_names
-        }
-        prev_log = [
-            log for log in cls.va_list_by_pk(session, **all_history_items) if log['va_id'] < va_id
-        ]
-        if not prev_log:
+        this_row = rows[0]
+        if len(rows) == 1:
+            ArchiveTable._rebuild_data(session, [this_row])
             return utils.compare_rows(None, this_row)
 
-        prev_va_id = prev_log[-1]['va_id']
-        prev_row = utils.result_to_dict(session.execute(
-                sa.select({cls.ArchiveTable})
-                .where(cls.ArchiveTable.va_id == prev_va_id)
-        ))[0]
-
+        prev_row = rows[1]
+        ArchiveTable._rebuild_data(session, [prev_row, this_row])
         return utils.compare_rows(prev_row, this_row)
 
+    @classmethod
+    def _rows_by_va_id(cls, session, va_ids):
+        """
+        :param session: a session instance to execute a select on the log table
+        :param va_ids: a list of va_ids of rows in the log table
+
+        :return: a dictionary mapping each va_id which exists in the log table to its row, with \
+            full data. Rows are read from ``va_cache`` where possible, and the others are added \
+            to it.
+        :rtype: dict
+        """
+        ArchiveTable = cls.ArchiveTable
+        rows = {}
+        missing = []
+        for va_id in va_ids:
+            row = cls.va_cache.get(ArchiveTable, va_id)
+            if row is None:
+                missing.append(va_id)
+            else:
+                rows[va_id] = row
+        if missing:
+            fetched = []
+            for chunk in utils.chunked(missing, utils.IN_CLAUSE_CHUNK_SIZE):
+                fetched.extend(utils.result_to_dict(session.execute(
+                    sa.select([ArchiveTable]).where(ArchiveTable.va_id.in_(chunk))
+                )))
+            for row in ArchiveTable._rebuild_data(session, fetched):
+                cls.va_cache.put(ArchiveTable, row, session)
+                rows[row['va_id']] = row
+        return rows
+
     def va_diff_all(self, session):
         return self.va_diff_all_by_pk(session, **self.get_row_identifier())
 
     @classmethod
     def va_diff_all_by_pk(cls, session, **kwargs):
-        all_history_items = utils.result_to_dict(session.execute(
-            sa.select([cls.ArchiveTable])
-                .where(cls.create_log_select_expression(kwargs))
-        ))
-        all_changes = []
-        for i in range(len(all_history_items)):
-            if i is 0:
-                all_changes.append(utils.compare_rows(None, all_history_items[i]))
-            else:
-                all_changes.append(utils.compare_rows(all_history_items[i-1], all_history_items[i]))
+        return list(cls.va_iter_diff_by_pk(session, **kwargs))
 
-        return all_changes
+    def va_iter_diff(self, session, from_version=None, batch_size=1000):
+        """
+        Like :meth:`va_diff_all`, but yields the diffs one at a time; see
+        :meth:`va_iter_diff_by_pk`.
+        """
+        return self.va_iter_diff_by_pk(
+            session, from_version=from_version, batch_size=batch_size,
+            **self.get_row_identifier()
+        )
+
+    @classmethod
+    def va_iter_diff_by_pk(cls, session, from_version=None, batch_size=1000, **kwargs):
+        """
+        Yields the diff of each version of the record identified by kwargs with the version
+        before it, in version order. The versions are read with one query per batch_size rows,
+        each starting after the last version of the one before, so memory does not grow with the
+        length of the history. Each batch is read in full before its deltas are rebuilt, so no
+        result is left open on the connection while those queries run (which MySQL's unbuffered
+        cursors do not allow).
+
+        :param session: flushed session
+        :param from_version: if specified, the first diff is the one of this version; it is \
+            compared with the version before it like all the others
+        :param batch_size: the number of versions fetched from the cursor at once
+        :param kwargs: the values of the version columns of the record
+        """
+        ArchiveTable = cls.ArchiveTable
+        where = cls.create_log_select_expression(kwargs)
+        if from_version is not None:
+            # Start from the version before from_version, to compare from_version with
+            previous_version = (
+                sa.select([func.max(ArchiveTable.va_version)])
+                .where(sa.and_(where, ArchiveTable.va_version < from_version))
+                .as_scalar()
+            )
+            where = sa.and_(
+                where, ArchiveTable.va_version >= func.coalesce(previous_version, from_version)
+            )
+        prev_row = None
+        while True:
+            batch_where = where
+            if prev_row is not None:
+                batch_where = sa.and_(where, ArchiveTable.va_version > prev_row['va_version'])
+            rows = utils.result_to_dict(session.execute(
+                sa.select([ArchiveTable])
+                .where(batch_where)
+                .order_by(ArchiveTable.va_version)
+                .limit(batch_size)
+            ))
+            if not rows:
+                return
+            # Deltas at the start of a batch are applied to the last row of the previous one
+            rows = ArchiveTable._rebuild_data(
+                session, rows if prev_row is None else [prev_row] + rows
+            )
+            if prev_row is not None:
+                rows = rows[1:]
+            for row in rows:
+                if from_version is None or row['va_version'] >= from_version:
+                    yield utils.compare_rows(prev_row, row)
+                prev_row = row
+            if len(rows) < batch_size:
+                return
 
     @classmethod
     def va_get_all_by_pk(cls, session, **kwargs):
@@ -398,7 +1376,9 @@ class VAModelMixin(object):
             ]).where(
                 cls.create_log_select_expression(kwargs))
         ))
-        return all_history_items
+        return cls.ArchiveTable._rebuild_data(
+            session, all_history_items, data_key='record', key=kwargs
+        )
 
     def va_get_all(self, session):
         return self.va_get_all_by_pk(session, **self.get_row_identifier())
@@ -0,0 +1,299 @@
+from collections import OrderedDict
+import datetime
+from decimal import Decimal
+import logging
+import re
+import threading
+
+import arrow
+import sqlalchemy as sa
+from sqlalchemy import Column, DateTime, Integer, String, UnicodeText
+
+from versionalchemy import utils
+from versionalchemy.batch import ArchiveBatch
+
+log = logging.getLogger(__name__)
+
+# Maps the full name (including the schema) of an archive table to the user table model it
+# archives, for every model registered with an outbox
+_models_by_archive_table = {}
+
+_UTC_OFFSET = re.compile(r'(Z|[+-]\d\d:?\d\d)$')
+
+
+def register_outbox_model(Model):
+    _models_by_archive_table[Model.ArchiveTable.__table__.fullname] = Model
+
+
+def _decode_key(Model, key):
+    '''
+    Returns key, a dictionary of the version columns of Model as they were decoded from the JSON
+    of an outbox entry, with the values of date, time and decimal columns converted back from
+    strings and floats.
+    '''
+    columns = Model.ArchiveTable.__table__.c
+    return {
+        col_name: _decode_value(columns[col_name].type, value) for col_name, value in key.items()
+    }
+
+
+def _decode_value(column_type, value):
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        return value
+    if value is None or isinstance(value, python_type):
+        return value
+    if python_type is Decimal:
+        return Decimal(str(value))
+    if python_type is datetime.time:
+        value = '1970-01-01T' + value
+    if python_type in (datetime.datetime, datetime.date, datetime.time):
+        parsed = arrow.get(value)
+        # Values without an offset were naive when they were written
+        parsed = parsed.datetime if _UTC_OFFSET.search(value) else parsed.naive
+        if python_type is datetime.date:
+            return parsed.date()
+        return parsed.timetz() if python_type is datetime.time else parsed
+    return value
+
+
+class VAOutboxMixin(object):
+    """
+    A mixin providing the schema for the outbox, a local queue of archive rows which have not been
+    written to their archive table yet. A single outbox can be shared by any number of models:
+
+    .. code-block:: python
+
+        class Outbox(VAOutboxMixin, Base):
+            __tablename__ = 'va_outbox'
+
+        Example.register(ExampleArchive, engine, outbox=Outbox)
+
+    Entries are written in the same transaction as the change to the user table, so they are
+    never lost or applied for a rolled back change.
+    """
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    va_table = Column(String(255), nullable=False)
+    # The version columns of the entry as JSON with sorted keys, identifying its key in va_table
+    va_key = Column(UnicodeText, nullable=False)
+    va_updated_at = Column(DateTime, nullable=False)
+    va_entry = Column(utils.JSONEncodedDict, nullable=False)  # JSON blob
+    # The number of times applying the entry failed; once an entry failed max_attempts times,
+    # it and every entry of its key are left in the outbox for inspection and skipped
+    va_attempts = Column(Integer, nullable=False, default=0, server_default='0')
+
+
+class OutboxWorker(object):
+    """
+    Moves entries from an outbox into their archive tables in batches.
+
+    Each batch is split by key over ``workers`` threads, each applying its share of the batch in
+    its own transaction. All entries for a key are applied by the same thread in the order they
+    were written, and a batch is finished before the next one is read, so the history of every
+    key is written in order. Only one worker should drain a given outbox at a time.
+
+    If a thread fails to apply its share, each key is retried on its own, so only the entries of
+    the keys which fail are held back. Once the entries of a key failed max_attempts times, an
+    error is logged and no entry of the key is read anymore, including the ones written later,
+    so its history stays in order; reset their ``va_attempts`` to retry them.
+    """
+
+    def __init__(
+        self, Session, Outbox, workers=4, batch_size=500, poll_interval=1.0, max_attempts=5
+    ):
+        """
+        :param Session: a session factory, used to create one session per thread and batch
+        :param Outbox: the model inheriting from :class:`VAOutboxMixin` to drain
+        :param workers: the number of threads applying a batch. With 1, batches are applied in \
+            the calling thread.
+        :param batch_size: the maximum number of entries read from the outbox at once
+        :param poll_interval: how long, in seconds, the background thread sleeps once the \
+            outbox is empty
+        :param max_attempts: the number of times applying an entry may fail before it is skipped
+        """
+        self.Session = Session
+        self.Outbox = Outbox
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def drain(self):
+        """
+        Applies entries until the outbox has no entries left to apply.
+
+        :return: the number of entries applied
+        :rtype: int
+        """
+        total = 0
+        while True:
+            read, applied = self._process_batch()
+            total += applied
+            if read < self.batch_size:
+                return total
+
+    def process_batch(self):
+        """
+        Applies the oldest batch_size entries of the outbox.
+
+        :return: the number of entries applied
+        :rtype: int
+        """
+        return self._process_batch()[1]
+
+    def _process_batch(self):
+        entries = self._read_batch()
+        if not entries:
+            return 0, 0
+        partitions = self._partition(entries)
+        if len(partitions) == 1:
+            return len(entries), self._apply_partition(partitions[0])
+
+        applied = []
+        threads = [
+            threading.Thread(target=lambda p: applied.append(self._apply_partition(p)), args=(p,))
+            for p in partitions
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(entries), sum(applied)
+
+    def _read_batch(self):
+        """
+        :return: the oldest batch_size entries of the outbox whose key has no entry which failed \
+            max_attempts times
+        :rtype: list
+        """
+        table = self.Outbox.__table__
+        dead = table.alias('va_dead')
+        blocked = sa.exists().where(sa.and_(
+            dead.c.va_table == table.c.va_table,
+            dead.c.va_key == table.c.va_key,
+            dead.c.va_attempts >= self.max_attempts,
+        ))
+        session = self.Session()
+        try:
+            return session.execute(
+                sa.select([table]).
+                where(~blocked).
+                order_by(table.c.id).
+                limit(self.batch_size)
+            ).fetchall()
+        finally:
+            session.close()
+
+    def _partition(self, entries):
+        """
+        :return: a list of at most workers partitions, each a list of the entries of some keys \
+            grouped by key, in the order they were written
+        :rtype: list
+        """
+        by_key = OrderedDict()
+        for entry in entries:
+            by_key.setdefault((entry['va_table'], entry['va_key']), []).append(entry)
+        partitions = [[] for _ in range(max(1, min(self.workers, len(by_key))))]
+        for i, key_entries in enumerate(by_key.values()):
+            partitions[i % len(partitions)].append(key_entries)
+        return partitions
+
+    def _apply_partition(self, groups):
+        """
+        Applies the entries of groups in one transaction or, if that fails, each group in its own.
+
+        :return: the number of entries applied
+        :rtype: int
+        """
+        try:
+            self._apply([entry for group in groups for entry in group])
+            return sum(len(group) for group in groups)
+        except Exception:
+            log.exception('Failed to apply outbox entries, retrying them key by key')
+        applied = 0
+        for group in groups:
+            try:
+                self._apply(group)
+                applied += len(group)
+            except Exception:
+                log.exception('Failed to apply the outbox entries of a key')
+                self._record_failure(group)
+        return applied
+
+    def _record_failure(self, entries):
+        ids = [entry['id'] for entry in entries]
+        session = self.Session()
+        try:
+            session.execute(
+                sa.update(self.Outbox).
+                where(self.Outbox.id.in_(ids)).
+                values(va_attempts=self.Outbox.va_attempts + 1)
+            )
+            session.commit()
+        finally:
+            session.close()
+        if entries[0]['va_attempts'] + 1 >= self.max_attempts:
+            log.error('Giving up on outbox entries {} after {} attempts'.format(
+                ids, self.max_attempts))
+
+    def _apply(self, entries):
+        session = self.Session()
+        try:
+            batch = ArchiveBatch(session, use_outbox=False)
+            for entry in entries:
+                va_entry = entry['va_entry']
+                Model = _models_by_archive_table[entry['va_table']]
+                batch.add_data(
+                    Model,
+                    _decode_key(Model, va_entry['key']),
+                    va_entry['data'],
+                    deleted=va_entry['deleted'],
+                    user_id=va_entry['user_id'],
+                    track=va_entry['track'],
+                    updated_at=entry['va_updated_at'],
+                )
+            batch.execute()
+            ids = [entry['id'] for entry in entries]
+            for chunk in utils.chunked(ids, utils.IN_CLAUSE_CHUNK_SIZE):
+                session.execute(sa.delete(self.Outbox).where(self.Outbox.id.in_(chunk)))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def start(self):
+        """
+        Starts draining the outbox in a background thread.
+        """
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, drain=True):
+        """
+        Stops the background thread.
+
+        :param drain: if ``True``, applies the remaining entries before returning
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if drain:
+            self.drain()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                applied = self.drain()
+            except Exception:
+                log.exception('Failed to drain the outbox')
+                applied = 0
+            if not applied:
+                self._stopped.wait(self.poll_interval)
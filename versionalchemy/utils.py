@@ -1,38 +1,74 @@
 import datetime
+from decimal import Decimal
 import itertools
+import math
+import re
 import simplejson as json
+import uuid
+import zlib
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
 
 import sqlalchemy as sa
 from sqlalchemy import (
+    JSON,
+    LargeBinary,
     TypeDecorator,
     UnicodeText,
 )
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.engine.reflection import Inspector
 
-def compare_dicts(old_d, new_d):
+def compare_dicts(old_d, new_d, nested=False):
+    """
+    :param old_d: the dictionary before the change, or None if there was none
+    :param new_d: the dictionary after the change
+    :param nested: if ``True``, the change of a key whose old and new values are both \
+        dictionaries, and the old one is not empty, is the nested diff of the two, instead of \
+        both values
+
+    :return: a dictionary mapping each key whose value changed to a dictionary of its \
+    ``'prev'`` and ``'this'`` values. A key missing from one side has the value None on that \
+    side. Values are compared with ``==``, so they do not need to be hashable.
+    :rtype: dict
+    """
     if not old_d:
-        old_d = {}
-        for key in new_d.keys():
-            old_d[key]=None
-
-    changed_values_set = set.symmetric_difference(set(old_d.items()), set(new_d.items()))
+        return {k: {'prev': None, 'this': v} for k, v in new_d.items() if v is not None}
     changes = {}
-    for pair in list(changed_values_set):
-        if pair[0] not in changes:
-            changes[pair[0]] = {}
-        if pair[0] in new_d:
-            if pair[0] in old_d:
-                prev_or_this = 'this' if pair in new_d.items() else "prev"
-                changes[pair[0]][prev_or_this] = pair[1]
+    for k, old in old_d.items():
+        if k not in new_d:
+            changes[k] = {'prev': old, 'this': None}
+            continue
+        new = new_d[k]
+        if old != new:
+            # An empty old dictionary has no keys to nest the change under, and would lose
+            # the None values of new
+            if nested and old and isinstance(old, dict) and isinstance(new, dict):
+                changes[k] = compare_dicts(old, new, nested=True)
             else:
-                changes[pair[0]]['prev'] = None
-                changes[pair[0]]['this'] = pair[1]
-        elif pair[0] in old_d:
-            changes[pair[0]]['prev'] = pair[1]
-            changes[pair[0]]['this'] = None
+                changes[k] = {'prev': old, 'this': new}
+    for k, new in new_d.items():
+        if k not in old_d:
+            changes[k] = {'prev': None, 'this': new}
     return changes
 
-def compare_rows(old_r, new_r):
+
+def compare_rows(old_r, new_r, nested=False):
+    """
+    :param old_r: the archive row of the previous version, or None if there was none
+    :param new_r: the archive row of the version
+    :param nested: see :func:`compare_dicts`
+
+    :return: the versions and user ids of both rows and the changes between their data
+    :rtype: dict
+    """
     if not old_r:
         old_r = {}
         for key in new_r.keys():
@@ -42,9 +78,10 @@ def compare_rows(old_r, new_r):
         'va_version': new_r['va_version'],
         'prev_user_id': old_r['user_id'],
         'user_id': new_r['user_id'],
-        'change': compare_dicts(old_r['va_data'], new_r['va_data'])
+        'change': compare_dicts(old_r['va_data'], new_r['va_data'], nested=nested)
     }
 
+
 def result_to_dict(res):
     """
     :param res: :any:`sqlalchemy.engine.ResultProxy`
@@ -153,16 +190,238 @@ def get_column_names(table):
 def get_column_keys_and_names(table):
     '''
     Return a generator of tuples k, c such that k is the name of the python attribute for
-    the column and c is the name of the column in the sql table.
+    the column and c is the name of the column in the sql table. Attributes mapped to SQL
+    expressions (e.g. the va_version of registered models) are not columns of the table.
     '''
     ins = sa.inspect(table)
-    return ((k, c.name) for k, c in ins.mapper.c.items())
+    return ((k, c.name) for k, c in ins.mapper.c.items() if isinstance(c, sa.Column))
+
+
+class ColumnPlan(object):
+    """
+    The columns of a model which are archived, resolved once so rows can be serialized without
+    inspecting the mapper or looking up bind processors for every column of every row. A plan
+    only stays valid while the columns of the mapper do not change, see :meth:`is_current`.
+    """
+    __slots__ = (
+        'keys', 'names', 'ignored', 'archived', '_columns', '_types', '_bind_processors'
+    )
+
+    def __init__(self, Model, ignore=None):
+        """
+        :param Model: the sqlalchemy ORM model
+        :param ignore: the column attributes which are not archived
+        """
+        keys_and_names = tuple(get_column_keys_and_names(Model))
+        self._columns = tuple(sa.inspect(Model).mapper.columns)
+        self.keys = tuple(k for k, _ in keys_and_names)
+        self.names = tuple(c for _, c in keys_and_names)
+        self.ignored = frozenset(ignore or ())
+        self.archived = tuple((k, c) for k, c in keys_and_names if k not in self.ignored)
+        self._types = tuple(getattr(Model, k).type for k, _ in self.archived)
+        self._bind_processors = {}
+
+    def is_current(self, Model, ignore=None):
+        """
+        :return: True if the plan was built from the columns Model currently maps and from \
+            the same ignored columns, i.e. no column was added to or removed from the model since
+        :rtype: bool
+        """
+        columns = sa.inspect(Model).mapper.columns
+        if len(columns) != len(self._columns) or self.ignored != frozenset(ignore or ()):
+            return False
+        return all(a is b for a, b in zip(columns, self._columns))
+
+    def bind_processors(self, dialect):
+        """
+        :param dialect: a :py:class:`~sqlalchemy.engine.interfaces.Dialect` or None
+
+        :return: the bind processor of each archived column for dialect, or None where the \
+        value is used as is
+        :rtype: tuple
+        """
+        if dialect is None:
+            return (None,) * len(self.archived)
+        processors = self._bind_processors.get(dialect)
+        if processors is None:
+            processors = tuple(t.bind_processor(dialect) for t in self._types)
+            self._bind_processors[dialect] = processors
+        return processors
+
+    def to_dict(self, row, dialect, use_dirty=True):
+        """
+        Equivalent to calling :func:`get_column_attribute` for each archived column of row.
+
+        :return: a dictionary mapping each archived column name to its value in row
+        :rtype: dict
+        """
+        row_dict = {}
+        processors = self.bind_processors(dialect)
+        state = None if use_dirty else sa.inspect(row)
+        for (key, name), processor in zip(self.archived, processors):
+            value = getattr(row, key)
+            # Only attributes with a committed value saved aside can have changed
+            hist = state.attrs[key].history \
+                if state is not None and key in state.committed_state else None
+            if hist is not None and hist.has_changes():
+                if not hist.deleted:
+                    row_dict[name] = None
+                    continue
+                value = hist.deleted[0]
+            elif type(value) is tuple:
+                value = value[0]
+            row_dict[name] = value if processor is None else processor(value)
+        return row_dict
+
+    def values_to_dict(self, values, dialect):
+        """
+        :param values: a dictionary mapping each column attribute to its value
+
+        :return: a dictionary mapping each archived column name to its value
+        :rtype: dict
+        """
+        return {
+            name: values[key] if processor is None else processor(values[key])
+            for (key, name), processor in zip(self.archived, self.bind_processors(dialect))
+        }
 
 
 def get_dialect(session):
     return session.connection().dialect
 
 
+# Upper bound on the number of bound parameters placed in a single IN clause; this keeps
+# statements under SQLite's default SQLITE_MAX_VARIABLE_NUMBER of 999.
+IN_CLAUSE_CHUNK_SIZE = 900
+
+
+def chunked(seq, size):
+    '''
+    Return a generator of consecutive slices of seq, each of at most size elements.
+    '''
+    size = max(1, size)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def supports_tuple_in(dialect):
+    """
+    :param dialect: a :py:class:`~sqlalchemy.engine.interfaces.Dialect`
+
+    :return: True if the dialect supports ``(a, b) IN ((1, 2), (3, 4))`` comparisons.
+    :rtype: bool
+    """
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 15, 0)
+    return dialect.name in ('postgresql', 'mysql', 'oracle')
+
+
+def tuple_in(columns, values, dialect):
+    """
+    :param columns: a list of sqlalchemy columns
+    :param values: a list of tuples, each with one value per column
+    :param dialect: the :py:class:`~sqlalchemy.engine.interfaces.Dialect` the clause is \
+        compiled for
+
+    :return: a clause which is true for rows where the columns match one of the tuples in \
+    values. This is a tuple IN where the dialect supports it, else an or of ands.
+    """
+    if len(columns) == 1:
+        return columns[0].in_([value[0] for value in values])
+    if supports_tuple_in(dialect):
+        return sa.tuple_(*columns).in_(values)
+    return sa.or_(*(
+        sa.and_(*(column == v for column, v in zip(columns, value)))
+        for value in values
+    ))
+
+
+def select_by_keys(session, columns, keys, select_columns):
+    """
+    Reads the rows whose columns equal one of keys, with an IN query per chunk of keys.
+
+    Rows are matched back to keys by the values the database returns. A row whose values the
+    database normalized, e.g. a DECIMAL read back for a float, a CHAR padded with spaces or a
+    string in a case insensitive collation, is matched by looking up the remaining keys one at
+    a time, so the database compares them.
+
+    :param session: a sqlalchemy session
+    :param columns: a list of sqlalchemy columns
+    :param keys: a list of distinct tuples, each with one value per column
+    :param select_columns: a list of the sqlalchemy columns to read
+
+    :return: a dictionary mapping each key that has a row to a tuple of the row's values of \
+    select_columns
+    :rtype: dict
+    """
+    dialect = get_dialect(session)
+    labeled = [column.label('va_key_{}'.format(i)) for i, column in enumerate(columns)]
+    n = len(select_columns)
+    rows = {}
+    for chunk in chunked(keys, IN_CLAUSE_CHUNK_SIZE // len(columns)):
+        found = {}
+        for row in session.execute(
+            sa.select(list(select_columns) + labeled).where(tuple_in(columns, chunk, dialect))
+        ):
+            found[tuple(row[n:])] = tuple(row[:n])
+        unmatched = []
+        for key in chunk:
+            if key in found:
+                rows[key] = found.pop(key)
+            else:
+                unmatched.append(key)
+        # Rows left over were read for keys which compare equal only in the database
+        for key in unmatched:
+            if not found:
+                break
+            row = session.execute(
+                sa.select(list(select_columns) + labeled).
+                where(sa.and_(*(column == value for column, value in zip(columns, key))))
+            ).first()
+            if row is not None:
+                rows[key] = found.pop(tuple(row[n:]), tuple(row[:n]))
+    return rows
+
+
+def expire_by_keys(session, classes, col_names, keys, attribute_names=None):
+    """
+    Expires the instances in the session's identity map whose key is one of keys, e.g. after
+    their rows were written with set based statements, so they are loaded again.
+
+    :param session: a sqlalchemy session
+    :param classes: a class or tuple of classes whose instances are expired
+    :param col_names: the names of the key attributes, in the order of the values of keys
+    :param keys: a set of tuples, each with one value per name in col_names
+    :param attribute_names: the attributes to expire, or None for all of them
+    """
+    for instance in list(session.identity_map.values()):
+        if not isinstance(instance, classes):
+            continue
+        instance_dict = sa.orm.attributes.instance_dict(instance)
+        key = tuple(instance_dict.get(col_name) for col_name in col_names)
+        # An instance whose key is not loaded may have any key
+        if key in keys or not all(col_name in instance_dict for col_name in col_names):
+            session.expire(instance, attribute_names)
+
+
+def supports_window_functions(dialect):
+    """
+    :param dialect: a :py:class:`~sqlalchemy.engine.interfaces.Dialect`
+
+    :return: True if the dialect supports window functions, e.g. \
+    ``ROW_NUMBER() OVER (PARTITION BY ...)``.
+    :rtype: bool
+    """
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 25, 0)
+    if dialect.name == 'mysql':
+        version = dialect.server_version_info or ()
+        if getattr(dialect, '_is_mariadb', False):
+            return version >= (10, 2)
+        return version >= (8, 0)
+    return dialect.name in ('postgresql', 'oracle', 'mssql')
+
+
 def has_constraint(tbl_name, engine, *col_names):
     """
     :param tbl_name: a string with the name of the table to check
@@ -180,6 +439,26 @@ def has_constraint(tbl_name, engine, *col_names):
     return sorted(col_names) in constraints
 
 
+def has_index(tbl_name, engine, *col_names):
+    """
+    :param tbl_name: a string with the name of the table to check
+    :param engine: an instance of :class:`sa.engine.Engine` from which to execute the query
+    :param col_names: the names of the columns the index should start with, in order
+
+    :rtype: bool
+    :return: True if an index, unique constraint or primary key of tbl_name starts with the \
+    given columns, so lookups and range scans on them can use it
+    """
+    insp = Inspector.from_engine(engine)
+    col_names = list(col_names)
+    indexed = itertools.chain(
+        (x['column_names'] for x in insp.get_indexes(tbl_name)),
+        (x['column_names'] for x in insp.get_unique_constraints(tbl_name)),
+        [insp.get_pk_constraint(tbl_name)['constrained_columns']],
+    )
+    return any(list(columns[:len(col_names)]) == col_names for columns in indexed)
+
+
 def is_modified(row, ignore=None):
     if ignore is None:
         ignore = set()
@@ -207,32 +486,158 @@ class VAJSONEncoder(json.JSONEncoder):
         return super(VAJSONEncoder, self).default(obj)
 
 
+class SimpleJSONCodec(object):
+    """
+    Serializes JSON with simplejson and :class:`VAJSONEncoder`. This is the default codec.
+    """
+    name = 'simplejson'
+
+    def dumps(self, value):
+        return json.dumps(value, ensure_ascii=False, encoding='utf8', cls=VAJSONEncoder)
+
+    def loads(self, value):
+        return json.loads(value)
+
+
+_UUID_PATTERN = re.compile(b'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def _needs_fallback(value):
+    if isinstance(value, float):
+        return math.isinf(value) or math.isnan(value)
+    if isinstance(value, uuid.UUID):
+        return True
+    if isinstance(value, dict):
+        return any(_needs_fallback(k) or _needs_fallback(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return any(_needs_fallback(v) for v in value)
+    return False
+
+
+class OrjsonCodec(object):
+    """
+    Serializes JSON with `orjson <https://github.com/ijl/orjson>`_, which is several times
+    faster than simplejson at both encoding and decoding.
+
+    Datetimes and dates are written by the hook of :class:`VAJSONEncoder`. Values orjson cannot
+    handle (e.g. :class:`~decimal.Decimal`, integers wider than 64 bits or NaN and infinite
+    floats, which it would write as null) and values only orjson would accept (times, UUIDs,
+    dataclasses and numpy values) are passed to the fallback codec instead, so the fallback
+    decides how they are written or rejected. Enum members are the exception: orjson writes
+    their value, which simplejson rejects unless they are also ints or strings.
+    If orjson is not installed, every value goes to the fallback.
+    """
+    name = 'orjson'
+    options = 0 if orjson is None else (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME |
+        orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+    def __init__(self, fallback=None):
+        """
+        :param fallback: the codec used when orjson is unavailable or fails; defaults to \
+            :class:`SimpleJSONCodec`
+        """
+        self.fallback = fallback or SimpleJSONCodec()
+        self._default = VAJSONEncoder().default
+
+    def dumps(self, value):
+        if orjson is None:
+            return self.fallback.dumps(value)
+        try:
+            encoded = orjson.dumps(value, default=self._default, option=self.options)
+        except TypeError:
+            return self.fallback.dumps(value)
+        # orjson writes NaN and infinities as null and UUIDs as strings, so they are only looked
+        # for if the output has something they could have been written as
+        if (b'null' in encoded or _UUID_PATTERN.search(encoded)) and _needs_fallback(value):
+            return self.fallback.dumps(value)
+        return encoded.decode('utf8')
+
+    def loads(self, value):
+        if orjson is None:
+            return self.fallback.loads(value)
+        try:
+            return orjson.loads(value)
+        except ValueError:
+            return self.fallback.loads(value)
+
+
+CODECS = {
+    SimpleJSONCodec.name: SimpleJSONCodec,
+    OrjsonCodec.name: OrjsonCodec,
+}
+
+_default_codec = SimpleJSONCodec()
+
+
+def get_codec(codec=None):
+    """
+    :param codec: a codec, the name of one in :data:`CODECS`, or None for the default codec
+
+    :return: an object with ``dumps`` and ``loads`` methods converting between python values \
+    and JSON strings
+    """
+    if codec is None:
+        return _default_codec
+    if isinstance(codec, str):
+        if codec not in CODECS:
+            raise ValueError('Unknown codec {}'.format(codec))
+        return CODECS[codec]()
+    return codec
+
+
+def set_default_codec(codec):
+    """
+    Sets the codec used by JSON columns which were not given a codec of their own.
+
+    :param codec: a codec or the name of one in :data:`CODECS`; None restores \
+        :class:`SimpleJSONCodec`
+    """
+    global _default_codec
+    _default_codec = SimpleJSONCodec() if codec is None else get_codec(codec)
+
+
 class _JSONEncoded(TypeDecorator):
     """
     Does validation and serde on a JSON python type (list, dict, int, str) to
     a text based column in a SQL database. This class should be overriden for each
     primitive JSON type.
+
+    The serialization is done by a codec (see :func:`get_codec`). Columns which are not given a
+    codec use the default one at the time they are read or written, see
+    :func:`set_default_codec`.
     """
 
     impl = UnicodeText
     json_type = None
 
+    def __init__(self, *args, **kwargs):
+        """
+        :param codec: a codec or the name of one in :data:`CODECS`; by default the codec set \
+            with :func:`set_default_codec` is used.
+        """
+        codec = kwargs.pop('codec', None)
+        super(_JSONEncoded, self).__init__(*args, **kwargs)
+        self.codec = None if codec is None else get_codec(codec)
+
     def process_bind_param(self, value, dialect):
         if value is None:
             return None
-        elif isinstance(value, str):
-            value = json.loads(value)
+        codec = self.codec or _default_codec
+        if isinstance(value, str):
+            value = codec.loads(value)
 
         if self.json_type is not None and not isinstance(value, self.json_type):
             raise ValueError('value of type {} is not {}'.format(type(value), self.json_type))
 
-        return json.dumps(value, ensure_ascii=False, encoding='utf8', cls=VAJSONEncoder)
+        return codec.dumps(value)
 
     def process_result_value(self, value, dialect):
         if value is None:
             return None
 
-        value = json.loads(value)
+        value = (self.codec or _default_codec).loads(value)
         if self.json_type is not None and not isinstance(value, self.json_type):
             raise ValueError('value of type {} is not {}'.format(type(value), self.json_type))
 
@@ -245,3 +650,299 @@ class JSONEncodedList(_JSONEncoded):
 
 class JSONEncodedDict(_JSONEncoded):
     json_type = dict
+
+
+# The first byte of a value written by a compressed JSON type says how the rest is encoded.
+# Values starting with anything else are JSON text written before the column was compressed.
+HEADER_PLAIN = b'\x00'
+HEADER_ZLIB = b'\x01'
+HEADER_ZSTD = b'\x02'
+
+COMPRESSIONS = {
+    'zlib': HEADER_ZLIB,
+    'zstd': HEADER_ZSTD,
+}
+
+
+def compress(data, compression='zlib', threshold=0, level=None):
+    """
+    :param data: the bytes to compress
+    :param compression: one of :data:`COMPRESSIONS`
+    :param threshold: data shorter than this many bytes is stored as is
+    :param level: the compression level; defaults to the library's default
+
+    :return: data, prefixed with a header byte and compressed unless that would not make it \
+    shorter
+    :rtype: bytes
+    """
+    if len(data) < threshold:
+        return HEADER_PLAIN + data
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package')
+        body = zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    else:
+        body = zlib.compress(data, -1 if level is None else level)
+    if len(body) + 1 >= len(data):
+        return HEADER_PLAIN + data
+    return COMPRESSIONS[compression] + body
+
+
+def decompress(value):
+    """
+    :param value: bytes written by :func:`compress`, or uncompressed JSON text
+
+    :return: the original data
+    :rtype: bytes
+    """
+    value = bytes(value) if not isinstance(value, str) else value.encode('utf8')
+    header, body = value[:1], value[1:]
+    if header == HEADER_PLAIN:
+        return body
+    if header == HEADER_ZLIB:
+        return zlib.decompress(body)
+    if header == HEADER_ZSTD:
+        if zstandard is None:
+            raise ImportError('zstd compressed data requires the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(body)
+    return value
+
+
+class _CompressedJSONEncoded(_JSONEncoded):
+    """
+    Like :class:`_JSONEncoded`, but stores the JSON compressed in a binary column. Values
+    shorter than the threshold are stored uncompressed, and values written as JSON text (e.g.
+    before the column was converted from :class:`JSONEncodedDict`) are still read.
+    """
+
+    impl = LargeBinary
+
+    def __init__(self, *args, **kwargs):
+        """
+        :param compression: ``'zlib'`` (the default) or ``'zstd'``, which requires the \
+            zstandard package
+        :param threshold: JSON shorter than this many bytes is stored uncompressed
+        :param level: the compression level; defaults to the library's default
+        :param codec: the JSON codec, see :class:`_JSONEncoded`
+        """
+        self.compression = kwargs.pop('compression', 'zlib')
+        self.threshold = kwargs.pop('threshold', 256)
+        self.level = kwargs.pop('level', None)
+        if self.compression not in COMPRESSIONS:
+            raise ValueError('Unknown compression {}'.format(self.compression))
+        if self.compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package')
+        super(_CompressedJSONEncoded, self).__init__(*args, **kwargs)
+
+    def process_bind_param(self, value, dialect):
+        value = super(_CompressedJSONEncoded, self).process_bind_param(value, dialect)
+        if value is None:
+            return None
+        return compress(value.encode('utf8'), self.compression, self.threshold, self.level)
+
+    def result_processor(self, dialect, coltype):
+        # Skip the binary type's own processing, which fails on JSON text stored before the
+        # column was compressed
+        def process(value):
+            return self.process_result_value(value, dialect)
+        return process
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return super(_CompressedJSONEncoded, self).process_result_value(
+            decompress(value).decode('utf8'), dialect
+        )
+
+
+class CompressedJSONEncodedList(_CompressedJSONEncoded):
+    json_type = list
+
+
+class CompressedJSONEncodedDict(_CompressedJSONEncoded):
+    json_type = dict
+
+
+# Dialects with a native JSON type NativeJSONDict maps to, and whose JSON values can be
+# subscripted in SQL
+NATIVE_JSON_DIALECTS = ('postgresql', 'mysql', 'sqlite')
+
+
+class NativeJSONDict(TypeDecorator):
+    """
+    Stores a JSON dictionary in the dialect's native JSON type: JSONB on Postgres, JSON on
+    MySQL and JSON (the JSON1 extension) on SQLite. Other dialects store JSON text like
+    :class:`JSONEncodedDict`.
+
+    Values are serialized with the column's codec (see :func:`get_codec`), so datetimes are
+    stored the same way as in a text column. Unlike text columns, fields of the JSON can be
+    extracted in SQL; see :func:`json_field`.
+    """
+
+    impl = JSON
+    json_type = dict
+
+    def __init__(self, *args, **kwargs):
+        """
+        :param codec: a codec or the name of one in :data:`CODECS`; by default the codec set \
+            with :func:`set_default_codec` is used.
+        """
+        codec = kwargs.pop('codec', None)
+        super(NativeJSONDict, self).__init__(*args, **kwargs)
+        self.codec = None if codec is None else get_codec(codec)
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.JSONB())
+        if dialect.name in NATIVE_JSON_DIALECTS:
+            return dialect.type_descriptor(JSON())
+        return dialect.type_descriptor(UnicodeText())
+
+    def bind_processor(self, dialect):
+        # The native types accept JSON text, so serialize with the codec instead of the
+        # dialect's json_serializer
+        def process(value):
+            if value is None:
+                return None
+            codec = self.codec or _default_codec
+            if isinstance(value, str):
+                value = codec.loads(value)
+            if not isinstance(value, self.json_type):
+                raise ValueError('value of type {} is not {}'.format(type(value), self.json_type))
+            return codec.dumps(value)
+        return process
+
+    def result_processor(self, dialect, coltype):
+        # Some drivers (e.g. psycopg2) already decode JSON, the others return text
+        def process(value):
+            if value is None:
+                return None
+            if isinstance(value, (str, bytes)):
+                value = (self.codec or _default_codec).loads(value)
+            if not isinstance(value, self.json_type):
+                raise ValueError('value of type {} is not {}'.format(type(value), self.json_type))
+            return value
+        return process
+
+
+def supports_json_fields(column, dialect):
+    """
+    :param column: a column
+    :param dialect: a :py:class:`~sqlalchemy.engine.interfaces.Dialect`
+
+    :return: True if fields of the JSON in column can be extracted in SQL
+    :rtype: bool
+    """
+    return isinstance(column.type, NativeJSONDict) and dialect.name in NATIVE_JSON_DIALECTS
+
+
+def supports_text_json_fields(column, dialect):
+    """
+    :param column: a column
+    :param dialect: a :py:class:`~sqlalchemy.engine.interfaces.Dialect`
+
+    :return: True if column stores uncompressed JSON text written by one of the codecs of \
+    :data:`CODECS`, whose fields can be extracted in SQL from :func:`as_json` of it
+    :rtype: bool
+    """
+    column_type = column.type
+    if not isinstance(column_type, JSONEncodedDict) or dialect.name not in NATIVE_JSON_DIALECTS:
+        return False
+    return isinstance(column_type.codec or _default_codec, tuple(CODECS.values()))
+
+
+def as_json(column, dialect):
+    """
+    :param column: a column of type :class:`NativeJSONDict`, or one for which \
+        :func:`supports_text_json_fields` is True
+    :param dialect: the :py:class:`~sqlalchemy.engine.interfaces.Dialect` the expression is \
+        compiled for
+
+    :return: an expression of column which :func:`json_field` and :func:`json_value` can \
+    extract fields from
+    """
+    if isinstance(column.type, NativeJSONDict) or dialect.name == 'sqlite':
+        # SQLite's JSON functions read JSON text, and casting it AS JSON would make it a number
+        return column
+    return sa.cast(column, JSON)
+
+
+def supports_json_key(name, dialect):
+    """
+    :param name: a key of a JSON dictionary
+    :param dialect: a :py:class:`~sqlalchemy.engine.interfaces.Dialect`
+
+    :return: False if :func:`json_field` and :func:`json_value` can't extract name on dialect, \
+    i.e. if it contains a double quote, which SQLite's JSON paths have no escape for
+    :rtype: bool
+    """
+    return dialect.name != 'sqlite' or '"' not in name
+
+
+def _json_key(name, dialect):
+    """
+    :return: name escaped for the ``$."<name>"`` JSON path it is placed in on dialect
+    """
+    if dialect is None:
+        return name
+    if not supports_json_key(name, dialect):
+        raise ValueError("The JSON key {!r} can't be extracted on {}".format(name, dialect.name))
+    if dialect.name == 'mysql':
+        return name.replace('\\', '\\\\').replace('"', '\\"')
+    return name
+
+
+def json_field(column, name, dialect=None, column_type=None):
+    """
+    :param column: a column of type :class:`NativeJSONDict`, or the result of :func:`as_json`
+    :param name: the key to extract
+    :param dialect: the :py:class:`~sqlalchemy.engine.interfaces.Dialect` the expression is \
+        compiled for
+    :param column_type: the type of the column the value was archived from, if any
+
+    :return: an expression evaluating to the decoded value under name in the JSON of column, \
+    or None if it is missing
+    """
+    column = sa.type_coerce(column, JSON)
+    key = _json_key(name, dialect)
+    if dialect is not None and dialect.name == 'sqlite':
+        if dialect.dbapi.sqlite_version_info >= (3, 38, 0):
+            # JSON_EXTRACT turns true and false into 1 and 0, the -> operator keeps them as JSON
+            return column.op('->', return_type=JSON)(sa.literal('$."{}"'.format(key)))
+        if isinstance(column_type, sa.Boolean):
+            return column[key].as_boolean()
+    return column[key]
+
+
+def json_value(column, name, column_type, dialect):
+    """
+    :param column: a column of type :class:`NativeJSONDict`, or the result of :func:`as_json`
+    :param name: the key to extract
+    :param column_type: the type of the column the value was archived from
+    :param dialect: the :py:class:`~sqlalchemy.engine.interfaces.Dialect` the expression is \
+        compiled for
+
+    :return: an expression evaluating to the value under name in the JSON of column as a SQL \
+    value of column_type, e.g. to be inserted into a column of that type, or None if it is missing
+    """
+    field = sa.type_coerce(column, JSON)[_json_key(name, dialect)]
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        python_type = None
+    if python_type is bool:
+        return field.as_boolean()
+    if python_type is int:
+        return field.as_integer()
+    if python_type is float:
+        return field.as_float()
+    if python_type is Decimal:
+        # Extracted as text, a float would lose precision
+        return sa.cast(field.as_string(), column_type)
+    value = field.as_string()
+    if isinstance(column_type, sa.String):
+        return value
+    if dialect.name == 'sqlite':
+        # SQLite has no date types, its datetimes are text with a space before the time
+        return sa.func.replace(value, 'T', ' ') if python_type is datetime.datetime else value
+    return sa.cast(value, column_type)